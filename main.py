@@ -1,12 +1,14 @@
 import os
 import pandas as pd
+import shutil
 import sys
 import tkinter as tk
 import v2vml.configuration as conf
 import v2vml.ml as ml
-from v2vml.node import Node
 import v2vml.plots as plots
-from v2vml.simulation import Simulation
+from v2vml.simulation import create_simulation, gather_data, write_summary
+from v2vml.storage import cache_entry, cache_stage, extract_config, gather_config, is_cached, restore_stage, \
+    stage_fingerprint, train_config
 from v2vml.visualizer import Visualizer
 
 
@@ -40,7 +42,43 @@ def main():
 
 def start_mode_gather_data():
 
-    # clear the old data
+    outputs = {'raw_data': './data/raw_data'}
+
+    # the features are extracted while the data is gathered
+    if conf.GATHER_DATA_EXTRACT_FEATURES:
+        outputs['processed_data'] = './data/processed_data'
+
+    # a finished run has nothing to resume, and its files may be shared with the stage cache
+    resume = conf.GATHER_DATA_RESUME and (os.path.isfile('./data/raw_data/checkpoint.bin') or
+                                          os.path.isdir('./data/raw_data/shards'))
+
+    # the seed of a run without SEED is only known once it ran, so it is never in the cache
+    if not resume and conf.SEED is not None and \
+            restore_cached('gather', gather_config(conf.SEED), outputs, clear_gather_outputs):
+        return
+
+    # clear the old data, unless an interrupted run is being continued
+    if not resume:
+        clear_gather_outputs()
+
+    # run the simulation(s) for n epochs
+    summary = gather_data('./data/raw_data', './data/processed_data')
+
+    # brief summary
+    write_summary('./data/raw_data/summary.txt', summary)
+
+    save_cached('gather', gather_config(summary['seed']), outputs)
+
+
+def clear_gather_outputs():
+
+    clear_raw_data()
+
+    if conf.GATHER_DATA_EXTRACT_FEATURES:
+        clear_processed_data()
+
+
+def clear_raw_data():
 
     for i in os.listdir('./data/raw_data/good'):
         os.remove('./data/raw_data/good/' + i)
@@ -51,54 +89,124 @@ def start_mode_gather_data():
     for i in os.listdir('./data/raw_data/malicious'):
         os.remove('./data/raw_data/malicious/' + i)
 
-    # run the simulation for n epochs
+    if os.path.isdir('./data/raw_data/store'):
+        shutil.rmtree('./data/raw_data/store')
 
-    sim = Simulation(conf.NUM_INITIAL_NODES)
+    if os.path.isdir('./data/raw_data/features'):
+        shutil.rmtree('./data/raw_data/features')
 
-    for i in range(conf.GATHER_DATA_NUM_EPOCHS):
+    # leftovers from an interrupted run
+    if os.path.isdir('./data/raw_data/shards'):
+        shutil.rmtree('./data/raw_data/shards')
 
-        if sim.epoch % 100 == 0:
-            print('epoch {}...'.format(sim.epoch))
+    if os.path.isfile('./data/raw_data/checkpoint.bin'):
+        os.remove('./data/raw_data/checkpoint.bin')
 
-        sim.next_epoch()
+    if os.path.isfile('./data/raw_data/summary.txt'):
+        os.remove('./data/raw_data/summary.txt')
 
-    print('epoch', sim.epoch)
-    sim.close_node_files()
 
-    # brief summary
-    with open('./data/raw_data/summary.txt', 'w') as summary:
-        summary.write('Num epochs:' + str(conf.GATHER_DATA_NUM_EPOCHS) + '\n')
-        summary.write('Num good:' + str(sim.lifetime_good_nodes) + '\n')
-        summary.write('Num faulty:' + str(sim.lifetime_faulty_nodes) + '\n')
-        summary.write('Num malicious:' + str(sim.lifetime_malicious_nodes) + '\n')
+def start_mode_extract_features():
 
+    outputs = {'processed_data': './data/processed_data'}
+    config = extract_config('./data/raw_data')
 
-def start_mode_extract_features():
+    if restore_cached('extract', config, outputs, clear_processed_data):
+        return
 
     # clear the features
-
-    for i in os.listdir('./data/processed_data'):
-        os.remove('./data/processed_data/' + i)
+    clear_processed_data()
 
     # extract features
+    ml.extract_features('./data/raw_data', './data/processed_data')
 
-    for i in os.listdir('./data/raw_data/good'):
-        ml.features_from_file(i, './data/raw_data/good/' + i, Node.GOOD)
+    save_cached('extract', config, outputs)
 
-    for i in os.listdir('./data/raw_data/faulty'):
-        ml.features_from_file(i, './data/raw_data/faulty/' + i, Node.FAULTY)
 
-    for i in os.listdir('./data/raw_data/malicious'):
-        ml.features_from_file(i, './data/raw_data/malicious/' + i, Node.MALICIOUS)
+# removes the features, including the ones of other sample sizes
+def clear_processed_data():
 
+    for i in os.listdir('./data/processed_data'):
+        if os.path.isdir('./data/processed_data/' + i):
+            shutil.rmtree('./data/processed_data/' + i)
+        else:
+            os.remove('./data/processed_data/' + i)
 
+
+# the report is written to ./data/test_models_report.txt as well
 def start_mode_test_models():
-    ml.test_models()
+
+    outputs = {'report.txt': './data/test_models_report.txt'}
+    config = train_config('test', './data/processed_data')
+
+    # the splits of a run without SEED can not be repeated
+    if conf.SEED is not None and restore_cached('test', config, outputs, clear_test_report):
+        with open('./data/test_models_report.txt') as in_file:
+            print(in_file.read(), end='')
+        return
+
+    report = ml.test_models()
+
+    clear_test_report()
+    with open('./data/test_models_report.txt', 'w') as out_file:
+        out_file.write(report)
+
+    if conf.SEED is not None:
+        save_cached('test', config, outputs)
 
 
 def start_mode_export_models():
+
+    outputs = {'models': './data/models'}
+    config = train_config('export', './data/processed_data')
+
+    # the split of a run without SEED can not be repeated
+    if conf.SEED is not None and restore_cached('export', config, outputs, clear_models):
+        return
+
     ml.export_models('./data/models')
 
+    if conf.SEED is not None:
+        save_cached('export', config, outputs)
+
+
+def clear_test_report():
+    if os.path.isfile('./data/test_models_report.txt'):
+        os.remove('./data/test_models_report.txt')
+
+
+def clear_models():
+    for i in os.listdir('./data/models'):
+        os.remove('./data/models/' + i)
+
+
+# with CACHE_STAGES, replaces the outputs of a stage with the ones in the stage cache, if it is there
+# clear: removes the outputs, files are removed before the cached ones are linked in their place, and stages write
+#        new files instead of writing to the old ones, so the cache is never written to through a link
+# returns: True if the outputs were taken from the cache and the stage does not need to run
+def restore_cached(stage, config, outputs, clear) -> bool:
+
+    if not conf.CACHE_STAGES:
+        return False
+
+    fingerprint = stage_fingerprint(config)
+    if not is_cached(stage, fingerprint):
+        return False
+
+    clear()
+    restore_stage(stage, fingerprint, outputs)
+    print('Stage {} was not run, its outputs were taken from the cache in {}'
+          .format(stage, cache_entry(stage, fingerprint)))
+    print('Set CACHE_STAGES to False, or clear the cache, if the code of the stage changed since')
+
+    return True
+
+
+# with CACHE_STAGES, adds the outputs of a stage that just ran to the stage cache
+def save_cached(stage, config, outputs):
+    if conf.CACHE_STAGES:
+        cache_stage(stage, stage_fingerprint(config), config, outputs)
+
 
 def start_mode_visualize():
 
@@ -111,7 +219,7 @@ def start_mode_visualize():
     canvas = tk.Canvas(root, width=conf.CANVAS_WIDTH, height=conf.CANVAS_HEIGHT, bg=Visualizer.COLOR_BACKGROUND)
 
     # create our simulation data
-    sim = Simulation(conf.NUM_INITIAL_NODES)
+    sim = create_simulation(conf.NUM_INITIAL_NODES)
 
     # has functions for drawing our simulation onto the canvas
     viz = Visualizer(root, canvas, sim)
@@ -1,6 +1,7 @@
 import v2vml.configuration as conf
 import v2vml.globals as g
 import math
+import numpy as np
 
 
 # checks to see if a point is off the canvas
@@ -12,6 +13,25 @@ def is_point_out(x, y) -> bool:
     return False
 
 
+# for a node driving in a straight line, the first and last epoch (counted from when it was created)
+# where the point is on the canvas. if last < first, the node is never on the canvas
+# coord: position along the direction of travel when the node was created
+# velocity: change in coord per epoch
+# length: width or height of the canvas along the direction of travel
+# works on ints and numpy arrays
+def epochs_on_canvas(coord, velocity, length) -> tuple:
+
+    speed = np.abs(velocity)
+
+    # distance driven into the canvas, measured from the edge the node enters through
+    dist = np.where(velocity > 0, coord, length - coord)
+
+    first = np.maximum(0, -(dist // speed))
+    last = (length - dist) // speed
+
+    return first, last
+
+
 def distance(x1, y1, x2, y2):
 
     # This is the distance formula
@@ -10,14 +10,122 @@ MODE_VISUALIZE = 4
 MODE_PLOTS = 5
 MODE = MODE_VISUALIZE
 
+# CACHE
+##########################################################
+
+# keep the outputs of every stage (gather data, extract features, test and export models) in CACHE_DIR
+# a stage that already ran with the same configuration and inputs takes its outputs from there instead of running again
+# changes to the code are not seen unless STAGE_VERSIONS (v2vml/storage/cache.py) or FEATURE_VERSION
+# (v2vml/ml/preprocessing.py) is bumped, so turn this off, or clear the cache, while working on a stage
+# the cache is cleared with v2vml.storage.clear_cache() or by deleting CACHE_DIR
+CACHE_STAGES = False
+CACHE_DIR = './data/cache'
+
+# most entries kept for each stage, the ones used the longest time ago are removed first, None keeps all of them
+CACHE_MAX_ENTRIES = 5
+
 # MODE_GATHER_DATA
 ##########################################################
 GATHER_DATA_NUM_EPOCHS = 1000
 
+# number of independent simulations, each one runs for GATHER_DATA_NUM_EPOCHS epochs with its own seed
+# their data is merged into a single data set with unique node ids
+GATHER_DATA_NUM_SHARDS = 1
+
+# number of processes running shards at the same time, None uses every core
+# the data does not depend on the number of processes
+GATHER_DATA_NUM_WORKERS = None
+
+# epochs between checkpoints, 0 to never write one
+# each simulation writes checkpoint.bin to the directory it writes its node files to
+# SIM_ENGINE_TILED can not be checkpointed, it needs 0
+GATHER_DATA_CHECKPOINT_INTERVAL = 0
+
+# continue from the checkpoints of an interrupted run instead of starting over
+GATHER_DATA_RESUME = False
+
+# extract the features while the simulation runs and write them to processed_data, MODE_EXTRACT_FEATURES is not needed
+GATHER_DATA_EXTRACT_FEATURES = False
+
+# GATHER_DATA_EXTRACT_FEATURES: write the raw data as well, see RAW_DATA_FORMAT
+GATHER_DATA_WRITE_RAW_DATA = True
+
+# how the raw data is stored
+# RAW_DATA_FORMAT_CSV: one csv file per node, raw_data/<type>/Node_<id>.csv
+# RAW_DATA_FORMAT_COLUMNAR: every record in a few large npz files, raw_data/store/
+# RAW_DATA_FORMAT_TRAJECTORY: same as RAW_DATA_FORMAT_COLUMNAR, but the records are encoded and compressed
+RAW_DATA_FORMAT_CSV = 0
+RAW_DATA_FORMAT_COLUMNAR = 1
+RAW_DATA_FORMAT_TRAJECTORY = 2
+RAW_DATA_FORMAT = RAW_DATA_FORMAT_CSV
+
+# RAW_DATA_FORMAT_COLUMNAR, RAW_DATA_FORMAT_TRAJECTORY: records collected in memory before they are written as one file
+RAW_DATA_CHUNK_RECORDS = 1000000
+
+# RAW_DATA_FORMAT_TRAJECTORY: zlib is faster, lzma makes smaller files
+RAW_DATA_COMPRESSION_ZLIB = 0
+RAW_DATA_COMPRESSION_LZMA = 1
+RAW_DATA_COMPRESSION = RAW_DATA_COMPRESSION_ZLIB
+
+# epochs of records that may wait for the background thread that writes them, 0 writes them on the simulation's thread
+# the simulation waits for the thread once this many are waiting
+RAW_DATA_WRITER_QUEUE_SIZE = 8
+
+# MODE_EXTRACT_FEATURES
+##########################################################
+
+# how the features are stored
+# PROCESSED_DATA_FORMAT_CSV: one csv file per node, processed_data/Node_<id>.csv
+# PROCESSED_DATA_FORMAT_STORE: every sample in one set of memory mappable files, processed_data/{features,labels,groups}.npy
+PROCESSED_DATA_FORMAT_CSV = 0
+PROCESSED_DATA_FORMAT_STORE = 1
+PROCESSED_DATA_FORMAT = PROCESSED_DATA_FORMAT_STORE
+
+# number of processes extracting features at the same time, None uses every core, 1 extracts them in this process
+EXTRACT_FEATURES_NUM_WORKERS = None
+
+# nodes handed to a process at a time, larger chunks cost less overhead for small node files
+EXTRACT_FEATURES_CHUNK_SIZE = 64
+
+# sample sizes to extract features for, every node is read once for all of them, ex: list(range(3, 11))
+# None for only g.SAMPLE_SIZE, see sample_size_dir() for where the features of each size are written
+EXTRACT_FEATURES_SAMPLE_SIZES = None
+
+# rows between the starts of two samples of a node, smaller than the sample size for samples that overlap
+# None for samples that do not overlap, also used by GATHER_DATA_EXTRACT_FEATURES
+EXTRACT_FEATURES_STRIDE = None
+
 # MODE_TRAIN_MODELS
 ##########################################################
+
+# most iterations of MODE_TEST_MODELS
 TRAIN_MODELS_NUM_TESTS = 100
 
+# stop once the confidence interval of the accuracy and of the recall of every node type is narrower than this,
+# for every model, ex: 0.01 is the mean +/- 0.005, None always runs TRAIN_MODELS_NUM_TESTS iterations
+TRAIN_MODELS_CI_WIDTH = 0.01
+
+# TRAIN_MODELS_CI_WIDTH: fewest iterations, the confidence intervals of only a few iterations can not be trusted
+TRAIN_MODELS_MIN_TESTS = 10
+
+# TRAIN_MODELS_CI_WIDTH: confidence level of the intervals
+TRAIN_MODELS_CI_LEVEL = 0.95
+
+# number of processes training and testing models at the same time, None uses every core, 1 tests them in this process
+# each iteration is one task, its split is made once for all of the models, the report does not depend on the number
+# of processes
+TRAIN_MODELS_NUM_WORKERS = None
+
+# train the models a chunk of samples at a time, so the features do not have to fit into memory
+# needs PROCESSED_DATA_FORMAT_STORE, only STREAMING_MODELS are tested and exported
+TRAIN_MODELS_STREAMING = False
+
+# TRAIN_MODELS_STREAMING: samples read from the feature store at a time
+TRAIN_MODELS_CHUNK_ROWS = 100000
+
+# TRAIN_MODELS_STREAMING: passes over the train samples for models that learn a bit more with every pass (ex: SGD)
+TRAIN_MODELS_STREAMING_PASSES = 5
+
 # TKINTER
 ##########################################################
 
@@ -51,6 +159,47 @@ SIM_MODE = SIM_AUTO
 # time to wait in SIM_AUTO
 SIM_EPOCH_WAIT_TIME = 0.25
 
+# master seed for the random numbers used by the simulation
+# None picks a new seed every run, gather data runs write the seed they used to summary.txt
+SEED = None
+
+# simulation engine
+# SIM_ENGINE_OBJECT: one Node object per vehicle, updated one at a time
+# SIM_ENGINE_VECTOR: all vehicles are stored in numpy arrays and updated together
+# SIM_ENGINE_TILED: the canvas is split into SIM_NUM_TILES strips, each updated by its own process
+SIM_ENGINE_OBJECT = 0
+SIM_ENGINE_VECTOR = 1
+SIM_ENGINE_TILED = 2
+SIM_ENGINE = SIM_ENGINE_OBJECT
+
+# SIM_ENGINE_TILED: number of tiles (and worker processes)
+# each tile must be at least as wide as the fastest node moves in an epoch
+SIM_NUM_TILES = 4
+
+# SIM_ENGINE_TILED: nodes a single tile can hold
+# None for twice an even share of NUM_INITIAL_NODES plus some room
+SIM_TILE_CAPACITY = None
+
+# how nodes find their neighbors
+# NEIGHBOR_FINDER_BRUTE_FORCE: compare every node with every other node
+# NEIGHBOR_FINDER_GRID: only compare nodes in nearby cells of a uniform grid
+# NEIGHBOR_FINDER_KD_TREE: use scipy's KD-tree
+NEIGHBOR_FINDER_BRUTE_FORCE = 0
+NEIGHBOR_FINDER_GRID = 1
+NEIGHBOR_FINDER_KD_TREE = 2
+NEIGHBOR_FINDER = NEIGHBOR_FINDER_GRID
+
+# how neighbors are kept up to date
+# NEIGHBOR_MODE_REBUILD: find every neighbor from scratch each epoch
+# NEIGHBOR_MODE_INCREMENTAL: keep the neighbor graph between epochs and publish the links that changed
+NEIGHBOR_MODE_REBUILD = 0
+NEIGHBOR_MODE_INCREMENTAL = 1
+NEIGHBOR_MODE = NEIGHBOR_MODE_REBUILD
+
+# NEIGHBOR_MODE_INCREMENTAL: epochs between searches for nearby nodes
+# larger values search less often but check more pairs each epoch
+NEIGHBOR_SKIN_EPOCHS = 2
+
 # NODE
 ##########################################################
 
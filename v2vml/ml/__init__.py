@@ -1,5 +1,9 @@
 from .export import *
+from .extract import *
+from .feature_store import *
 from .load import *
 from .metrics import *
+from .models import *
 from .preprocessing import *
+from .streaming import *
 from .testing import *
@@ -0,0 +1,160 @@
+import multiprocessing
+import numpy as np
+import os
+import pandas as pd
+import v2vml.configuration as conf
+import v2vml.globals as g
+from v2vml.ml.feature_store import NUM_FEATURES, FeatureStoreWriter
+import v2vml.ml.preprocessing as pre
+from v2vml.node import Node
+from v2vml.storage.store import RawDataStore
+
+
+# sub directory of each node type in raw_data_dir
+NODE_TYPE_DIRS = [('good', Node.GOOD), ('faulty', Node.FAULTY), ('malicious', Node.MALICIOUS)]
+
+# the raw data store of the process, see open_raw_data()
+raw_data_store = None
+
+
+# extracts the features of every node in raw_data_dir and writes them to a feature store per sample size,
+# or a feature file per node and sample size, see PROCESSED_DATA_FORMAT and sample_size_dir()
+# the nodes are split into tasks of EXTRACT_FEATURES_CHUNK_SIZE nodes, which run on a pool of
+# EXTRACT_FEATURES_NUM_WORKERS processes
+# sample_sizes: None for EXTRACT_FEATURES_SAMPLE_SIZES
+# returns: (file name, error) of every node whose features could not be extracted
+def extract_features(raw_data_dir='./data/raw_data', processed_data_dir='./data/processed_data',
+                     sample_sizes=None) -> list:
+
+    if sample_sizes is None:
+        sample_sizes = conf.EXTRACT_FEATURES_SAMPLE_SIZES or [g.SAMPLE_SIZE]
+
+    if min(sample_sizes) < 3:
+        raise ValueError('sample sizes must be greater than 2, got {}'.format(sample_sizes))
+
+    # (sample size, directory of its feature files)
+    outputs = [(sample_size, sample_size_dir(processed_data_dir, sample_size)) for sample_size in sample_sizes]
+    for _, out_dir in outputs:
+        os.makedirs(out_dir, exist_ok=True)
+
+    # (node id, node file or node id, node type) of every node
+    if conf.RAW_DATA_FORMAT == conf.RAW_DATA_FORMAT_CSV:
+        nodes = [(int(file[len('Node_'):-len('.csv')]), '{}/{}/{}'.format(raw_data_dir, type_dir, file), node_type)
+                 for type_dir, node_type in NODE_TYPE_DIRS
+                 for file in os.listdir('{}/{}'.format(raw_data_dir, type_dir))]
+        store_dir = None
+
+    # nodes that are next to each other in the store are kept in the same task, so they share chunk reads
+    else:
+        nodes = [(node_id, node_id, node_type) for node_id, node_type in RawDataStore(raw_data_dir).nodes_in_chunk_order()]
+        store_dir = raw_data_dir
+
+    # the workers hand the features of the feature stores back, the stores are written here
+    to_store = conf.PROCESSED_DATA_FORMAT == conf.PROCESSED_DATA_FORMAT_STORE
+
+    chunk_size = conf.EXTRACT_FEATURES_CHUNK_SIZE
+    tasks = [(outputs, conf.EXTRACT_FEATURES_STRIDE, to_store, nodes[i:i + chunk_size])
+             for i in range(0, len(nodes), chunk_size)]
+
+    feature_stores = [FeatureStoreWriter(out_dir) for _, out_dir in outputs] if to_store else []
+
+    failures = []
+    num_done = 0
+    percent_done = -1
+
+    pool = None
+    if conf.EXTRACT_FEATURES_NUM_WORKERS == 1:
+        open_raw_data(store_dir)
+        results = map(extract_chunk, tasks)
+    else:
+        pool = multiprocessing.Pool(conf.EXTRACT_FEATURES_NUM_WORKERS, initializer=open_raw_data, initargs=(store_dir,))
+        results = pool.imap(extract_chunk, tasks)
+
+    try:
+        for num_nodes, chunk_failures, chunk_features in results:
+
+            num_done += num_nodes
+            failures += chunk_failures
+
+            for feature_store, columns in zip(feature_stores, chunk_features):
+                feature_store.append(*columns)
+
+            for file_name, error in chunk_failures:
+                print('Failed to extract features from {}: {}'.format(file_name, error))
+
+            if num_done * 100 // len(nodes) != percent_done:
+                percent_done = num_done * 100 // len(nodes)
+                print('Extracted features from {}/{} nodes ({}%)'.format(num_done, len(nodes), percent_done))
+
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+        for feature_store in feature_stores:
+            feature_store.close()
+
+    print('Extracted features from {} nodes, {} failed'.format(len(nodes) - len(failures), len(failures)))
+
+    return failures
+
+
+# the features of g.SAMPLE_SIZE, which the models are trained with, are written to processed_data_dir itself
+# the features of other sample sizes are written to processed_data_dir/sample_size_<size>/
+def sample_size_dir(processed_data_dir, sample_size) -> str:
+
+    if sample_size == g.SAMPLE_SIZE:
+        return processed_data_dir
+
+    return '{}/sample_size_{}'.format(processed_data_dir, sample_size)
+
+
+# runs once in every process
+# store_dir: raw_data_dir of a RawDataStore, None for node files
+def open_raw_data(store_dir):
+
+    global raw_data_store
+    raw_data_store = None if store_dir is None else RawDataStore(store_dir)
+
+
+# returns: (number of nodes, failures, features) of the task
+#          features: to_store, (features, labels, groups) of every sample size, see FeatureStoreWriter.append()
+def extract_chunk(task) -> tuple:
+
+    outputs, stride, to_store, nodes = task
+
+    failures = []
+    frames = [[] for _ in outputs]
+    for node_id, source, node_type in nodes:
+
+        file_name = 'Node_{}.csv'.format(node_id)
+
+        # an error only costs the features of the node it happened on
+        try:
+            raw = pd.read_csv(source) if raw_data_store is None else raw_data_store.read_node(source)
+
+            node_frames = []
+            for sample_size, out_dir in outputs:
+                df = pre.node_features(raw, node_type, sample_size, stride)
+                if df is not None and not to_store:
+                    pre.write_features(out_dir + '/' + file_name, df)
+                node_frames.append(df)
+
+        except Exception as e:
+            failures.append((file_name, '{}: {}'.format(type(e).__name__, e)))
+            continue
+
+        if to_store:
+            for size_frames, df in zip(frames, node_frames):
+                if df is not None:
+                    size_frames.append((node_id, df.to_numpy(dtype=np.float64)))
+
+    features = []
+    if to_store:
+        for size_frames in frames:
+            data = np.concatenate([rows for _, rows in size_frames]) if size_frames else np.zeros((0, NUM_FEATURES + 1))
+            groups = np.concatenate([np.full(len(rows), node_id) for node_id, rows in size_frames]) \
+                if size_frames else np.zeros(0, dtype=np.int64)
+            features.append((data[:, :-1], data[:, -1], groups))
+
+    return len(nodes), failures, features
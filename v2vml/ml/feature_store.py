@@ -0,0 +1,213 @@
+import numpy as np
+import os
+import pandas as pd
+from typing import List
+import v2vml.ml.preprocessing as pre
+
+
+# the features of every node in a single place, instead of one csv file per node
+#   features.npy: float32 matrix, one row per sample with the features of get_feature_header() except Type
+#   labels.npy: int8 node type of every sample
+#   groups.npy: int64 id of the node every sample came from, the samples of a node are next to each other
+# the files are plain .npy files, so they can be memory mapped instead of read
+FEATURE_STORE_COLUMNS = [('features', np.float32), ('labels', np.int8), ('groups', np.int64)]
+
+# features per sample, without Type
+NUM_FEATURES = len(pre.get_feature_header()) - 1
+
+# rows copied at a time when the store is finished or merged
+COPY_ROWS = 1000000
+
+
+def feature_store_path(processed_data_dir, name) -> str:
+    return '{}/{}.npy'.format(processed_data_dir, name)
+
+
+def has_feature_store(processed_data_dir) -> bool:
+    return all(os.path.isfile(feature_store_path(processed_data_dir, name)) for name, _ in FEATURE_STORE_COLUMNS)
+
+
+# shape of a column with num_rows rows
+def column_shape(name, num_rows) -> tuple:
+    return (num_rows, NUM_FEATURES) if name == 'features' else (num_rows,)
+
+
+# reads the feature store in processed_data_dir
+class FeatureStore:
+
+    # mmap: map the files into memory instead of reading them, the arrays are read-only and nothing is copied
+    def __init__(self, processed_data_dir, mmap=True):
+
+        mmap_mode = 'r' if mmap else None
+
+        self.features = np.load(feature_store_path(processed_data_dir, 'features'), mmap_mode=mmap_mode)
+        self.labels = np.load(feature_store_path(processed_data_dir, 'labels'), mmap_mode=mmap_mode)
+        self.groups = np.load(feature_store_path(processed_data_dir, 'groups'), mmap_mode=mmap_mode)
+
+    def __len__(self) -> int:
+        return len(self.labels)
+
+    # returns: the first row of every node and, at the end, the number of rows
+    # the groups are read COPY_ROWS rows at a time, so only the offsets are kept in memory
+    def node_offsets(self) -> np.ndarray:
+
+        if len(self) == 0:
+            return np.zeros(1, dtype=np.int64)
+
+        starts = [np.zeros(1, dtype=np.int64)]
+        for start in range(1, len(self), COPY_ROWS):
+            groups = self.groups[start - 1:start + COPY_ROWS]
+            starts.append(np.flatnonzero(groups[1:] != groups[:-1]) + start)
+        starts.append(np.array([len(self)]))
+
+        return np.concatenate(starts)
+
+    # returns: one dataframe per node, with the same columns as the node's csv feature file
+    def node_frames(self) -> List[pd.DataFrame]:
+
+        offsets = self.node_offsets()
+        data = np.column_stack((self.features.astype(np.float64), self.labels.astype(np.float64)))
+
+        return [pd.DataFrame(data[start:end], columns=pre.get_feature_header())
+                for start, end in zip(offsets[:-1], offsets[1:])]
+
+
+# adds samples to the feature store in processed_data_dir
+# the rows are appended to <name>.part files, which close() turns into the .npy files
+class FeatureStoreWriter:
+
+    # num_rows: rows written before that are kept, later ones are removed (ex: when a run is resumed)
+    #           the rows are taken from the .npy files if the store was closed since
+    def __init__(self, processed_data_dir, num_rows=0):
+
+        self.processed_data_dir = processed_data_dir
+        os.makedirs(processed_data_dir, exist_ok=True)
+
+        self.num_rows = num_rows
+        self.files = {}
+
+        reopen = num_rows > 0 and has_feature_store(processed_data_dir) and \
+            not all(os.path.isfile(self.part_path(name)) for name, _ in FEATURE_STORE_COLUMNS)
+
+        for name, dtype in FEATURE_STORE_COLUMNS:
+
+            path = self.part_path(name)
+            part_file = open(path, 'r+b' if os.path.isfile(path) and not reopen else 'wb')
+
+            if reopen:
+                column = np.load(feature_store_path(processed_data_dir, name), mmap_mode='r')
+                for start in range(0, num_rows, COPY_ROWS):
+                    part_file.write(np.ascontiguousarray(column[start:min(start + COPY_ROWS, num_rows)]).tobytes())
+                del column
+
+            part_file.truncate(int(np.prod(column_shape(name, num_rows))) * np.dtype(dtype).itemsize)
+            part_file.seek(0, os.SEEK_END)
+            self.files[name] = part_file
+
+    def part_path(self, name) -> str:
+        return '{}/{}.part'.format(self.processed_data_dir, name)
+
+    # features: (samples, NUM_FEATURES) matrix, labels and groups: one value per sample
+    def append(self, features, labels, groups):
+
+        columns = {'features': features, 'labels': labels, 'groups': groups}
+        for name, dtype in FEATURE_STORE_COLUMNS:
+            self.files[name].write(np.ascontiguousarray(columns[name], dtype=dtype).tobytes())
+
+        self.num_rows += len(labels)
+
+    # appends the features of a node, see features_from_array()
+    def append_frame(self, df: pd.DataFrame, node_id):
+
+        data = df.to_numpy(dtype=np.float64)
+        self.append(data[:, :-1], data[:, -1], np.full(len(data), node_id))
+
+    # writes the rows to disk, returns: the number of rows
+    def flush(self) -> int:
+
+        for part_file in self.files.values():
+            part_file.flush()
+
+        return self.num_rows
+
+    # turns the .part files into the .npy files of the store
+    def close(self):
+
+        for name, dtype in FEATURE_STORE_COLUMNS:
+
+            self.files[name].close()
+
+            shape = column_shape(name, self.num_rows)
+            tmp_path = feature_store_path(self.processed_data_dir, name) + '.tmp'
+
+            out = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=dtype, shape=shape)
+            if self.num_rows > 0:
+                part = np.memmap(self.part_path(name), dtype=dtype, mode='r', shape=shape)
+                for start in range(0, self.num_rows, COPY_ROWS):
+                    out[start:start + COPY_ROWS] = part[start:start + COPY_ROWS]
+                del part
+
+            out.flush()
+            del out
+
+            os.replace(tmp_path, feature_store_path(self.processed_data_dir, name))
+            os.remove(self.part_path(name))
+
+        self.files = {}
+
+
+# appends the store in src_dir to writer, adding id_offset to its node ids
+def append_feature_store(writer, src_dir, id_offset):
+
+    store = FeatureStore(src_dir)
+    for start in range(0, len(store), COPY_ROWS):
+        rows = slice(start, start + COPY_ROWS)
+        writer.append(store.features[rows], store.labels[rows], store.groups[rows] + id_offset)
+
+
+# moves the store in src_dir to dst_dir
+def move_feature_store(src_dir, dst_dir):
+    for name, _ in FEATURE_STORE_COLUMNS:
+        os.replace(feature_store_path(src_dir, name), feature_store_path(dst_dir, name))
+
+
+# returns: the features of every node in processed_data_dir, one dataframe per node
+# the feature store is used if there is one, otherwise the csv files, sub directories (ex: the features of other
+# sample sizes) are skipped
+def load_node_features(processed_data_dir='./data/processed_data') -> List[pd.DataFrame]:
+
+    if has_feature_store(processed_data_dir):
+        print('Loading in features for {}'.format(processed_data_dir))
+        return FeatureStore(processed_data_dir).node_frames()
+
+    node_features = []
+
+    for file in os.listdir(processed_data_dir):
+
+        file_path = '{}/{}'.format(processed_data_dir, file)
+        if not os.path.isfile(file_path):
+            continue
+
+        print('Loading in features for {}'.format(file_path))
+        node_features.append(pd.read_csv(file_path))
+
+    return node_features
+
+
+# returns: (features, labels, offsets) of every sample in processed_data_dir
+#          features: one row per sample, the columns of get_feature_header() except Type
+#          labels: node type of every sample
+#          offsets: first row of every node and, at the end, the number of rows, see FeatureStore.node_offsets()
+# a feature store is memory mapped, csv files are read once and put into one array
+def load_feature_arrays(processed_data_dir='./data/processed_data') -> tuple:
+
+    if has_feature_store(processed_data_dir):
+        print('Loading in features for {}'.format(processed_data_dir))
+        store = FeatureStore(processed_data_dir)
+        return store.features, store.labels, store.node_offsets()
+
+    frames = [df.to_numpy(dtype=np.float64) for df in load_node_features(processed_data_dir)]
+    data = np.concatenate(frames) if frames else np.zeros((0, NUM_FEATURES + 1))
+    offsets = np.concatenate(([0], np.cumsum([len(frame) for frame in frames], dtype=np.int64)))
+
+    return data[:, :-1], data[:, -1].astype(np.int8), offsets
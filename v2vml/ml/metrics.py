@@ -1,7 +1,126 @@
 from abc import ABC, abstractmethod
+import io
 import numpy as np
 import pandas as pd
+from scipy.stats import t as t_distribution
 from sklearn.metrics import accuracy_score, classification_report
+import v2vml.configuration as conf
+
+
+# returns: the report of test_models(), one section per model
+# specs: the ModelSpec of every StatSuite
+# running_stats: the RunningStats of every StatSuite, see iteration_metrics()
+def stat_report(specs, stat_suites, running_stats) -> str:
+
+    report = io.StringIO()
+    print(stopping_summary(stat_suites[0].final_total), file=report)
+    print('\n-------------------------------------------------------------------------------------------------------', file=report)
+    for spec, stat_suite, stats in zip(specs, stat_suites, running_stats):
+        print('{} Stats\n'.format(spec.name), file=report)
+        print(stat_suite, '\n', file=report)
+        print(confidence_report(stats, stat_suite.index), '\n', file=report)
+        print('-------------------------------------------------------------------------------------------------------\n', file=report)
+
+    return report.getvalue()
+
+
+# returns: why test_models() stopped after num_tests iterations
+def stopping_summary(num_tests) -> str:
+
+    if num_tests < conf.TRAIN_MODELS_NUM_TESTS:
+        return 'Stopped after {} of at most {} iterations, every {:g}% confidence interval is narrower than {}' \
+            .format(num_tests, conf.TRAIN_MODELS_NUM_TESTS, 100 * conf.TRAIN_MODELS_CI_LEVEL, conf.TRAIN_MODELS_CI_WIDTH)
+
+    return 'Ran all {} iterations'.format(num_tests)
+
+
+# returns: the mean and confidence interval of the accuracy and the recall of every label
+# index: name of every label
+def confidence_report(stats, index) -> str:
+
+    half_width = stats.half_width(conf.TRAIN_MODELS_CI_LEVEL)
+
+    ci_frame = pd.DataFrame({
+        'mean': stats.mean,
+        'ci low': stats.mean - half_width,
+        'ci high': stats.mean + half_width,
+        'ci width': 2 * half_width,
+    }, index=['Accuracy'] + ['Recall ' + str(i) for i in index])
+
+    return '{:g}% Confidence Intervals:\n\n{}'.format(100 * conf.TRAIN_MODELS_CI_LEVEL, ci_frame.round(4))
+
+
+# returns: the accuracy and then the recall of every label of the confusion counts of an iteration
+#          the recall of a label that is not in the test samples is nan
+def iteration_metrics(counts) -> np.ndarray:
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        recall = np.diag(counts) / counts.sum(axis=1)
+
+    return np.concatenate(([np.trace(counts) / counts.sum()], recall))
+
+
+# returns: True once the iterations of test_models() can stop, see TRAIN_MODELS_CI_WIDTH
+# running_stats: RunningStats of every model
+def has_converged(running_stats, num_tests) -> bool:
+
+    if conf.TRAIN_MODELS_CI_WIDTH is None or num_tests < conf.TRAIN_MODELS_MIN_TESTS:
+        return False
+
+    return all(np.all(2 * stats.half_width(conf.TRAIN_MODELS_CI_LEVEL) <= conf.TRAIN_MODELS_CI_WIDTH)
+               for stats in running_stats)
+
+
+# running mean and variance of a few values over the iterations of test_models() (Welford's algorithm)
+# values that are nan are left out, ex: the recall of a label that was not in the test samples
+class RunningStats:
+
+    def __init__(self, num_values):
+
+        self.count = np.zeros(num_values, dtype=np.int64)
+        self.mean = np.zeros(num_values)
+        self.m2 = np.zeros(num_values)
+
+    def add(self, values):
+
+        values = np.asarray(values, dtype=np.float64)
+        seen = np.flatnonzero(~np.isnan(values))
+
+        self.count[seen] += 1
+        delta = values[seen] - self.mean[seen]
+        self.mean[seen] += delta / self.count[seen]
+        self.m2[seen] += delta * (values[seen] - self.mean[seen])
+
+    # returns: half the width of the confidence interval of the mean of every value (student's t)
+    #          inf for values that were seen less than twice
+    def half_width(self, level) -> np.ndarray:
+
+        half_width = np.full(len(self.count), np.inf)
+
+        seen = self.count > 1
+        std = np.sqrt(self.m2[seen] / (self.count[seen] - 1))
+        half_width[seen] = t_distribution.ppf((1 + level) / 2, self.count[seen] - 1) * std / np.sqrt(self.count[seen])
+
+        return half_width
+
+
+# returns: counts[i, j] is the number of values with label i that were predicted as label j
+def confusion_counts(actual_values, predictions, num_labels) -> np.ndarray:
+
+    counts = np.zeros((num_labels, num_labels), dtype=np.int64)
+    np.add.at(counts, (np.asarray(actual_values).astype(np.int64), np.asarray(predictions).astype(np.int64)), 1)
+
+    return counts
+
+
+# returns: (actual values, predictions) with the given confusion counts, sorted by label
+# the metrics below only depend on the counts, so they come out the same as for the values the counts came from
+def from_confusion_counts(counts) -> tuple:
+
+    actual, predicted = np.nonzero(counts)
+    repeats = counts[actual, predicted]
+
+    return np.repeat(actual, repeats).astype(np.float64), np.repeat(predicted, repeats).astype(np.float64)
 
 
 class FinalizedError(Exception):
@@ -0,0 +1,129 @@
+import numpy as np
+from sklearn.linear_model import LogisticRegression, SGDClassifier
+from sklearn.naive_bayes import GaussianNB
+from sklearn.neighbors import KNeighborsClassifier
+from sklearn.preprocessing import StandardScaler
+from sklearn.svm import SVC
+from sklearn.tree import DecisionTreeClassifier
+import v2vml.ml.preprocessing as pre
+
+
+# a model that test_models() and export_models() train, see MODELS
+class ModelSpec:
+
+    # name: name in the report of test_models()
+    # file_name: file export_models() writes the trained model to
+    # constructor: creates the model from params
+    # scaled: trained and tested on the features scaled by the StandardScaler of the split
+    # parallel: may be trained in a worker process of test_models(), False trains it in the main process
+    # batched: can be trained a chunk of samples at a time with partial_fit(), see STREAMING_MODELS
+    # iterative: batched, and gets TRAIN_MODELS_STREAMING_PASSES passes over the train samples instead of one
+    # seeded: constructor takes a random_state, which is set to the seed of the split
+    def __init__(self, name, file_name, constructor, params=None, scaled=True, parallel=True, batched=False,
+                 iterative=False, seeded=False):
+
+        self.name = name
+        self.file_name = file_name
+        self.constructor = constructor
+        self.params = params or {}
+        self.scaled = scaled
+        self.parallel = parallel
+        self.batched = batched
+        self.iterative = iterative
+        self.seeded = seeded
+
+    # returns: a new model that has not been trained
+    def create(self, seed=None):
+
+        params = dict(self.params)
+        if self.seeded:
+            params['random_state'] = seed
+
+        return self.constructor(**params)
+
+    # what the trained model depends on, see v2vml.storage.cache
+    def config(self) -> list:
+        return [self.name, self.constructor.__name__, self.params, self.scaled, self.iterative, self.seeded]
+
+
+# every model that is tested and exported, adding one here adds it to both
+MODELS = [
+    ModelSpec('Logistic Regression', 'Logistic_Regression_Model.pkl', LogisticRegression),
+    ModelSpec('KNN', 'KNN_Model.pkl', KNeighborsClassifier, {'n_neighbors': 5, 'metric': 'minkowski', 'p': 2}),
+    ModelSpec('Decision Tree', 'Decision_Tree_Model.pkl', DecisionTreeClassifier, scaled=False, seeded=True),
+    ModelSpec('SVM', 'SVM_Model.pkl', SVC, {'kernel': 'linear'}),
+    ModelSpec('Naive Bayes', 'Naive_Bayes_Model.pkl', GaussianNB, batched=True),
+]
+
+# every model that is tested and exported with TRAIN_MODELS_STREAMING, they all have to be batched
+# the linear models of MODELS are not batched, stochastic gradient descent versions of them take their place
+STREAMING_MODELS = [
+    ModelSpec('SGD SVM', 'SGD_SVM_Model.pkl', SGDClassifier, {'loss': 'hinge'}, batched=True, iterative=True,
+              seeded=True),
+    ModelSpec('SGD Logistic Regression', 'SGD_Logistic_Regression_Model.pkl', SGDClassifier, {'loss': 'log_loss'},
+              batched=True, iterative=True, seeded=True),
+] + [spec for spec in MODELS if spec.batched]
+
+# number of node types, the labels are 0 to NUM_LABELS - 1
+NUM_LABELS = 3
+
+
+# returns: the seed of the split of an iteration of test_models(), export_models() uses the one of iteration 0
+# streams: see RandomStreams
+def split_seed(streams, iteration) -> int:
+    return int(streams.split(iteration).integers(2**31))
+
+
+# the train and test samples of a split that keeps the samples of a node together
+# the StandardScaler is fit once and shared by every model that is trained on the split
+class Split:
+
+    # feature_arrays: (features, labels, offsets), see load_feature_arrays()
+    def __init__(self, feature_arrays, seed, test_size=0.2):
+
+        features, labels, offsets = feature_arrays
+
+        # the nodes are split, the rows of the nodes are taken straight from the arrays
+        train_rows, test_rows = pre.node_split(offsets, test_size=test_size, random_state=seed)
+
+        self.seed = seed
+
+        # print('DROPPING DATA!!!!!!!!!!!!!!!!')
+        # features = features[:, 3:]
+
+        # independent features
+        self.x_train = features[train_rows].astype(np.float64)
+        self.x_test = features[test_rows].astype(np.float64)
+
+        # scaled independent features
+        self.scaler = StandardScaler()
+        self.scaled_x_train = self.scaler.fit_transform(self.x_train)
+        self.scaled_x_test = self.scaler.transform(self.x_test)
+
+        # dependent features
+        self.y_train = labels[train_rows]
+        self.y_test = labels[test_rows]
+
+    # returns: (x_train, x_test) that the model is trained and tested on
+    def inputs(self, spec) -> tuple:
+
+        if spec.scaled:
+            return self.scaled_x_train, self.scaled_x_test
+
+        return self.x_train, self.x_test
+
+    # returns: the model, trained on the train samples
+    def fit(self, spec):
+
+        x_train, _ = self.inputs(spec)
+
+        model = spec.create(self.seed)
+        model.fit(x_train, self.y_train)
+
+        return model
+
+    # returns: the predictions of a trained model for the test samples
+    def predict(self, spec, model) -> np.ndarray:
+
+        _, x_test = self.inputs(spec)
+        return model.predict(x_test)
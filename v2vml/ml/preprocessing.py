@@ -1,11 +1,15 @@
 from sklearn.linear_model import LinearRegression
+from sklearn.model_selection import train_test_split
 import v2vml.calculations as calc
 import v2vml.globals as g
 import numpy as np
 import pandas as pd
 import math
 import sys
-from typing import List
+
+
+# bump when the features change, so features in the stage cache are extracted again, see v2vml.storage.cache
+FEATURE_VERSION = 1
 
 
 def get_feature_header():
@@ -13,47 +17,195 @@ def get_feature_header():
 
 
 def features_from_file(file_name, file_path, node_type) -> None:
+    features_from_frame(file_name, pd.read_csv(file_path), node_type)
 
-    print('Extracting features from', file_name)
-    raw = pd.read_csv(file_path)
-    num_rows = len(raw)
 
-    # do not consider nodes that do not have at least 3 rows
-    if num_rows < g.SAMPLE_SIZE:
-        return
+# raw: the node's x,y,bsm_x,bsm_y rows, ex: from a node file or RawDataStore.read_node()
+# file_name: name of the feature file in ./data/processed_data
+def features_from_frame(file_name, raw: pd.DataFrame, node_type) -> None:
 
-    # get features
-    df = None
-    for i in range(0, num_rows//g.SAMPLE_SIZE):
-
-        # make sure that there are at least g.SAMPLE_SIZE rows remaining
-        if i > num_rows:
-            break
+    print('Extracting features from', file_name)
+    write_node_features('./data/processed_data/' + file_name, raw, node_type)
 
-        # get features from sample
-        features = features_from_rows(raw.iloc[i*g.SAMPLE_SIZE:(i*g.SAMPLE_SIZE)+g.SAMPLE_SIZE, :], node_type)
 
-        # append row of features to dataframe
-        if 0 == i:
-            df = features
+# writes the features of a node's rows to file_path
+# stride: see features_from_array()
+def write_node_features(file_path, raw: pd.DataFrame, node_type, sample_size=g.SAMPLE_SIZE, stride=None) -> None:
 
-        else:
-            df = pd.concat([df, features], ignore_index=True)
+    df = node_features(raw, node_type, sample_size, stride)
 
     # print(df)
 
     # write the features to a file
-    with open('./data/processed_data/' + file_name, 'w') as out_file:
+    if df is not None:
+        write_features(file_path, df)
+
+
+# returns: the features of a node's rows, None if the node does not have a full sample
+def node_features(raw: pd.DataFrame, node_type, sample_size=g.SAMPLE_SIZE, stride=None) -> pd.DataFrame:
+
+    num_rows = len(raw)
+
+    # do not consider nodes that do not have at least 3 rows
+    if num_rows < sample_size:
+        return None
+
+    # get features of every sample at once
+    return features_from_array(raw.to_numpy(dtype=np.float64), node_type, sample_size, stride)
+
+
+# df: the features of a node, one row per sample
+def write_features(file_path, df: pd.DataFrame) -> None:
+
+    with open(file_path, 'w') as out_file:
 
         # write column headers to file
         out_file.write(','.join(df.columns) + '\n')
 
         # write rows to the file one at a time
-        for i in range(len(df)):
-            row = [str(x) for x in df.iloc[i, :].values.tolist()]
+        for values in df.to_numpy(dtype=np.float64).tolist():
+            row = [str(x) for x in values]
             out_file.write(','.join(row) + '\n')
 
 
+# same features as features_from_rows(), but for every sample of a node at once
+# raw: the node's x,y,bsm_x,bsm_y rows, each g.SAMPLE_SIZE rows in a row are a sample
+#      rows after the last full sample are left out
+# stride: rows between the starts of two samples, None for sample_size (samples do not overlap)
+# returns: one row of features per sample
+def features_from_array(raw: np.ndarray, node_type, sample_size=g.SAMPLE_SIZE, stride=None) -> pd.DataFrame:
+
+    if stride is not None and stride != sample_size:
+        return features_from_overlapping(raw, node_type, sample_size, stride)
+
+    features = features_as_array(raw, sample_size)
+
+    columns = list(features.T) + [np.full(len(features), node_type)]
+    return pd.DataFrame(dict(zip(get_feature_header(), columns)))
+
+
+# same as features_from_array(), without the node type and without pandas, ex: for a single sample
+# returns: (sample, feature) array of the 5 features
+def features_as_array(raw: np.ndarray, sample_size=g.SAMPLE_SIZE) -> np.ndarray:
+
+    num_samples = len(raw) // sample_size
+
+    # (sample, row in the sample) arrays
+    samples = np.asarray(raw[:num_samples*sample_size], dtype=np.float64).reshape((num_samples, sample_size, 4))
+    x, y, bsm_x, bsm_y = samples[:, :, 0], samples[:, :, 1], samples[:, :, 2], samples[:, :, 3]
+
+    # ratios and angles of bsms at the same spot are inf or nan, instead of raising an error
+    with np.errstate(divide='ignore', invalid='ignore'):
+
+        # FEATURE 1: average distance
+        avg_distance = np.sqrt((bsm_x - x)**2 + (bsm_y - y)**2).sum(axis=1) / sample_size
+
+        # FEATURE 2: average ratio
+        actual_steps = np.sqrt(np.diff(x, axis=1)**2 + np.diff(y, axis=1)**2)
+        bsm_steps = np.sqrt(np.diff(bsm_x, axis=1)**2 + np.diff(bsm_y, axis=1)**2)
+        avg_ratio = (actual_steps / bsm_steps).sum(axis=1) / (sample_size - 1)
+
+        # FEATURE 3: average bsm angle
+        # angle at every bsm between the one before it and the one after it
+        a_x, a_y = bsm_x[:, :-2] - bsm_x[:, 1:-1], bsm_y[:, :-2] - bsm_y[:, 1:-1]
+        c_x, c_y = bsm_x[:, 2:] - bsm_x[:, 1:-1], bsm_y[:, 2:] - bsm_y[:, 1:-1]
+
+        cos = (a_x*c_x + a_y*c_y) / (np.sqrt(a_x**2 + a_y**2) * np.sqrt(c_x**2 + c_y**2))
+        avg_angle = np.degrees(np.arccos(cos)).sum(axis=1) / (sample_size - 2)
+
+        # FEATURE 4: slope dif
+        # if a line is vertical, make it horizontal before calculating the slope
+        # a line if all of x values are the same
+        is_vertical = (x == x[:, :1]).all(axis=1, keepdims=True)
+        line_x = np.where(is_vertical, bsm_y, bsm_x)
+        line_y = np.where(is_vertical, bsm_x, bsm_y)
+
+        # least squares slope of the best fit line, 0 if every x is the same (like LinearRegression)
+        line_x = line_x - line_x.mean(axis=1, keepdims=True)
+        line_y = line_y - line_y.mean(axis=1, keepdims=True)
+        covariance = (line_x*line_y).sum(axis=1)
+        variance = (line_x*line_x).sum(axis=1)
+        slope = np.abs(np.where(variance > 0, covariance / np.where(variance > 0, variance, 1), 0))
+
+    # FEATURE 5: Avg Dif
+    avg_dif = (np.abs(x - bsm_x) + np.abs(y - bsm_y)).sum(axis=1) / (2*sample_size)
+
+    return np.stack([avg_distance, avg_ratio, avg_angle, slope, avg_dif], axis=1)
+
+
+# same features as features_from_array(), for samples that start every stride rows
+# each feature is a sum of one term per row (or pair or triple of rows) of the sample, the terms are computed
+# once per row and the sums of every sample come from running sums, so a sample costs the same no matter how
+# much it overlaps with the others
+def features_from_overlapping(raw: np.ndarray, node_type, sample_size, stride) -> pd.DataFrame:
+
+    raw = np.asarray(raw, dtype=np.float64)
+    x, y, bsm_x, bsm_y = raw[:, 0], raw[:, 1], raw[:, 2], raw[:, 3]
+
+    # first row of every sample
+    starts = np.arange(0, max(len(raw) - sample_size + 1, 0), stride)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+
+        # FEATURE 1: average distance
+        distances = np.sqrt((bsm_x - x)**2 + (bsm_y - y)**2)
+        avg_distance = window_sums(distances, starts, sample_size) / sample_size
+
+        # FEATURE 2: average ratio
+        actual_steps = np.sqrt(np.diff(x)**2 + np.diff(y)**2)
+        bsm_steps = np.sqrt(np.diff(bsm_x)**2 + np.diff(bsm_y)**2)
+        avg_ratio = window_sums(actual_steps / bsm_steps, starts, sample_size - 1) / (sample_size - 1)
+
+        # FEATURE 3: average bsm angle
+        a_x, a_y = bsm_x[:-2] - bsm_x[1:-1], bsm_y[:-2] - bsm_y[1:-1]
+        c_x, c_y = bsm_x[2:] - bsm_x[1:-1], bsm_y[2:] - bsm_y[1:-1]
+
+        cos = (a_x*c_x + a_y*c_y) / (np.sqrt(a_x**2 + a_y**2) * np.sqrt(c_x**2 + c_y**2))
+        avg_angle = window_sums(np.degrees(np.arccos(cos)), starts, sample_size - 2) / (sample_size - 2)
+
+        # FEATURE 4: slope dif
+        # a sample is vertical if x does not change between any of its rows
+        is_vertical = window_sums((np.diff(x) != 0).astype(np.float64), starts, sample_size - 1) == 0
+
+        # sums of the least squares fit, relative to the node's average bsm to keep the running sums small
+        u = bsm_x - bsm_x.mean() if len(raw) > 0 else bsm_x
+        v = bsm_y - bsm_y.mean() if len(raw) > 0 else bsm_y
+        sum_u, sum_v = window_sums(u, starts, sample_size), window_sums(v, starts, sample_size)
+        sum_uu, sum_vv = window_sums(u*u, starts, sample_size), window_sums(v*v, starts, sample_size)
+        sum_uv = window_sums(u*v, starts, sample_size)
+
+        # the line of a vertical sample is made horizontal, see features_from_rows()
+        sum_x, sum_y = np.where(is_vertical, sum_v, sum_u), np.where(is_vertical, sum_u, sum_v)
+        sum_xx = np.where(is_vertical, sum_vv, sum_uu)
+
+        covariance = sum_uv - sum_x*sum_y/sample_size
+        variance = sum_xx - sum_x*sum_x/sample_size
+        slope = np.abs(np.where(variance > 0, covariance / np.where(variance > 0, variance, 1), 0))
+
+    # FEATURE 5: Avg Dif
+    avg_dif = window_sums(np.abs(x - bsm_x) + np.abs(y - bsm_y), starts, sample_size) / (2*sample_size)
+
+    columns = [avg_distance, avg_ratio, avg_angle, slope, avg_dif, np.full(len(starts), node_type)]
+    return pd.DataFrame(dict(zip(get_feature_header(), columns)))
+
+
+# returns: the sum of values[start:start + length] for every start
+# inf and nan (ex: the ratio of two bsms at the same spot) would spread to every later sum,
+# so the samples that have them are summed one at a time
+def window_sums(values, starts, length) -> np.ndarray:
+
+    finite = np.isfinite(values)
+
+    running = np.concatenate(([0.0], np.cumsum(np.where(finite, values, 0))))
+    sums = running[starts + length] - running[starts]
+
+    num_not_finite = np.concatenate(([0], np.cumsum(~finite)))
+    for i in np.flatnonzero(num_not_finite[starts + length] > num_not_finite[starts]):
+        sums[i] = values[starts[i]:starts[i] + length].sum()
+
+    return sums
+
+
 def features_from_rows(sample: pd.DataFrame, node_type, sample_size=g.SAMPLE_SIZE) -> pd.DataFrame:
 
     df = pd.DataFrame(0, index=np.arange(1), columns=get_feature_header())
@@ -124,13 +276,27 @@ def features_from_rows(sample: pd.DataFrame, node_type, sample_size=g.SAMPLE_SIZ
     return df
 
 
-# input: a list where each index is a dataframe containing the features for a single node
-# returns: a single dataframe with the features from all of the nodes in the list
-def condense_features(node_features: List[pd.DataFrame]) -> pd.DataFrame:
+# returns: (train rows, test rows) of a split that keeps the samples of a node together
+# offsets: see load_feature_arrays(), the nodes are split the same way train_test_split() splits a list of nodes
+def node_split(offsets, test_size, random_state) -> tuple:
 
-    df = node_features[0].copy()
+    train_nodes, test_nodes = split_nodes(len(offsets) - 1, test_size, random_state)
 
-    for features in node_features[1::]:
-        df = pd.concat([df, features], ignore_index=True)
+    return node_rows(offsets, train_nodes), node_rows(offsets, test_nodes)
 
-    return df
+
+# returns: (train nodes, test nodes), indexes of the nodes in the same order as train_test_split() puts them
+def split_nodes(num_nodes, test_size, random_state) -> tuple:
+    return train_test_split(np.arange(num_nodes), test_size=test_size, random_state=random_state)
+
+
+# returns: the rows of the given nodes, in the order of the nodes
+def node_rows(offsets, nodes) -> np.ndarray:
+
+    starts = offsets[nodes]
+    lengths = offsets[nodes + 1] - starts
+
+    # the first row of each node's run of rows, minus the rows before the run
+    shift = np.repeat(starts - (np.cumsum(lengths) - lengths), lengths)
+
+    return shift + np.arange(lengths.sum())
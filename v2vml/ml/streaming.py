@@ -0,0 +1,167 @@
+import numpy as np
+from sklearn.preprocessing import StandardScaler
+import v2vml.configuration as conf
+from v2vml.ml.feature_store import FeatureStore, has_feature_store
+from v2vml.ml.metrics import RunningStats, StatSuite, confusion_counts, from_confusion_counts, has_converged, \
+    iteration_metrics, stat_report
+from v2vml.ml.models import NUM_LABELS, STREAMING_MODELS, split_seed
+import v2vml.ml.preprocessing as pre
+from v2vml.random_streams import RandomStreams
+
+
+# the store keeps the samples of a node (and often of a node type) together, so the models are trained on chunks
+# made of blocks of this many rows from all over the store, see StreamingSplit.chunks()
+BLOCK_ROWS = 1000
+
+
+# TRAIN_MODELS_STREAMING: same as test_models(), but the features are never loaded all at once
+# the models are trained and tested TRAIN_MODELS_CHUNK_ROWS samples at a time, straight from the feature store
+# returns: the report that is printed at the end
+def test_models_streaming(processed_data_dir='./data/processed_data') -> str:
+
+    store, offsets = open_feature_store(processed_data_dir)
+
+    streams = RandomStreams()
+    print('Seed', streams.seed)
+
+    index = ['Good', 'Faulty', 'Malicious']
+    stat_suites = [StatSuite(index=index) for _ in STREAMING_MODELS]
+    running_stats = [RunningStats(NUM_LABELS + 1) for _ in STREAMING_MODELS]
+
+    for i in range(conf.TRAIN_MODELS_NUM_TESTS):
+
+        split = StreamingSplit(store, offsets, split_seed(streams, i))
+        models = split.fit(STREAMING_MODELS)
+
+        for stat_suite, stats, counts in zip(stat_suites, running_stats,
+                                             split.confusion_counts(STREAMING_MODELS, models)):
+            stat_suite.add(*from_confusion_counts(counts))
+            stats.add(iteration_metrics(counts))
+
+        print('Iteration', i+1)
+
+        # see TRAIN_MODELS_CI_WIDTH
+        if has_converged(running_stats, i+1):
+            break
+
+    # update percentages
+    for stat_suite in stat_suites:
+        stat_suite.finalize()
+
+    report = stat_report(STREAMING_MODELS, stat_suites, running_stats)
+    print(report, end='')
+
+    return report
+
+
+# TRAIN_MODELS_STREAMING: returns the (ModelSpec, model) of every STREAMING_MODELS, trained on the same split as
+# export_models() uses
+def train_models_streaming(processed_data_dir='./data/processed_data') -> list:
+
+    store, offsets = open_feature_store(processed_data_dir)
+
+    split = StreamingSplit(store, offsets, split_seed(RandomStreams(), 0))
+
+    return list(zip(STREAMING_MODELS, split.fit(STREAMING_MODELS)))
+
+
+# returns: (memory mapped FeatureStore, node offsets)
+def open_feature_store(processed_data_dir) -> tuple:
+
+    if not has_feature_store(processed_data_dir):
+        raise ValueError('TRAIN_MODELS_STREAMING needs a feature store in {}, see PROCESSED_DATA_FORMAT'
+                         .format(processed_data_dir))
+
+    print('Loading in features for {}'.format(processed_data_dir))
+    store = FeatureStore(processed_data_dir)
+
+    return store, store.node_offsets()
+
+
+# the train and test samples of a split that keeps the samples of a node together, see Split
+# only a list of which nodes are test nodes is kept, the samples are read TRAIN_MODELS_CHUNK_ROWS rows at a time
+# the StandardScaler is fit once, a chunk at a time, and shared by every model that is trained on the split
+class StreamingSplit:
+
+    # store: FeatureStore, offsets: see FeatureStore.node_offsets()
+    def __init__(self, store, offsets, seed, test_size=0.2):
+
+        self.store = store
+        self.offsets = offsets
+        self.seed = seed
+
+        _, test_nodes = pre.split_nodes(len(offsets) - 1, test_size, seed)
+        self.is_test = np.zeros(len(offsets) - 1, dtype=np.bool_)
+        self.is_test[test_nodes] = True
+
+        self.scaler = StandardScaler()
+        for x, _ in self.chunks(test=False):
+            self.scaler.partial_fit(x)
+
+    # yields: (x, y) of the train or test samples, TRAIN_MODELS_CHUNK_ROWS rows of the store at a time
+    # rng: None to read the store in order, otherwise every chunk is made of random blocks of BLOCK_ROWS rows and its
+    #      rows are shuffled, a model that is trained on a chunk sees every node type
+    def chunks(self, test, rng=None):
+
+        num_rows = len(self.store)
+        chunk_rows = conf.TRAIN_MODELS_CHUNK_ROWS
+
+        if rng is None:
+            row_chunks = (np.arange(start, min(start + chunk_rows, num_rows)) for start in range(0, num_rows, chunk_rows))
+        else:
+            blocks = rng.permutation(-(-num_rows // BLOCK_ROWS))
+            blocks_per_chunk = max(chunk_rows // BLOCK_ROWS, 1)
+            row_chunks = (rng.permutation(block_rows(blocks[i:i + blocks_per_chunk], num_rows))
+                          for i in range(0, len(blocks), blocks_per_chunk))
+
+        for rows in row_chunks:
+
+            # node of every row
+            nodes = np.searchsorted(self.offsets, rows, side='right') - 1
+            rows = rows[self.is_test[nodes] == test]
+
+            if len(rows) > 0:
+                yield np.asarray(self.store.features[rows], dtype=np.float64), np.asarray(self.store.labels[rows])
+
+    # returns: the models, trained on the train samples
+    # every chunk is scaled once for all of the models
+    def fit(self, specs) -> list:
+
+        models = [spec.create(self.seed) for spec in specs]
+        classes = np.arange(NUM_LABELS)
+
+        # the chunks are made of different rows every pass
+        rng = np.random.default_rng(self.seed)
+
+        for i in range(max(conf.TRAIN_MODELS_STREAMING_PASSES, 1)):
+
+            active = [m for m, spec in enumerate(specs) if i == 0 or spec.iterative]
+            if not active:
+                break
+
+            for x, y in self.chunks(test=False, rng=rng):
+
+                scaled_x = self.scaler.transform(x)
+                for m in active:
+                    models[m].partial_fit(scaled_x if specs[m].scaled else x, y, classes=classes)
+
+        return models
+
+    # returns: the confusion counts of the predictions of every model for the test samples
+    def confusion_counts(self, specs, models) -> list:
+
+        counts = [np.zeros((NUM_LABELS, NUM_LABELS), dtype=np.int64) for _ in specs]
+
+        for x, y in self.chunks(test=True):
+
+            scaled_x = self.scaler.transform(x)
+            for m, spec in enumerate(specs):
+                counts[m] += confusion_counts(y, models[m].predict(scaled_x if spec.scaled else x), NUM_LABELS)
+
+        return counts
+
+
+# returns: the rows of the given blocks of BLOCK_ROWS rows, leaving out the ones past num_rows
+def block_rows(blocks, num_rows) -> np.ndarray:
+    rows = (blocks[:, np.newaxis] * BLOCK_ROWS + np.arange(BLOCK_ROWS)).ravel()
+    return rows[rows < num_rows]
@@ -1,114 +1,140 @@
+import collections
+import multiprocessing
 import numpy as np
-import os
-import pandas as pd
-from sklearn.linear_model import LogisticRegression
-from sklearn.model_selection import train_test_split
-from sklearn.naive_bayes import GaussianNB
-from sklearn.neighbors import KNeighborsClassifier
-from sklearn.preprocessing import StandardScaler
-from sklearn.svm import SVC
-from sklearn.tree import DecisionTreeClassifier
 import v2vml.configuration as conf
-from v2vml.ml.metrics import StatSuite
-import v2vml.ml.preprocessing as pre
+from v2vml.ml.feature_store import load_feature_arrays
+from v2vml.ml.metrics import RunningStats, StatSuite, confusion_counts, from_confusion_counts, has_converged, \
+    iteration_metrics, stat_report
+from v2vml.ml.models import MODELS, NUM_LABELS, Split, split_seed
+from v2vml.ml.streaming import test_models_streaming
+from v2vml.random_streams import RandomStreams
 
 
-def test_models():
+# (features, labels, offsets) of the process, see load_test_data()
+feature_arrays = None
 
-    # each index is a dataframe containing the features for a single node
-    node_features = []
 
-    # load in features
-    for file in os.listdir('./data/processed_data'):
-        print('Loading in features for ./data/processed_data/{}'.format(file))
-        node_features.append(pd.read_csv('./data/processed_data/' + file))
+# processed_data_dir: features to test the models with, ex: the features of another sample size
+# every iteration is a task, the split of the iteration is made once and every model is trained and tested on it
+# the tasks run on a pool of TRAIN_MODELS_NUM_WORKERS processes
+# models that are not ModelSpec.parallel run in this process, on a split of their own
+# the split of each iteration is seeded with SEED, so the report does not depend on the number of processes
+# the results are taken an iteration at a time, in order, and the iterations stop early once every confidence interval
+# is narrow enough, see TRAIN_MODELS_CI_WIDTH
+# the pool only works on as many iterations at a time as it has processes, so little is wasted once they stop
+# with TRAIN_MODELS_STREAMING, see test_models_streaming() instead
+# returns: the report that is printed at the end
+def test_models(processed_data_dir='./data/processed_data') -> str:
+
+    if conf.TRAIN_MODELS_STREAMING:
+        return test_models_streaming(processed_data_dir)
+
+    streams = RandomStreams()
+    print('Seed', streams.seed)
+
+    # seed of every iteration
+    seeds = [split_seed(streams, i) for i in range(conf.TRAIN_MODELS_NUM_TESTS)]
+
+    # index in MODELS of the models that run on the pool and of the ones that run in this process
+    pool_models = [m for m, spec in enumerate(MODELS) if spec.parallel]
+    local_models = [m for m, spec in enumerate(MODELS) if not spec.parallel]
+
+    pool = None
+    num_workers = conf.TRAIN_MODELS_NUM_WORKERS or multiprocessing.cpu_count()
+    if num_workers == 1:
+        pool_models, local_models = [], list(range(len(MODELS)))
+    elif pool_models:
+        pool = multiprocessing.Pool(num_workers, initializer=load_test_data, initargs=(processed_data_dir,))
+
+    if local_models:
+        load_test_data(processed_data_dir)
+
+    # AsyncResult of every iteration the pool is working on, in order
+    pending = collections.deque()
+
+    # confusion counts of every model of every iteration
+    counts = np.zeros((conf.TRAIN_MODELS_NUM_TESTS, len(MODELS), NUM_LABELS, NUM_LABELS), dtype=np.int64)
+
+    # accuracy and recall of every node type, see iteration_metrics()
+    running_stats = [RunningStats(NUM_LABELS + 1) for _ in MODELS]
+
+    num_tests = 0
+    try:
+        for i in range(conf.TRAIN_MODELS_NUM_TESTS):
+
+            results = []
+            if pool is not None:
+
+                # the pool works ahead on the iterations that come next, at most num_workers of them
+                while len(pending) < num_workers and i + len(pending) < conf.TRAIN_MODELS_NUM_TESTS:
+                    j = i + len(pending)
+                    pending.append(pool.apply_async(test_iteration, ((j, seeds[j], pool_models),)))
+
+                results = pending.popleft().get()
+
+            if local_models:
+                results += test_iteration((i, seeds[i], local_models))
+
+            for m, model_counts in results:
+                counts[i, m] = model_counts
+                running_stats[m].add(iteration_metrics(model_counts))
+
+            num_tests += 1
+            print('Iteration', num_tests)
+
+            if has_converged(running_stats, num_tests):
+                break
+
+    finally:
+        if pool is not None:
+            # the iterations the pool was working ahead on are not needed
+            pool.terminate()
+            pool.join()
 
     index = ['Good', 'Faulty', 'Malicious']
 
-    # various different stats
-    logistic_regression_stat_suite = StatSuite(index=index)
-    knn_stat_suite = StatSuite(index=index)
-    decision_tree_stat_suite = StatSuite(index=index)
-    svm_stat_suite = StatSuite(index=index)
-    naive_bayes_stat_suite = StatSuite(index=index)
-
-    for i in np.arange(conf.TRAIN_MODELS_NUM_TESTS):
-
-        print('Iteration', i+1)
-
-        training_node_features, testing_node_features = train_test_split(node_features, test_size=0.2)
-        scaler = StandardScaler()
-
-        train = pre.condense_features(training_node_features)
-        test = pre.condense_features(testing_node_features)
-
-        # print('DROPPING DATA!!!!!!!!!!!!!!!!')
-        # train = train.drop(columns=['Avg Dist', 'Avg Ratio', 'BSM Angle'])
-        # test = test.drop(columns=['Avg Dist', 'Avg Ratio', 'BSM Angle'])
-
-        # independent features
-        unscaled_x_train = train.iloc[:, :-1].to_numpy()
-        unscaled_x_test = test.iloc[:, :-1].to_numpy()
-
-        # scaled independent features
-        scaled_x_train = scaler.fit_transform(unscaled_x_train)
-        scaled_x_test = scaler.transform(unscaled_x_test)
-
-        # dependent features
-        y_train = train.iloc[:, -1]
-        y_test = test.iloc[:, -1]
-
-        # Logistic Regression
-        model = LogisticRegression()
-        model.fit(scaled_x_train, y_train)
-        predictions = model.predict(scaled_x_test)
-        logistic_regression_stat_suite.add(y_test, predictions)
-
-        # KNN
-        model = KNeighborsClassifier(n_neighbors=5, metric='minkowski', p=2)
-        model.fit(scaled_x_train, y_train)
-        predictions = model.predict(scaled_x_test)
-        knn_stat_suite.add(y_test, predictions)
-
-        # Decision Tree
-        model = DecisionTreeClassifier()
-        model.fit(unscaled_x_train, y_train)
-        predictions = model.predict(unscaled_x_test)
-        decision_tree_stat_suite.add(y_test, predictions)
-
-        # SVM
-        model = SVC(kernel='linear')
-        model.fit(scaled_x_train, y_train)
-        predictions = model.predict(scaled_x_test)
-        svm_stat_suite.add(y_test, predictions)
-
-        # Naive Bayes
-        model = GaussianNB()
-        model.fit(scaled_x_train, y_train)
-        predictions = model.predict(scaled_x_test)
-        naive_bayes_stat_suite.add(y_test, predictions)
+    # various different stats, added in the same order as a serial run would add them
+    stat_suites = [StatSuite(index=index) for _ in MODELS]
+    for i in range(num_tests):
+        for m, stat_suite in enumerate(stat_suites):
+            stat_suite.add(*from_confusion_counts(counts[i, m]))
 
     # update percentages
-    logistic_regression_stat_suite.finalize()
-    knn_stat_suite.finalize()
-    decision_tree_stat_suite.finalize()
-    svm_stat_suite.finalize()
-    naive_bayes_stat_suite.finalize()
+    for stat_suite in stat_suites:
+        stat_suite.finalize()
 
     # print custom stats
-    print('\n-------------------------------------------------------------------------------------------------------')
-    print('Logistic Regression Stats\n')
-    print(logistic_regression_stat_suite, '\n')
-    print('-------------------------------------------------------------------------------------------------------\n')
-    print('KNN Stats\n')
-    print(knn_stat_suite, '\n')
-    print('-------------------------------------------------------------------------------------------------------\n')
-    print('Decision Tree Stats\n')
-    print(decision_tree_stat_suite, '\n')
-    print('-------------------------------------------------------------------------------------------------------\n')
-    print('SVM Stats\n')
-    print(svm_stat_suite, '\n')
-    print('-------------------------------------------------------------------------------------------------------\n')
-    print('Naive Bayes Stats\n')
-    print(naive_bayes_stat_suite, '\n')
-    print('-------------------------------------------------------------------------------------------------------\n')
+    report = stat_report(MODELS, stat_suites, running_stats)
+    print(report, end='')
+
+    return report
+
+
+# runs once in every process
+def load_test_data(processed_data_dir):
+
+    global feature_arrays
+
+    # every sample in one array, the samples of a node are next to each other
+    feature_arrays = load_feature_arrays(processed_data_dir)
+
+
+# makes the split of an iteration and trains and tests models on it, the models share its StandardScaler
+# task: (iteration, seed of the iteration, index in MODELS of every model)
+# returns: (index in MODELS, confusion counts of the predictions) of every model
+def test_iteration(task) -> list:
+
+    _, seed, models = task
+    split = Split(feature_arrays, seed)
+
+    results = []
+    for m in models:
+
+        spec = MODELS[m]
+
+        model = split.fit(spec)
+        predictions = split.predict(spec, model)
+
+        results.append((m, confusion_counts(split.y_test, predictions, NUM_LABELS)))
+
+    return results
@@ -1 +1,2 @@
+from .ring_buffer import *
 from .node import Node
@@ -1,13 +1,17 @@
 import numpy as np
-import random
 from typing import List
 import v2vml.calculations as calc
 import v2vml.configuration as conf
 import v2vml.globals as g
+from v2vml.node.ring_buffer import PointRingBuffer
 
 
 class Node:
 
+    # no per-node __dict__, long runs keep a lot of nodes alive
+    __slots__ = ('id', 'dir', 'type', 'has_appeared', 'x', 'y', 'speed', 'appear_epoch', 'exit_epoch',
+                 'coord_hist', 'bsm_hist', 'inner_neighbors', 'outer_neighbors', 'susses', 'last_bsm')
+
     num_nodes = 0
 
     # node types
@@ -20,6 +24,10 @@ class Node:
     ERROR_FAULTY = 40
     ERROR_MALICIOUS = 100
 
+    # node speeds
+    SPEED_MIN = 20
+    SPEED_MAX = 70
+
     # keep detected faulty or malicious nodes in memory for n epochs
     # 10 epochs is 1 second
     # 100 epochs is 10 seconds
@@ -28,21 +36,21 @@ class Node:
 
     ####################################################################
 
-    def __init__(self, on_canvas=True):
+    # node_id: defaults to the next unused id
+    # rng: numpy Generator used to place the node, see RandomStreams.node()
+    def __init__(self, on_canvas=True, epoch=0, node_id=None, rng=None):
 
         # unique node id
-        self.id = Node.num_nodes
-        Node.num_nodes += 1
+        if node_id is None:
+            node_id = Node.num_nodes
+            Node.num_nodes += 1
+        self.id = node_id
 
-        random.seed()
-        self.dir = random.randint(1, 4)
-        self.type = Node.random_node_type()
+        if rng is None:
+            rng = np.random.default_rng()
 
-        self.out_file = None
-        if conf.MODE == conf.MODE_GATHER_DATA:
-            str_out_file = './data/raw_data/{}/Node_{}.csv'.format(self.type_as_str(), self.id)
-            self.out_file = open(str_out_file, 'w')
-            self.out_file.write('x,y,bsm_x,bsm_y\n')
+        self.dir = Node.randint(rng, 1, 4)
+        self.type = Node.random_node_type(rng)
 
         # nodes that are off the canvas are removed
         # however, newly spawned nodes start off of the canvas
@@ -52,8 +60,8 @@ class Node:
         # if the node is being placed on the canvas
         if on_canvas:
             self.has_appeared = True
-            self.x = random.randint(0, conf.CANVAS_WIDTH)
-            self.y = random.randint(0, conf.CANVAS_HEIGHT)
+            self.x = Node.randint(rng, 0, conf.CANVAS_WIDTH)
+            self.y = Node.randint(rng, 0, conf.CANVAS_HEIGHT)
 
         # if the node is being placed off the canvas
         # a node is placed off the canvas when another node went off the canvas
@@ -61,30 +69,33 @@ class Node:
             self.has_appeared = False
 
             if g.NORTH == self.dir:
-                self.x = random.randint(0, conf.CANVAS_WIDTH)
+                self.x = Node.randint(rng, 0, conf.CANVAS_WIDTH)
                 self.y = conf.CANVAS_HEIGHT + g.RADIUS_SENSOR
 
             elif g.SOUTH == self.dir:
-                self.x = random.randint(0, conf.CANVAS_WIDTH)
+                self.x = Node.randint(rng, 0, conf.CANVAS_WIDTH)
                 self.y = 0 - g.RADIUS_SENSOR
 
             elif g.EAST == self.dir:
                 self.x = 0 - g.RADIUS_SENSOR
-                self.y = random.randint(0, conf.CANVAS_HEIGHT)
+                self.y = Node.randint(rng, 0, conf.CANVAS_HEIGHT)
 
             else:
                 self.x = conf.CANVAS_WIDTH + g.RADIUS_SENSOR
-                self.y = random.randint(0, conf.CANVAS_HEIGHT)
+                self.y = Node.randint(rng, 0, conf.CANVAS_HEIGHT)
+
+        self.speed = Node.randint(rng, Node.SPEED_MIN, Node.SPEED_MAX)
 
-        self.speed = random.randint(20, 70)
+        # epochs where has_appeared becomes True and where is_out() becomes True
+        self.appear_epoch = None
+        self.exit_epoch = None
+        self.set_lifetime(epoch, on_canvas)
 
-        # keep track of the nodes previous positions
-        # ex: [ (oldest_x, oldest_y), ... , (recent_x, recent_y) ]
-        self.past_coord: List[tuple] = []
+        # keep track of the nodes previous positions, see past_coord
+        self.coord_hist = PointRingBuffer(conf.MAX_COORD_HIST, typecode='q')
 
-        # keep track of the nodes previous positions as reported by BSMs
-        # ex: [ (oldest_bsm_x, oldest_bsm_y), ... , (recent_bsm_x, recent_bsm_y) ]
-        self.past_bsm_coord: List[tuple] = []
+        # keep track of the nodes previous positions as reported by BSMs, see past_bsm_coord
+        self.bsm_hist = PointRingBuffer(conf.MAX_BSM_HIST, typecode='d')
 
         # current neighbors
         self.inner_neighbors: List[int] = []
@@ -96,10 +107,52 @@ class Node:
         # the last BSM emitted by this node
         self.last_bsm = None
 
+    # rebuilds the node in the given row of a state saved by Simulation.get_state()
+    # the neighbors are set by the simulation
+    @classmethod
+    def from_state(cls, state, row):
+
+        n = cls.__new__(cls)
+
+        n.id = int(state['ids'][row])
+        n.dir = int(state['dirs'][row])
+        n.type = int(state['types'][row])
+        n.has_appeared = bool(state['has_appeared'][row])
+        n.x = int(state['x'][row])
+        n.y = int(state['y'][row])
+        n.speed = int(state['speeds'][row])
+
+        appear_epoch = int(state['appear_epoch'][row])
+        n.appear_epoch = appear_epoch if appear_epoch >= 0 else None
+        n.exit_epoch = int(state['exit_epoch'][row])
+
+        n.coord_hist = PointRingBuffer(conf.MAX_COORD_HIST, typecode='q')
+        for x, y in state['coord_hist'][row, :state['coord_hist_len'][row]].tolist():
+            n.coord_hist.append(x, y)
+
+        n.bsm_hist = PointRingBuffer(conf.MAX_BSM_HIST, typecode='d')
+        for x, y in state['bsm_hist'][row, :state['bsm_hist_len'][row]].tolist():
+            n.bsm_hist.append(x, y)
+
+        n.inner_neighbors = []
+        n.outer_neighbors = []
+        n.susses = []
+
+        n.last_bsm = None
+        if state['bsm_hist_len'][row] > 0:
+            n.last_bsm = tuple(state['last_bsm'][row].tolist())
+
+        return n
+
+    # random integer in [low, high], like random.randint()
+    @staticmethod
+    def randint(rng, low, high) -> int:
+        return int(rng.integers(low, high + 1))
+
     @classmethod
-    def random_node_type(cls) -> int:
+    def random_node_type(cls, rng) -> int:
 
-        ran = random.random() * 100
+        ran = rng.random() * 100
 
         if ran <= conf.PERCENT_GOOD:
             return Node.GOOD
@@ -109,16 +162,28 @@ class Node:
             return Node.MALICIOUS
 
     def type_as_str(self) -> str:
+        return Node.type_name(self.type)
+
+    # name of a node type, also the sub directory of the raw data of its nodes
+    @staticmethod
+    def type_name(node_type) -> str:
 
-        if self.type == Node.GOOD:
+        if node_type == Node.GOOD:
             return 'good'
-        elif self.type == Node.FAULTY:
+        elif node_type == Node.FAULTY:
             return 'faulty'
         else:
             return 'malicious'
 
+    # maximum BSM error for each node type, indexed by type
+    @classmethod
+    def max_errors(cls) -> np.ndarray:
+        return np.array([cls.ERROR_GOOD, cls.ERROR_FAULTY, cls.ERROR_MALICIOUS])
+
     # handles all of the updates a node needs to make when going into a new epoch
-    def update(self):
+    # the simulation draws the BSM errors for every node at once, see bsm_errors()
+    # and writes the raw data of every node at once, see v2vml.storage
+    def update(self, error_x, error_y):
 
         # manages location history (for the visualizer)
         self.update_hist()
@@ -127,67 +192,55 @@ class Node:
         self.update_position()
 
         # creates a new bsm and updates the bsm list
-        self.update_bsm_hist()
-
-        # writes current location and bsm location to file
-        if conf.MODE == conf.MODE_GATHER_DATA:
-            self.output_to_file()
-
-    # updates the list containing the nodes previous (x,y) coordinates
+        self.update_bsm_hist(error_x, error_y)
+
+    # the nodes previous positions
+    # ex: [ (oldest_x, oldest_y), ... , (recent_x, recent_y) ]
+    @property
+    def past_coord(self) -> List[tuple]:
+        return self.coord_hist.as_list()
+
+    # the nodes previous positions as reported by BSMs
+    # ex: [ (oldest_bsm_x, oldest_bsm_y), ... , (recent_bsm_x, recent_bsm_y) ]
+    @property
+    def past_bsm_coord(self) -> List[tuple]:
+        return self.bsm_hist.as_list()
+
+    # updates the history of the nodes previous (x,y) coordinates
+    # the oldest recorded position is overwritten once the history is full
     def update_hist(self):
+        self.coord_hist.append(self.x, self.y)
 
-        if len(self.past_coord) == conf.MAX_COORD_HIST:
-
-            # remove the oldest recorded position
-            self.past_coord = self.past_coord[1:]
-
-        # add the current position to the end of the list
-        self.past_coord.append((self.x, self.y))
+    def update_bsm_hist(self, error_x, error_y):
+        self.last_bsm = self.new_bsm_coord(error_x, error_y)
+        self.bsm_hist.append(self.last_bsm[0], self.last_bsm[1])
 
-    def update_bsm_hist(self):
-
-        if len(self.past_bsm_coord) == conf.MAX_BSM_HIST:
-
-            # remove the oldest recorded position
-            self.past_bsm_coord = self.past_bsm_coord[1:]
+    # generates the point to broadcast in the BSM
+    def new_bsm_coord(self, error_x, error_y) -> tuple:
 
-        # add the current position to the end of the list
-        self.last_bsm = self.new_bsm_coord()
-        self.past_bsm_coord.append(self.last_bsm)
+        # point to include in broadcasted bsm
+        bsm_x = self.x + error_x
+        bsm_y = self.y + error_y
 
-    # writes current location and the location specified in the bsm to a file
-    def output_to_file(self):
-        out_str = '{},{},{},{}\n'.format(self.x, self.y, self.last_bsm[0], self.last_bsm[1])
-        self.out_file.write(out_str)
+        return bsm_x, bsm_y
 
-    # generates the point to broadcast in the BSM
-    def new_bsm_coord(self) -> tuple:
+    # works out the BSM errors of a batch of nodes at once
+    # uniforms: uniform numbers in [0, 1), shape (2, number of nodes), see RandomStreams.bsm()
+    # types: array with the type of each node
+    # returns: (error_x, error_y) arrays
+    @classmethod
+    def bsm_errors(cls, uniforms, types) -> tuple:
 
         # PERFECT node's BSMs will contain the x and y's that are VERY similar to the actual x and y
         # GOOD node's BSMs will contain x and y's that are a little bit off
         # FAULTY node's BSMs will contain x and y's that are noticeably off
         # MALICIOUS node's BSMs will arbitrary x and y's
 
-        # point to include in broadcasted bsm
-        bsm_x = None
-        bsm_y = None
-
-        error_radius = None
-        angle = random.randint(0, 359)
-
-        if Node.GOOD == self.type:
-            error_radius = random.randint(0, Node.ERROR_GOOD-1)
-
-        elif Node.FAULTY == self.type:
-            error_radius = random.randint(0, Node.ERROR_FAULTY-1)
-
-        else:
-            error_radius = random.randint(0, Node.ERROR_MALICIOUS-1)
+        # whole numbers between 0 and 359, which are used as radians
+        angle = (uniforms[0] * 360).astype(np.int64)
+        error_radius = (uniforms[1] * cls.max_errors()[types]).astype(np.int64)
 
-        bsm_x = self.x + (error_radius*np.cos(angle))
-        bsm_y = self.y + (error_radius*np.sin(angle))
-
-        return bsm_x, bsm_y
+        return error_radius*np.cos(angle), error_radius*np.sin(angle)
 
     # adjusts the nodes x and y
     def update_position(self):
@@ -204,7 +257,31 @@ class Node:
         else:
             self.x -= self.speed
 
+    # works out when the node appears on the canvas and when it will be completely off of it
+    # nodes drive in a straight line at a constant speed, so this is known when the node is created
+    # epoch: the epoch the node was created in, it first moves in the next epoch
+    def set_lifetime(self, epoch, on_canvas):
+
+        if g.NORTH == self.dir:
+            first, last = calc.epochs_on_canvas(self.y, -self.speed, conf.CANVAS_HEIGHT)
+        elif g.SOUTH == self.dir:
+            first, last = calc.epochs_on_canvas(self.y, self.speed, conf.CANVAS_HEIGHT)
+        elif g.EAST == self.dir:
+            first, last = calc.epochs_on_canvas(self.x, self.speed, conf.CANVAS_WIDTH)
+        else:
+            first, last = calc.epochs_on_canvas(self.x, -self.speed, conf.CANVAS_WIDTH)
+
+        # nodes that jump over the canvas without landing on it never appear, but are removed as well
+        if on_canvas:
+            self.appear_epoch = epoch
+        elif first <= last:
+            self.appear_epoch = epoch + int(first)
+
+        # is_out() also waits for every point in the history to leave the canvas
+        self.exit_epoch = epoch + int(last) + conf.MAX_COORD_HIST + 1
+
     # returns True if the node is completely off the canvas, including the node history
+    # the simulation uses exit_epoch instead, which gives the same answer without checking the history
     def is_out(self) -> bool:
 
         # do not remove nodes that just spawned off of the canvas
@@ -0,0 +1,46 @@
+from array import array
+from typing import List
+
+
+# fixed size history of (x, y) points
+# the storage is allocated once and the oldest point is overwritten once the buffer is full
+class PointRingBuffer:
+
+    __slots__ = ('points', 'capacity', 'head', 'size')
+
+    # typecode: 'q' for integer points, 'd' for float points
+    def __init__(self, capacity, typecode='d'):
+
+        # x and y are stored next to each other
+        self.points = array(typecode, [0]) * (2*capacity)
+        self.capacity = capacity
+
+        # index where the next point is written
+        self.head = 0
+        self.size = 0
+
+    def append(self, x, y):
+
+        i = 2*self.head
+        self.points[i] = x
+        self.points[i+1] = y
+
+        self.head = (self.head + 1) % self.capacity
+        if self.size < self.capacity:
+            self.size += 1
+
+    # ex: [ (oldest_x, oldest_y), ... , (recent_x, recent_y) ]
+    def as_list(self) -> List[tuple]:
+
+        start = (self.head - self.size) % self.capacity
+        p = self.points
+
+        coords = []
+        for k in range(self.size):
+            i = 2*((start + k) % self.capacity)
+            coords.append((p[i], p[i+1]))
+
+        return coords
+
+    def __len__(self):
+        return self.size
@@ -0,0 +1 @@
+from .random_streams import *
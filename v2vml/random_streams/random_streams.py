@@ -0,0 +1,67 @@
+import numpy as np
+import v2vml.configuration as conf
+
+
+# independent random number streams derived from a single master seed
+# a stream only depends on the seed and its key, so the same seed gives the same numbers
+# no matter how many streams were used before or which process asks for them
+class RandomStreams:
+
+    # stream keys
+    STREAM_NODE = 0
+    STREAM_SPAWN = 1
+    STREAM_BSM = 2
+    STREAM_SPLIT = 3
+
+    # seed_sequence: defaults to one seeded with SEED from the configuration file
+    def __init__(self, seed_sequence=None):
+
+        if seed_sequence is None:
+            seed_sequence = np.random.SeedSequence(conf.SEED)
+
+        self.seed_sequence = seed_sequence
+
+    # the master seed, also set when SEED is None so that a run can be repeated
+    @property
+    def seed(self) -> int:
+        return self.seed_sequence.entropy
+
+    def generator(self, *key) -> np.random.Generator:
+        seq = np.random.SeedSequence(self.seed_sequence.entropy, spawn_key=self.seed_sequence.spawn_key + key)
+        return np.random.Generator(np.random.PCG64(seq))
+
+    # used to create a single node
+    def node(self, node_id) -> np.random.Generator:
+        return self.generator(RandomStreams.STREAM_NODE, node_id)
+
+    # used to create a batch of nodes
+    def spawn(self, batch) -> np.random.Generator:
+        return self.generator(RandomStreams.STREAM_SPAWN, batch)
+
+    # returns: the uniform numbers the BSM errors of the nodes with the given ids are made from in an epoch,
+    #          see Node.bsm_errors()
+    # keyed by node id, so the errors of a node do not depend on which tile or process moves it
+    def bsm(self, epoch, ids) -> np.ndarray:
+        return self.counter_uniforms(ids, 2, RandomStreams.STREAM_BSM, epoch)
+
+    # returns: count uniform numbers in [0, 1) for every id, shape (count, len(ids))
+    # counter based, a number only depends on the seed, the key, the id and its place, not on which other ids are drawn
+    # with it or in which order (splitmix64 of the id, offset by a value drawn for the key)
+    def counter_uniforms(self, ids, count, *key) -> np.ndarray:
+
+        offsets = np.random.SeedSequence(self.seed_sequence.entropy, spawn_key=self.seed_sequence.spawn_key + key) \
+            .generate_state(count, dtype=np.uint64)
+
+        x = np.asarray(ids).astype(np.uint64)[np.newaxis, :] * np.uint64(0x9e3779b97f4a7c15) + offsets[:, np.newaxis]
+        x ^= x >> np.uint64(30)
+        x *= np.uint64(0xbf58476d1ce4e5b9)
+        x ^= x >> np.uint64(27)
+        x *= np.uint64(0x94d049bb133111eb)
+        x ^= x >> np.uint64(31)
+
+        # top 53 bits, the most a float64 holds
+        return (x >> np.uint64(11)).astype(np.float64) * 2.0**-53
+
+    # used for the train/test split of an iteration of test_models() and the models trained on it
+    def split(self, iteration) -> np.random.Generator:
+        return self.generator(RandomStreams.STREAM_SPLIT, iteration)
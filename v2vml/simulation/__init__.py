@@ -1 +1,9 @@
 from .simulation import *
+from .neighbors import *
+from .neighbor_tracker import *
+from .node_table import *
+from .vector_simulation import *
+from .tiled_simulation import *
+from .factory import *
+from .checkpoint import *
+from .gather import *
@@ -0,0 +1,151 @@
+import io
+import numpy as np
+import os
+import struct
+import threading
+import v2vml.configuration as conf
+from v2vml.simulation.simulation import Simulation
+from v2vml.simulation.vector_simulation import VectorSimulation
+
+
+# checkpoint file layout:
+#   CHECKPOINT_MAGIC | version (little endian uint32) | compressed npz archive of the simulation's state
+# the version is increased whenever the saved state, or how a resumed run draws its random numbers, changes
+CHECKPOINT_MAGIC = b'V2VMLCKP'
+CHECKPOINT_VERSION = 4
+
+# simulation class of each engine that can be checkpointed
+CHECKPOINT_ENGINES = {
+    conf.SIM_ENGINE_OBJECT: Simulation,
+    conf.SIM_ENGINE_VECTOR: VectorSimulation,
+}
+
+
+# returns: the state of the simulation and the settings it depends on
+# the arrays are copies, so they can be written while the simulation keeps running
+def checkpoint_state(sim) -> dict:
+
+    engine = None
+    for key, cls in CHECKPOINT_ENGINES.items():
+        if type(sim) is cls:
+            engine = key
+
+    if engine is None:
+        raise ValueError('{} can not be checkpointed'.format(type(sim).__name__))
+
+    state = sim.get_state()
+
+    # the random streams only depend on the seed and the counters saved by the simulation
+    seed_sequence = sim.streams.seed_sequence
+    state['seed_entropy'] = np.array(str(seed_sequence.entropy))
+    state['seed_spawn_key'] = np.array(seed_sequence.spawn_key, dtype=np.int64)
+
+    state['engine'] = np.array(engine)
+    state['num_initial_nodes'] = np.array(sim.num_initial_nodes)
+    state['settings'] = np.array([conf.CANVAS_WIDTH, conf.CANVAS_HEIGHT, conf.MAX_COORD_HIST, conf.MAX_BSM_HIST,
+                                  conf.NEIGHBOR_MODE])
+
+    return state
+
+
+# the file is written next to path and then moved over it, so a crash never leaves half a checkpoint
+def write_checkpoint(path, state):
+
+    tmp_path = path + '.tmp'
+
+    with open(tmp_path, 'wb') as out_file:
+        out_file.write(CHECKPOINT_MAGIC)
+        out_file.write(struct.pack('<I', CHECKPOINT_VERSION))
+        np.savez_compressed(out_file, **state)
+        out_file.flush()
+        os.fsync(out_file.fileno())
+
+    os.replace(tmp_path, path)
+
+
+# returns: the state saved by write_checkpoint()
+def read_checkpoint(path) -> dict:
+
+    with open(path, 'rb') as in_file:
+        data = in_file.read()
+
+    header_size = len(CHECKPOINT_MAGIC) + 4
+    if data[:len(CHECKPOINT_MAGIC)] != CHECKPOINT_MAGIC:
+        raise ValueError('{} is not a checkpoint file'.format(path))
+
+    version, = struct.unpack('<I', data[len(CHECKPOINT_MAGIC):header_size])
+    if version != CHECKPOINT_VERSION:
+        raise ValueError('{} has checkpoint version {}, expected {}'.format(path, version, CHECKPOINT_VERSION))
+
+    with np.load(io.BytesIO(data[header_size:]), allow_pickle=False) as archive:
+        return {name: archive[name] for name in archive.files}
+
+
+# returns: the simulation saved in the checkpoint at path, ready to continue with the next epoch
+# raw_data_dir: where MODE_GATHER_DATA writes the node files, the open ones are cut back to the checkpoint
+def load_checkpoint(path, raw_data_dir='./data/raw_data'):
+
+    state = read_checkpoint(path)
+
+    settings = [conf.CANVAS_WIDTH, conf.CANVAS_HEIGHT, conf.MAX_COORD_HIST, conf.MAX_BSM_HIST, conf.NEIGHBOR_MODE]
+    if state['settings'].tolist() != settings:
+        raise ValueError('{} was written with different CANVAS_WIDTH, CANVAS_HEIGHT, MAX_COORD_HIST, MAX_BSM_HIST '
+                         'or NEIGHBOR_MODE settings'.format(path))
+
+    seed_sequence = np.random.SeedSequence(int(state['seed_entropy']), spawn_key=tuple(state['seed_spawn_key'].tolist()))
+
+    cls = CHECKPOINT_ENGINES[int(state['engine'])]
+    sim = cls(0, seed_sequence=seed_sequence, raw_data_dir=raw_data_dir)
+    sim.num_initial_nodes = int(state['num_initial_nodes'])
+    sim.set_state(state)
+
+    return sim
+
+
+# writes a checkpoint every interval epochs
+# the state is copied on the calling thread and written to disk on a background thread,
+# so the epoch loop only waits if the previous checkpoint is still being written
+class Checkpointer:
+
+    # interval: epochs between checkpoints, 0 to never write one
+    def __init__(self, path, interval):
+
+        self.path = path
+        self.interval = interval
+
+        self.thread = None
+        self.error = None
+
+    # call after every epoch
+    def after_epoch(self, sim):
+        if self.interval > 0 and sim.epoch % self.interval == 0:
+            self.save(sim)
+
+    def save(self, sim):
+
+        state = checkpoint_state(sim)
+
+        self.wait()
+        self.thread = threading.Thread(target=self.write, args=(state,), daemon=True)
+        self.thread.start()
+
+    def write(self, state):
+        try:
+            write_checkpoint(self.path, state)
+        except Exception as e:
+            self.error = e
+
+    # waits for the checkpoint being written, raises the error if writing it failed
+    def wait(self):
+
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+        if self.error is not None:
+            error = self.error
+            self.error = None
+            raise error
+
+    def close(self):
+        self.wait()
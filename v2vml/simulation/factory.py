@@ -0,0 +1,16 @@
+import v2vml.configuration as conf
+from v2vml.simulation.simulation import Simulation
+from v2vml.simulation.tiled_simulation import TiledSimulation
+from v2vml.simulation.vector_simulation import VectorSimulation
+
+
+# creates the simulation selected by SIM_ENGINE in the configuration file
+def create_simulation(num_initial_nodes, seed_sequence=None, raw_data_dir='./data/raw_data'):
+
+    if conf.SIM_ENGINE == conf.SIM_ENGINE_VECTOR:
+        return VectorSimulation(num_initial_nodes, seed_sequence=seed_sequence, raw_data_dir=raw_data_dir)
+
+    if conf.SIM_ENGINE == conf.SIM_ENGINE_TILED:
+        return TiledSimulation(num_initial_nodes, seed_sequence=seed_sequence, raw_data_dir=raw_data_dir)
+
+    return Simulation(num_initial_nodes, seed_sequence=seed_sequence, raw_data_dir=raw_data_dir)
@@ -0,0 +1,202 @@
+import multiprocessing
+import numpy as np
+import os
+import shutil
+import v2vml.configuration as conf
+from v2vml.ml.feature_store import FeatureStoreWriter, append_feature_store, move_feature_store
+from v2vml.simulation.checkpoint import Checkpointer, load_checkpoint
+from v2vml.simulation.factory import create_simulation
+from v2vml.storage import ThreadedRawDataWriter, features_dir, merge_store, store_dir, write_index
+
+
+# sub directory for each node type, indexed by type
+NODE_TYPE_DIRS = ['good', 'faulty', 'malicious']
+
+
+# runs the simulation(s) for MODE_GATHER_DATA and writes the node files to raw_data_dir
+# with GATHER_DATA_EXTRACT_FEATURES, the feature files are written to processed_data_dir
+# returns: a summary of the run, see write_summary()
+def gather_data(raw_data_dir='./data/raw_data', processed_data_dir='./data/processed_data') -> dict:
+
+    master = np.random.SeedSequence(conf.SEED)
+
+    # a node's samples would be split between the tiles it drives through
+    if conf.GATHER_DATA_EXTRACT_FEATURES and conf.SIM_ENGINE == conf.SIM_ENGINE_TILED:
+        raise ValueError('GATHER_DATA_EXTRACT_FEATURES does not support SIM_ENGINE_TILED')
+
+    # only the engines in CHECKPOINT_ENGINES can be checkpointed, found out now instead of at the first checkpoint
+    if conf.GATHER_DATA_CHECKPOINT_INTERVAL > 0 and conf.SIM_ENGINE == conf.SIM_ENGINE_TILED:
+        raise ValueError('SIM_ENGINE_TILED can not be checkpointed, set GATHER_DATA_CHECKPOINT_INTERVAL to 0')
+
+    if conf.GATHER_DATA_NUM_SHARDS <= 1:
+        summary = run_simulation(raw_data_dir, master, verbose=True)
+
+    # the processes of a pool can not start the tile processes
+    elif conf.SIM_ENGINE == conf.SIM_ENGINE_TILED:
+        raise ValueError('SIM_ENGINE_TILED runs a single simulation, set GATHER_DATA_NUM_SHARDS to 1')
+
+    else:
+        summary = run_shards(raw_data_dir, master, conf.GATHER_DATA_NUM_SHARDS, conf.GATHER_DATA_NUM_WORKERS)
+
+    # combines the node-offset indexes of every chunk
+    if conf.RAW_DATA_FORMAT != conf.RAW_DATA_FORMAT_CSV and os.path.isdir(store_dir(raw_data_dir)):
+        write_index(store_dir(raw_data_dir))
+
+    if conf.GATHER_DATA_EXTRACT_FEATURES:
+        os.makedirs(processed_data_dir, exist_ok=True)
+        if conf.PROCESSED_DATA_FORMAT == conf.PROCESSED_DATA_FORMAT_STORE:
+            move_feature_store(features_dir(raw_data_dir), processed_data_dir)
+        else:
+            move_node_files(features_dir(raw_data_dir), processed_data_dir, 0)
+        os.rmdir(features_dir(raw_data_dir))
+
+    return summary
+
+
+# runs one simulation for GATHER_DATA_NUM_EPOCHS epochs
+# with GATHER_DATA_RESUME, continues from the checkpoint in raw_data_dir if there is one
+def run_simulation(raw_data_dir, seed_sequence, verbose=False) -> dict:
+
+    path = checkpoint_path(raw_data_dir)
+
+    if conf.GATHER_DATA_RESUME and os.path.isfile(path):
+        sim = load_checkpoint(path, raw_data_dir)
+        if verbose:
+            print('resuming from epoch', sim.epoch)
+    else:
+        sim = create_simulation(conf.NUM_INITIAL_NODES, seed_sequence=seed_sequence, raw_data_dir=raw_data_dir)
+
+    checkpointer = Checkpointer(path, conf.GATHER_DATA_CHECKPOINT_INTERVAL)
+
+    while sim.epoch < conf.GATHER_DATA_NUM_EPOCHS:
+
+        if verbose and sim.epoch % 100 == 0:
+            print('epoch {}...'.format(sim.epoch))
+
+        sim.next_epoch()
+        checkpointer.after_epoch(sim)
+
+    if verbose:
+        print('epoch', sim.epoch)
+
+    checkpointer.close()
+    sim.close_node_files()
+
+    if verbose and isinstance(getattr(sim, 'writer', None), ThreadedRawDataWriter):
+        print('raw data writer:', ', '.join('{} {:.6g}'.format(k, v) for k, v in sim.writer.stats().items()))
+
+    # the run is complete, there is nothing left to resume
+    if os.path.isfile(path):
+        os.remove(path)
+
+    return {
+        'epochs': sim.epoch,
+        'seed': sim.streams.seed,
+        'shards': 1,
+        'nodes': sim.next_node_id,
+        'good': sim.lifetime_good_nodes,
+        'faulty': sim.lifetime_faulty_nodes,
+        'malicious': sim.lifetime_malicious_nodes,
+    }
+
+
+# runs num_shards independent simulations on a pool of num_workers processes
+# shard k is seeded with the master seed and k, so the data does not depend on num_workers
+def run_shards(raw_data_dir, master, num_shards, num_workers) -> dict:
+
+    tasks = [(raw_data_dir, master.entropy, master.spawn_key + (shard,), shard) for shard in range(num_shards)]
+
+    summaries = [None] * num_shards
+    with multiprocessing.Pool(num_workers) as pool:
+        for shard, summary in pool.imap_unordered(run_shard, tasks):
+            summaries[shard] = summary
+            print('shard {} done ({} nodes)'.format(shard, summary['nodes']))
+
+    merge_shards(raw_data_dir, summaries)
+
+    summary = {
+        'epochs': conf.GATHER_DATA_NUM_EPOCHS,
+        'seed': master.entropy,
+        'shards': num_shards,
+    }
+    for key in ['nodes', 'good', 'faulty', 'malicious']:
+        summary[key] = sum(s[key] for s in summaries)
+
+    return summary
+
+
+def checkpoint_path(raw_data_dir) -> str:
+    return raw_data_dir + '/checkpoint.bin'
+
+
+def shard_dir(raw_data_dir, shard) -> str:
+    return '{}/shards/shard_{}'.format(raw_data_dir, shard)
+
+
+# runs in a worker process
+def run_shard(task) -> tuple:
+
+    raw_data_dir, entropy, spawn_key, shard = task
+
+    # workers that do not fork start from the configuration file
+    conf.MODE = conf.MODE_GATHER_DATA
+
+    out_dir = shard_dir(raw_data_dir, shard)
+    for type_dir in NODE_TYPE_DIRS:
+        os.makedirs(out_dir + '/' + type_dir, exist_ok=True)
+
+    seed_sequence = np.random.SeedSequence(entropy, spawn_key=spawn_key)
+    return shard, run_simulation(out_dir, seed_sequence)
+
+
+# moves every shard's node files (or chunks) into raw_data_dir
+# node ids are shifted by the number of nodes in the shards before it, so they stay unique
+def merge_shards(raw_data_dir, summaries):
+
+    # the feature stores of the shards are appended to one store
+    feature_store = None
+    if conf.GATHER_DATA_EXTRACT_FEATURES and conf.PROCESSED_DATA_FORMAT == conf.PROCESSED_DATA_FORMAT_STORE:
+        feature_store = FeatureStoreWriter(features_dir(raw_data_dir))
+
+    offset = 0
+    for shard, summary in enumerate(summaries):
+
+        src_store = store_dir(shard_dir(raw_data_dir, shard))
+        if os.path.isdir(src_store):
+            merge_store(src_store, store_dir(raw_data_dir), offset, 'shard{}_'.format(shard))
+
+        for type_dir in NODE_TYPE_DIRS:
+            move_node_files('{}/{}'.format(shard_dir(raw_data_dir, shard), type_dir),
+                            '{}/{}'.format(raw_data_dir, type_dir), offset)
+
+        src_features = features_dir(shard_dir(raw_data_dir, shard))
+        if feature_store is not None:
+            append_feature_store(feature_store, src_features, offset)
+        elif os.path.isdir(src_features):
+            os.makedirs(features_dir(raw_data_dir), exist_ok=True)
+            move_node_files(src_features, features_dir(raw_data_dir), offset)
+
+        offset += summary['nodes']
+
+    if feature_store is not None:
+        feature_store.close()
+
+    shutil.rmtree(raw_data_dir + '/shards')
+
+
+# moves the Node_<id>.csv files in src_dir to dst_dir, adding id_offset to their ids
+def move_node_files(src_dir, dst_dir, id_offset):
+    for file in os.listdir(src_dir):
+        node_id = int(file[len('Node_'):-len('.csv')])
+        os.replace(src_dir + '/' + file, '{}/Node_{}.csv'.format(dst_dir, node_id + id_offset))
+
+
+# brief summary
+def write_summary(path, summary):
+    with open(path, 'w') as out_file:
+        out_file.write('Num epochs:' + str(summary['epochs']) + '\n')
+        out_file.write('Num shards:' + str(summary['shards']) + '\n')
+        out_file.write('Seed:' + str(summary['seed']) + '\n')
+        out_file.write('Num good:' + str(summary['good']) + '\n')
+        out_file.write('Num faulty:' + str(summary['faulty']) + '\n')
+        out_file.write('Num malicious:' + str(summary['malicious']) + '\n')
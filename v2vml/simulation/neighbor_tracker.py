@@ -0,0 +1,177 @@
+from collections import namedtuple
+import numpy as np
+import v2vml.configuration as conf
+import v2vml.globals as g
+from v2vml.node import Node
+from v2vml.simulation.neighbors import create_neighbor_finder, empty_pairs
+
+
+# the links that appeared and disappeared during one epoch
+# each link is a (smaller id, larger id) tuple
+NeighborDelta = namedtuple('NeighborDelta', ['epoch', 'inner_added', 'inner_removed', 'outer_added', 'outer_removed'])
+
+
+# keeps the neighbor graph between epochs
+#
+# a node moves at most Node.SPEED_MAX per epoch, so two nodes that are further apart than
+# the outer radius plus 2*Node.SPEED_MAX*NEIGHBOR_SKIN_EPOCHS cannot become neighbors within
+# NEIGHBOR_SKIN_EPOCHS epochs. only the pairs closer than that (the candidates) are checked
+# every epoch, and the candidates are found again once they are too old.
+# nodes that join in between are compared against every node when they first show up.
+class NeighborTracker:
+
+    def __init__(self):
+
+        self.inner_limit = g.RADIUS_SENSOR**2
+        self.outer_limit = (2*g.RADIUS_SENSOR)**2
+
+        self.skin_epochs = conf.NEIGHBOR_SKIN_EPOCHS
+        candidate_radius = 2*g.RADIUS_SENSOR + 2*Node.SPEED_MAX*self.skin_epochs
+        self.candidate_limit = candidate_radius**2
+        self.candidate_finder = create_neighbor_finder(outer_radius=candidate_radius)
+
+        # epoch the candidates were last found from scratch
+        self.built_epoch = None
+
+        # candidate pairs, as rows of last epoch
+        self.candidates = empty_pairs()
+
+        # ids of the nodes seen last epoch, by row
+        self.known_ids = np.empty(0, dtype=np.int64)
+
+        # current links, encoded by link_keys()
+        self.inner_keys = np.empty(0, dtype=np.int64)
+        self.outer_keys = np.empty(0, dtype=np.int64)
+
+        # called with a NeighborDelta after every epoch
+        self.subscribers = []
+
+    # arrays needed to continue tracking later, the subscribers are not included
+    def get_state(self) -> dict:
+        return {
+            'tracker_built_epoch': np.array(-1 if self.built_epoch is None else self.built_epoch),
+            'tracker_candidates': self.candidates.copy(),
+            'tracker_known_ids': self.known_ids.copy(),
+            'tracker_inner_keys': self.inner_keys.copy(),
+            'tracker_outer_keys': self.outer_keys.copy(),
+        }
+
+    def set_state(self, state):
+
+        built_epoch = int(state['tracker_built_epoch'])
+        self.built_epoch = built_epoch if built_epoch >= 0 else None
+
+        self.candidates = state['tracker_candidates']
+        self.known_ids = state['tracker_known_ids']
+        self.inner_keys = state['tracker_inner_keys']
+        self.outer_keys = state['tracker_outer_keys']
+
+    def subscribe(self, callback):
+        self.subscribers.append(callback)
+
+    def publish(self, delta):
+        for callback in self.subscribers:
+            callback(delta)
+
+    # input: the id and position of every node this epoch
+    # returns: (inner_pairs, outer_pairs, delta), the pairs are rows with the smaller row first
+    def update(self, epoch, ids, x, y) -> tuple:
+
+        ids = np.asarray(ids, dtype=np.int64)
+        x = np.asarray(x, dtype=np.int64)
+        y = np.asarray(y, dtype=np.int64)
+
+        order = np.argsort(ids)
+        sorted_ids = ids[order]
+
+        if self.built_epoch is None or epoch - self.built_epoch > self.skin_epochs:
+            _, cand_rows = self.candidate_finder.find(x, y)
+            self.built_epoch = epoch
+
+        else:
+
+            # rows may have moved since last epoch, nodes that left have no row
+            rows, found = NeighborTracker.lookup(order, sorted_ids, self.known_ids)
+            remap = np.where(found, rows, -1)
+
+            # forget the candidates of nodes that left
+            cand_rows = remap[self.candidates]
+            cand_rows = cand_rows[(cand_rows >= 0).all(axis=1)]
+
+            # add the candidates of nodes that just joined
+            is_new = ~np.isin(ids, self.known_ids, assume_unique=True)
+            if is_new.any():
+                cand_rows = np.concatenate((cand_rows, self.new_node_candidates(is_new, x, y)))
+
+        self.candidates = cand_rows
+        self.known_ids = ids.copy()
+
+        # check the candidates
+        i = cand_rows[:, 0]
+        j = cand_rows[:, 1]
+        dx = x[i] - x[j]
+        dy = y[i] - y[j]
+        dist = dx*dx + dy*dy
+
+        rows = np.column_stack((np.minimum(i, j), np.maximum(i, j)))
+        outer_pairs = rows[dist <= self.outer_limit]
+        inner_pairs = rows[dist <= self.inner_limit]
+
+        # compare against last epoch's links
+        inner_keys = NeighborTracker.link_keys(ids, inner_pairs)
+        outer_keys = NeighborTracker.link_keys(ids, outer_pairs)
+
+        delta = NeighborDelta(epoch,
+                              NeighborTracker.links(np.setdiff1d(inner_keys, self.inner_keys, assume_unique=True)),
+                              NeighborTracker.links(np.setdiff1d(self.inner_keys, inner_keys, assume_unique=True)),
+                              NeighborTracker.links(np.setdiff1d(outer_keys, self.outer_keys, assume_unique=True)),
+                              NeighborTracker.links(np.setdiff1d(self.outer_keys, outer_keys, assume_unique=True)))
+
+        self.inner_keys = inner_keys
+        self.outer_keys = outer_keys
+
+        return inner_pairs, outer_pairs, delta
+
+    # compares the new nodes with every node
+    # pairs of two new nodes are only returned once
+    def new_node_candidates(self, is_new, x, y) -> np.ndarray:
+
+        new_rows = np.flatnonzero(is_new)
+        block = max(1, 2**22 // len(x))
+
+        pairs = []
+        for start in range(0, len(new_rows), block):
+
+            rows = new_rows[start:start + block]
+            dx = x[rows, np.newaxis] - x[np.newaxis, :]
+            dy = y[rows, np.newaxis] - y[np.newaxis, :]
+
+            i, j = np.nonzero((dx*dx + dy*dy) <= self.candidate_limit)
+            i = rows[i]
+
+            keep = (i != j) & (~is_new[j] | (i < j))
+            pairs.append(np.column_stack((i[keep], j[keep])))
+
+        return np.concatenate(pairs)
+
+    # returns the rows of the given ids and whether each id was found
+    @staticmethod
+    def lookup(order, sorted_ids, query) -> tuple:
+
+        if len(sorted_ids) == 0:
+            return np.zeros(len(query), dtype=np.int64), np.zeros(len(query), dtype=np.bool_)
+
+        pos = np.minimum(np.searchsorted(sorted_ids, query), len(sorted_ids) - 1)
+        return order[pos], sorted_ids[pos] == query
+
+    # encodes each link as a single sorted integer, (smaller id << 32) | larger id
+    @staticmethod
+    def link_keys(ids, pairs) -> np.ndarray:
+        a = ids[pairs[:, 0]]
+        b = ids[pairs[:, 1]]
+        return np.sort((np.minimum(a, b) << 32) | np.maximum(a, b))
+
+    # decodes link keys back into (smaller id, larger id) tuples
+    @staticmethod
+    def links(keys) -> list:
+        return list(zip((keys >> 32).tolist(), (keys & 0xFFFFFFFF).tolist()))
@@ -0,0 +1,195 @@
+from abc import ABC, abstractmethod
+import numpy as np
+from typing import List
+import v2vml.configuration as conf
+import v2vml.globals as g
+
+
+# finds every pair of nodes whose inner or outer circles overlap
+# pairs are returned as an (n, 2) array of row numbers, the smaller row first
+# squared distances are compared, which matches calc.is_in_inner_radius() and
+# calc.is_in_outer_radius() exactly for integer coordinates
+class NeighborFinder(ABC):
+
+    def __init__(self, inner_radius=g.RADIUS_SENSOR, outer_radius=2*g.RADIUS_SENSOR):
+
+        self.inner_radius = inner_radius
+        self.outer_radius = outer_radius
+        self.inner_limit = inner_radius**2
+        self.outer_limit = outer_radius**2
+
+        super().__init__()
+
+    # returns (inner_pairs, outer_pairs)
+    def find(self, x, y) -> tuple:
+
+        x = np.asarray(x, dtype=np.int64)
+        y = np.asarray(y, dtype=np.int64)
+
+        if len(x) < 2:
+            return empty_pairs(), empty_pairs()
+
+        i, j = self._candidates(x, y)
+
+        # a single distance check decides both radii
+        dx = x[i] - x[j]
+        dy = y[i] - y[j]
+        dist = dx*dx + dy*dy
+
+        is_outer = dist <= self.outer_limit
+        i, j, dist = i[is_outer], j[is_outer], dist[is_outer]
+        is_inner = dist <= self.inner_limit
+
+        outer = np.column_stack((np.minimum(i, j), np.maximum(i, j)))
+        return outer[is_inner], outer
+
+    # returns two arrays of rows, every pair that could be within the outer radius appears exactly once
+    @abstractmethod
+    def _candidates(self, x, y) -> tuple:
+        pass
+
+
+# compares every node with every other node, a block of rows at a time
+class BruteForceNeighborFinder(NeighborFinder):
+
+    # number of node pairs compared at once
+    BLOCK_SIZE = 2**22
+
+    def _candidates(self, x, y) -> tuple:
+
+        n = len(x)
+        block = max(1, BruteForceNeighborFinder.BLOCK_SIZE // n)
+
+        all_i = []
+        all_j = []
+
+        for start in range(0, n, block):
+
+            stop = min(start + block, n)
+            dx = x[start:stop, np.newaxis] - x[np.newaxis, :]
+            dy = y[start:stop, np.newaxis] - y[np.newaxis, :]
+
+            # only keep pairs where the first row is smaller than the second
+            upper = np.arange(start, stop)[:, np.newaxis] < np.arange(n)[np.newaxis, :]
+
+            i, j = np.nonzero(((dx*dx + dy*dy) <= self.outer_limit) & upper)
+            all_i.append(i + start)
+            all_j.append(j)
+
+        return np.concatenate(all_i), np.concatenate(all_j)
+
+
+# buckets nodes into square cells as wide as the outer radius
+# a node can only be within the outer radius of nodes in its own cell or the 8 cells around it
+class GridNeighborFinder(NeighborFinder):
+
+    # half of the surrounding cells, so that each pair of cells is only visited once
+    # the cell itself is handled separately
+    CELL_OFFSETS = [(1, -1), (1, 0), (1, 1), (0, 1)]
+
+    def __init__(self, inner_radius=g.RADIUS_SENSOR, outer_radius=2*g.RADIUS_SENSOR):
+        super().__init__(inner_radius=inner_radius, outer_radius=outer_radius)
+        self.cell_size = outer_radius
+
+    def _candidates(self, x, y) -> tuple:
+
+        # cell coordinates, padded by one so that neighboring cells are never negative
+        cx = x // self.cell_size
+        cy = y // self.cell_size
+        cx = cx - cx.min() + 1
+        cy = cy - cy.min() + 1
+        height = int(cy.max()) + 2
+
+        # sort the nodes by cell
+        keys = cx*height + cy
+        order = np.argsort(keys, kind='stable')
+        sorted_keys = keys[order]
+        positions = np.arange(len(x))
+
+        all_i = []
+        all_j = []
+
+        # pairs within the same cell, only pair with the nodes sorted after this one
+        end = np.searchsorted(sorted_keys, sorted_keys, side='right')
+        i, j = GridNeighborFinder.expand(positions, positions + 1, end)
+        all_i.append(i)
+        all_j.append(j)
+
+        # pairs with the neighboring cells
+        for dx, dy in GridNeighborFinder.CELL_OFFSETS:
+            other = sorted_keys + (dx*height + dy)
+            start = np.searchsorted(sorted_keys, other, side='left')
+            end = np.searchsorted(sorted_keys, other, side='right')
+            i, j = GridNeighborFinder.expand(positions, start, end)
+            all_i.append(i)
+            all_j.append(j)
+
+        # back to rows
+        return order[np.concatenate(all_i)], order[np.concatenate(all_j)]
+
+    # pairs every position p with each position in [start[p], end[p])
+    @staticmethod
+    def expand(positions, start, end) -> tuple:
+
+        counts = np.maximum(end - start, 0)
+        total = int(counts.sum())
+
+        i = np.repeat(positions, counts)
+
+        # position within each run, added to the start of that run
+        run_start = np.repeat(np.cumsum(counts) - counts, counts)
+        j = np.repeat(start, counts) + (np.arange(total) - run_start)
+
+        return i, j
+
+
+# uses scipy's KD-tree to find nodes within the outer radius
+class KDTreeNeighborFinder(NeighborFinder):
+
+    def _candidates(self, x, y) -> tuple:
+
+        # scipy is installed alongside scikit-learn
+        from scipy.spatial import cKDTree
+
+        tree = cKDTree(np.column_stack((x, y)))
+        pairs = tree.query_pairs(self.outer_radius, output_type='ndarray')
+
+        return pairs[:, 0].astype(np.int64), pairs[:, 1].astype(np.int64)
+
+
+# creates the neighbor finder selected by NEIGHBOR_FINDER in the configuration file
+def create_neighbor_finder(inner_radius=g.RADIUS_SENSOR, outer_radius=2*g.RADIUS_SENSOR) -> NeighborFinder:
+
+    if conf.NEIGHBOR_FINDER == conf.NEIGHBOR_FINDER_BRUTE_FORCE:
+        return BruteForceNeighborFinder(inner_radius=inner_radius, outer_radius=outer_radius)
+
+    elif conf.NEIGHBOR_FINDER == conf.NEIGHBOR_FINDER_KD_TREE:
+        return KDTreeNeighborFinder(inner_radius=inner_radius, outer_radius=outer_radius)
+
+    return GridNeighborFinder(inner_radius=inner_radius, outer_radius=outer_radius)
+
+
+def empty_pairs() -> np.ndarray:
+    return np.empty((0, 2), dtype=np.int64)
+
+
+# input: pairs of rows
+# returns: for each row, the rows it is paired with in ascending order
+def pairs_to_adjacency(pairs, num_rows) -> List[List[int]]:
+
+    src = np.concatenate((pairs[:, 0], pairs[:, 1]))
+    dst = np.concatenate((pairs[:, 1], pairs[:, 0]))
+
+    order = np.lexsort((dst, src))
+    src = src[order]
+    dst = dst[order].tolist()
+
+    bounds = np.searchsorted(src, np.arange(num_rows + 1)).tolist()
+    return [dst[bounds[r]:bounds[r+1]] for r in range(num_rows)]
+
+
+# input: pairs of rows and the node id of each row
+# returns: a list of (smaller id, larger id) tuples
+def pairs_to_id_tuples(pairs, ids) -> List[tuple]:
+    pair_ids = np.asarray(ids)[pairs]
+    return list(zip(pair_ids.min(axis=1).tolist(), pair_ids.max(axis=1).tolist()))
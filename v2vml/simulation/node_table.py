@@ -0,0 +1,226 @@
+import numpy as np
+from typing import List
+import v2vml.calculations as calc
+import v2vml.configuration as conf
+import v2vml.globals as g
+from v2vml.node import Node
+
+
+# one row per vehicle, one numpy array per attribute
+# the arrays are views into a single buffer, which may be shared memory so that
+# several processes can work on the same table
+class NodeTable:
+
+    # (name, shape of one row, dtype) of every column
+    @staticmethod
+    def columns() -> List[tuple]:
+        return [
+            ('ids', (), np.int64),
+            ('types', (), np.int8),
+            ('dirs', (), np.int8),
+            ('speeds', (), np.int64),
+            ('x', (), np.int64),
+            ('y', (), np.int64),
+            ('vx', (), np.int64),
+            ('vy', (), np.int64),
+            ('has_appeared', (), np.bool_),
+            ('appear_epoch', (), np.int64),
+            ('exit_epoch', (), np.int64),
+            ('coord_hist', (conf.MAX_COORD_HIST, 2), np.int64),
+            ('coord_hist_len', (), np.int64),
+            ('bsm_hist', (conf.MAX_BSM_HIST, 2), np.float64),
+            ('bsm_hist_len', (), np.int64),
+            ('last_bsm', (2,), np.float64),
+            # created since the last time the rows were written to file
+            ('is_new', (), np.bool_),
+        ]
+
+    # returns: (byte offset of each column, total number of bytes) for capacity rows
+    # the first 8 bytes hold the number of rows in use
+    @staticmethod
+    def layout(capacity) -> tuple:
+
+        offsets = {}
+        nbytes = 8
+
+        for name, shape, dtype in NodeTable.columns():
+            offsets[name] = nbytes
+            column_bytes = capacity * int(np.prod(shape)) * np.dtype(dtype).itemsize
+            nbytes += -(-column_bytes // 8) * 8
+
+        return offsets, nbytes
+
+    # buffer: anything that supports the buffer protocol and is at least layout(capacity) bytes
+    def __init__(self, capacity, buffer=None):
+
+        offsets, nbytes = NodeTable.layout(capacity)
+
+        if buffer is None:
+            buffer = bytearray(nbytes)
+
+        self.capacity = capacity
+        self.buffer = buffer
+        self.meta = np.frombuffer(buffer, dtype=np.int64, count=1)
+
+        for name, shape, dtype in NodeTable.columns():
+            count = capacity * int(np.prod(shape))
+            column = np.frombuffer(buffer, dtype=dtype, count=count, offset=offsets[name])
+            setattr(self, name, column.reshape((capacity,) + shape))
+
+    # number of rows in use
+    @property
+    def size(self) -> int:
+        return int(self.meta[0])
+
+    @size.setter
+    def size(self, value):
+        self.meta[0] = value
+
+    # returns a copy of the table that can hold capacity rows
+    def resized(self, capacity):
+
+        table = NodeTable(capacity)
+
+        n = self.size
+        for name, _, _ in NodeTable.columns():
+            getattr(table, name)[:n] = getattr(self, name)[:n]
+        table.size = n
+
+        return table
+
+    # input: one array per column, columns that are left out are set to zero
+    def append(self, rows):
+
+        count = len(rows['ids'])
+        if self.size + count > self.capacity:
+            raise ValueError('table is full ({} rows)'.format(self.capacity))
+
+        new = slice(self.size, self.size + count)
+        for name, _, _ in NodeTable.columns():
+            getattr(self, name)[new] = rows.get(name, 0)
+
+        self.size += count
+
+    # returns: a copy of the given rows, one array per column
+    def take(self, rows) -> dict:
+        return {name: getattr(self, name)[rows].copy() for name, _, _ in NodeTable.columns()}
+
+    # removes the given rows, the remaining rows keep their order
+    def remove(self, rows):
+
+        if len(rows) == 0:
+            return
+
+        keep = np.ones(self.size, dtype=np.bool_)
+        keep[rows] = False
+        new_size = self.size - len(rows)
+
+        for name, _, _ in NodeTable.columns():
+            column = getattr(self, name)
+            column[:new_size] = column[:self.size][keep]
+
+        self.size = new_size
+
+    # returns: the columns of count new nodes, see Node.__init__()
+    # first_id: id of the first new node, the others follow in order
+    @staticmethod
+    def new_rows(rng, count, on_canvas, first_id, epoch) -> dict:
+
+        ids = np.arange(first_id, first_id + count)
+
+        dirs = rng.integers(1, 5, size=count)
+        types = NodeTable.random_node_types(rng, count)
+        speeds = rng.integers(Node.SPEED_MIN, Node.SPEED_MAX + 1, size=count)
+
+        x = rng.integers(0, conf.CANVAS_WIDTH + 1, size=count)
+        y = rng.integers(0, conf.CANVAS_HEIGHT + 1, size=count)
+
+        # nodes placed off the canvas start just outside of the edge they are driving towards
+        if not on_canvas:
+            x[dirs == g.EAST] = 0 - g.RADIUS_SENSOR
+            x[dirs == g.WEST] = conf.CANVAS_WIDTH + g.RADIUS_SENSOR
+            y[dirs == g.NORTH] = conf.CANVAS_HEIGHT + g.RADIUS_SENSOR
+            y[dirs == g.SOUTH] = 0 - g.RADIUS_SENSOR
+
+        # velocity per epoch
+        vx = np.where(dirs == g.EAST, speeds, 0) - np.where(dirs == g.WEST, speeds, 0)
+        vy = np.where(dirs == g.SOUTH, speeds, 0) - np.where(dirs == g.NORTH, speeds, 0)
+
+        # see Node.set_lifetime()
+        horizontal = (dirs == g.EAST) | (dirs == g.WEST)
+        first, last = calc.epochs_on_canvas(np.where(horizontal, x, y), np.where(horizontal, vx, vy),
+                                            np.where(horizontal, conf.CANVAS_WIDTH, conf.CANVAS_HEIGHT))
+        appear_epoch = np.where(first <= last, epoch + first, np.iinfo(np.int64).max)
+
+        return {
+            'ids': ids,
+            'types': types,
+            'dirs': dirs,
+            'speeds': speeds,
+            'x': x,
+            'y': y,
+            'vx': vx,
+            'vy': vy,
+            'has_appeared': on_canvas,
+            'appear_epoch': epoch if on_canvas else appear_epoch,
+            'exit_epoch': epoch + last + conf.MAX_COORD_HIST + 1,
+            'is_new': True,
+        }
+
+    # same distribution as Node.random_node_type()
+    @staticmethod
+    def random_node_types(rng, count) -> np.ndarray:
+
+        ran = rng.random(count) * 100
+
+        types = np.full(count, Node.MALICIOUS, dtype=np.int8)
+        types[ran <= conf.PERCENT_GOOD + conf.PERCENT_FAULTY] = Node.FAULTY
+        types[ran <= conf.PERCENT_GOOD] = Node.GOOD
+
+        return types
+
+    # moves every node one epoch and creates its bsm, the bsm errors come from streams, see RandomStreams.bsm()
+    # same steps as Node.update(), but for every node at once
+    def move(self, epoch, streams):
+
+        n = self.size
+
+        # manages location history (for the visualizer)
+        # every node adds one entry per epoch, so all nodes share the same ring buffer slot
+        slot = epoch % conf.MAX_COORD_HIST
+        self.coord_hist[:n, slot, 0] = self.x[:n]
+        self.coord_hist[:n, slot, 1] = self.y[:n]
+        np.minimum(self.coord_hist_len[:n] + 1, conf.MAX_COORD_HIST, out=self.coord_hist_len[:n])
+
+        # moves the nodes
+        self.x[:n] += self.vx[:n]
+        self.y[:n] += self.vy[:n]
+
+        # creates new bsms and updates the bsm history, see Node.new_bsm_coord()
+        error_x, error_y = Node.bsm_errors(streams.bsm(epoch, self.ids[:n]), self.types[:n])
+        self.last_bsm[:n, 0] = self.x[:n] + error_x
+        self.last_bsm[:n, 1] = self.y[:n] + error_y
+
+        slot = epoch % conf.MAX_BSM_HIST
+        self.bsm_hist[:n, slot] = self.last_bsm[:n]
+        np.minimum(self.bsm_hist_len[:n] + 1, conf.MAX_BSM_HIST, out=self.bsm_hist_len[:n])
+
+        self.has_appeared[:n] |= self.appear_epoch[:n] <= epoch
+
+    # rows of the nodes that left the canvas by the given epoch
+    def due(self, epoch) -> np.ndarray:
+        return np.flatnonzero(self.exit_epoch[:self.size] <= epoch)
+
+    # hands current location and the location specified in the bsm of every node to the writer
+    def write_raw_data(self, writer, epoch):
+        n = self.size
+        writer.write(epoch, self.ids[:n], self.types[:n], self.x[:n], self.y[:n], self.last_bsm[:n, 0], self.last_bsm[:n, 1])
+
+    # entries of a history column, oldest to newest
+    def history(self, name, row, epoch) -> List[tuple]:
+
+        hist = getattr(self, name)
+        hist_len = getattr(self, name + '_len')
+
+        slots = np.arange(epoch - hist_len[row] + 1, epoch + 1) % hist.shape[1]
+        return [tuple(p) for p in hist[row, slots].tolist()]
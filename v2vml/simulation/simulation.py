@@ -1,11 +1,22 @@
-import v2vml.calculations as calc
+import heapq
+import numpy as np
 import v2vml.configuration as conf
 from v2vml.node import Node
+from v2vml.random_streams import RandomStreams
+from v2vml.simulation.neighbor_tracker import NeighborTracker
+from v2vml.simulation.neighbors import create_neighbor_finder, pairs_to_adjacency, pairs_to_id_tuples
+from v2vml.storage import create_raw_data_writer
 
 
 class Simulation:
 
-    def __init__(self, num_initial_nodes):
+    # events kept in the lifetime queue
+    EVENT_APPEAR = 0
+    EVENT_EXIT = 1
+
+    # seed_sequence: numpy SeedSequence all random numbers are drawn from, defaults to SEED
+    # raw_data_dir: where MODE_GATHER_DATA writes the node files
+    def __init__(self, num_initial_nodes, seed_sequence=None, raw_data_dir='./data/raw_data'):
 
         # current iteration of the simulation
         self.epoch = 0
@@ -13,16 +24,47 @@ class Simulation:
         # number of nodes to create at the start of the simulation
         self.num_initial_nodes = num_initial_nodes
 
+        # random numbers, the same seed always gives the same simulation
+        self.streams = RandomStreams(seed_sequence)
+
+        # ids are unique over the lifetime of the simulation
+        self.next_node_id = 0
+
+        self.raw_data_dir = raw_data_dir
+
+        # MODE_GATHER_DATA output
+        self.writer = None
+        if conf.MODE == conf.MODE_GATHER_DATA:
+            self.writer = create_raw_data_writer(raw_data_dir)
+
         # nodes present in the simulation
         self.nodes = []
 
         # hashmap of nodes present in the simulation
         self.hm_nodes = {}
 
+        # position of each node in self.nodes, keyed by node id
+        self.node_index = {}
+
+        # min-heap of (epoch, event, node id)
+        # nodes know when they appear and exit as soon as they are created
+        self.lifetime_events = []
+
         # a set of all neighbors within the simulation
         self.inner_neighbor_tuples = []
         self.outer_neighbor_tuples = []
 
+        # finds the nodes whose circles overlap
+        self.neighbor_finder = create_neighbor_finder()
+
+        # keeps the neighbors up to date between epochs
+        # the tuples are updated in place, so they are kept as actual sets
+        self.neighbor_tracker = None
+        if conf.NEIGHBOR_MODE == conf.NEIGHBOR_MODE_INCREMENTAL:
+            self.neighbor_tracker = NeighborTracker()
+            self.inner_neighbor_tuples = set()
+            self.outer_neighbor_tuples = set()
+
         # keeps track of total node type counts over the lifetime of the simulation
         self.lifetime_good_nodes = 0
         self.lifetime_faulty_nodes = 0
@@ -41,10 +83,20 @@ class Simulation:
 
     # adds a node to the simulation
     def create_node(self, on_canvas=True):
-        n = Node(on_canvas=on_canvas)
+        n = Node(on_canvas=on_canvas, epoch=self.epoch, node_id=self.next_node_id, rng=self.streams.node(self.next_node_id))
+        self.next_node_id += 1
+
+        if self.writer is not None:
+            self.writer.add_nodes([n.id], [n.type])
+
+        self.node_index[n.id] = len(self.nodes)
         self.nodes.append(n)
         self.hm_nodes[n.id] = n
 
+        if n.appear_epoch is not None and not n.has_appeared:
+            heapq.heappush(self.lifetime_events, (n.appear_epoch, Simulation.EVENT_APPEAR, n.id))
+        heapq.heappush(self.lifetime_events, (n.exit_epoch, Simulation.EVENT_EXIT, n.id))
+
         if n.type == Node.GOOD:
             self.lifetime_good_nodes += 1
         elif n.type == Node.FAULTY:
@@ -53,60 +105,233 @@ class Simulation:
             self.lifetime_malicious_nodes += 1
 
     # removes a node from the simulation
+    # the last node takes the removed node's place, so the order of self.nodes is not kept
     def remove_node(self, n):
 
-        # close the out file
-        if conf.MODE == conf.MODE_GATHER_DATA:
-            n.out_file.close()
+        # stop writing the node's raw data
+        if self.writer is not None:
+            self.writer.remove_nodes([n.id])
 
         del self.hm_nodes[n.id]
-        self.nodes.remove(n)
+
+        i = self.node_index.pop(n.id)
+        last = self.nodes.pop()
+
+        if last is not n:
+            self.nodes[i] = last
+            self.node_index[last.id] = i
 
     # moves nodes and adds new ones if necessary
     def move_nodes(self):
-        for n in self.nodes:
-            n.update()
 
-            if n.is_out():
-                self.remove_node(n)
-                self.create_node(on_canvas=False)
+        # BSM errors for every node are drawn at once
+        ids = np.fromiter((n.id for n in self.nodes), dtype=np.int64, count=len(self.nodes))
+        types = np.fromiter((n.type for n in self.nodes), dtype=np.int64, count=len(self.nodes))
+        error_x, error_y = Node.bsm_errors(self.streams.bsm(self.epoch, ids), types)
+
+        for n, ex, ey in zip(self.nodes, error_x.tolist(), error_y.tolist()):
+            n.update(ex, ey)
+
+        # writes current location and bsm location of every node
+        if self.writer is not None:
+            self.write_raw_data()
+
+        # nodes that went off the canvas this epoch
+        departed = []
+
+        # only look at the nodes that are due
+        while self.lifetime_events and self.lifetime_events[0][0] <= self.epoch:
+
+            _, event, node_id = heapq.heappop(self.lifetime_events)
+            n = self.hm_nodes[node_id]
+
+            if Simulation.EVENT_APPEAR == event:
+                n.has_appeared = True
+            else:
+                departed.append(n)
+
+        # the list is not changed while it is being walked
+        # nodes are replaced at the end of the epoch and the new nodes move starting next epoch
+        for n in departed:
+            self.remove_node(n)
+
+        for _ in range(len(departed)):
+            self.create_node(on_canvas=False)
+
+    def write_raw_data(self):
+
+        nodes = self.nodes
+        count = len(nodes)
+
+        self.writer.write(self.epoch,
+                          np.fromiter((n.id for n in nodes), dtype=np.int64, count=count),
+                          np.fromiter((n.type for n in nodes), dtype=np.int8, count=count),
+                          np.fromiter((n.x for n in nodes), dtype=np.int64, count=count),
+                          np.fromiter((n.y for n in nodes), dtype=np.int64, count=count),
+                          np.fromiter((n.last_bsm[0] for n in nodes), dtype=np.float64, count=count),
+                          np.fromiter((n.last_bsm[1] for n in nodes), dtype=np.float64, count=count))
 
     # nodes detect their neighbors
     def set_neighbors(self):
 
+        x = np.array([n.x for n in self.nodes], dtype=np.int64)
+        y = np.array([n.y for n in self.nodes], dtype=np.int64)
+        ids = [n.id for n in self.nodes]
+
+        if self.neighbor_tracker is not None:
+            self.update_neighbors(ids, x, y)
+            return
+
+        # both radii are checked in a single pass
+        inner_pairs, outer_pairs = self.neighbor_finder.find(x, y)
+
         # let all nodes know who their neighbors are
-        for i in range(len(self.nodes)):
+        # neighbors are listed in the same order as self.nodes
+        inner_rows = pairs_to_adjacency(inner_pairs, len(self.nodes))
+        outer_rows = pairs_to_adjacency(outer_pairs, len(self.nodes))
 
-            n1 = self.nodes[i]
-            n1.inner_neighbors = []
-            n1.outer_neighbors = []
+        for n, inner, outer in zip(self.nodes, inner_rows, outer_rows):
+            n.inner_neighbors = [ids[r] for r in inner]
+            n.outer_neighbors = [ids[r] for r in outer]
 
-            for j in range(len(self.nodes)):
+        # create a set (not list) of all neighbors
+        self.inner_neighbor_tuples = pairs_to_id_tuples(inner_pairs, ids)
+        self.outer_neighbor_tuples = pairs_to_id_tuples(outer_pairs, ids)
 
-                # don't compare a car to itself
-                if i == j:
-                    continue
+    # only applies the links that changed since the last epoch
+    # neighbors are listed in the order they were found
+    def update_neighbors(self, ids, x, y):
 
-                n2 = self.nodes[j]
+        _, _, delta = self.neighbor_tracker.update(self.epoch, ids, x, y)
 
-                if calc.is_in_inner_radius(n1.x, n1.y, n2.x, n2.y):
-                    n1.inner_neighbors.append(n2.id)
+        for links, tuples, attr in ((delta.inner_removed, self.inner_neighbor_tuples, 'inner_neighbors'),
+                                    (delta.outer_removed, self.outer_neighbor_tuples, 'outer_neighbors')):
+            for a, b in links:
+                tuples.discard((a, b))
 
-                if calc.is_in_outer_radius(n1.x, n1.y, n2.x, n2.y):
-                    n1.outer_neighbors.append(n2.id)
+                # nodes that left the simulation are not updated
+                if a in self.hm_nodes:
+                    getattr(self.hm_nodes[a], attr).remove(b)
+                if b in self.hm_nodes:
+                    getattr(self.hm_nodes[b], attr).remove(a)
 
-        # create a set (not list) of all neighbors
-        self.inner_neighbor_tuples = []
-        self.outer_neighbor_tuples = []
+        for links, tuples, attr in ((delta.inner_added, self.inner_neighbor_tuples, 'inner_neighbors'),
+                                    (delta.outer_added, self.outer_neighbor_tuples, 'outer_neighbors')):
+            for a, b in links:
+                tuples.add((a, b))
+                getattr(self.hm_nodes[a], attr).append(b)
+                getattr(self.hm_nodes[b], attr).append(a)
+
+        self.neighbor_tracker.publish(delta)
+
+    # callback is called with a NeighborDelta after every epoch
+    # requires NEIGHBOR_MODE_INCREMENTAL
+    def subscribe_neighbor_changes(self, callback):
+
+        if self.neighbor_tracker is None:
+            raise RuntimeError('neighbor changes are only published in NEIGHBOR_MODE_INCREMENTAL')
+
+        self.neighbor_tracker.subscribe(callback)
+
+    # everything needed to continue the simulation later, as numpy arrays, see checkpoint.py
+    def get_state(self) -> dict:
+
+        nodes = self.nodes
+        num_nodes = len(nodes)
+
+        coord_hist = np.zeros((num_nodes, conf.MAX_COORD_HIST, 2), dtype=np.int64)
+        bsm_hist = np.zeros((num_nodes, conf.MAX_BSM_HIST, 2), dtype=np.float64)
+        for row, n in enumerate(nodes):
+
+            # nodes that were just created have no history yet
+            if len(n.coord_hist):
+                coord_hist[row, :len(n.coord_hist)] = n.past_coord
+            if len(n.bsm_hist):
+                bsm_hist[row, :len(n.bsm_hist)] = n.past_bsm_coord
+
+        state = {
+            'epoch': np.array(self.epoch),
+            'next_node_id': np.array(self.next_node_id),
+            'lifetime_nodes': np.array([self.lifetime_good_nodes, self.lifetime_faulty_nodes,
+                                        self.lifetime_malicious_nodes]),
+            'ids': np.array([n.id for n in nodes], dtype=np.int64),
+            'types': np.array([n.type for n in nodes], dtype=np.int8),
+            'dirs': np.array([n.dir for n in nodes], dtype=np.int8),
+            'speeds': np.array([n.speed for n in nodes], dtype=np.int64),
+            'x': np.array([n.x for n in nodes], dtype=np.int64),
+            'y': np.array([n.y for n in nodes], dtype=np.int64),
+            'has_appeared': np.array([n.has_appeared for n in nodes], dtype=np.bool_),
+            'appear_epoch': np.array([-1 if n.appear_epoch is None else n.appear_epoch for n in nodes], dtype=np.int64),
+            'exit_epoch': np.array([n.exit_epoch for n in nodes], dtype=np.int64),
+            'coord_hist': coord_hist,
+            'coord_hist_len': np.array([len(n.coord_hist) for n in nodes], dtype=np.int64),
+            'bsm_hist': bsm_hist,
+            'bsm_hist_len': np.array([len(n.bsm_hist) for n in nodes], dtype=np.int64),
+            'last_bsm': np.array([n.last_bsm or (0, 0) for n in nodes], dtype=np.float64).reshape(num_nodes, 2),
+            'inner_neighbor_tuples': np.array(list(self.inner_neighbor_tuples), dtype=np.int64).reshape(-1, 2),
+            'outer_neighbor_tuples': np.array(list(self.outer_neighbor_tuples), dtype=np.int64).reshape(-1, 2),
+        }
+
+        # the neighbor lists in order, one after the other
+        for attr in ('inner_neighbors', 'outer_neighbors'):
+            lists = [getattr(n, attr) for n in nodes]
+            state[attr] = np.array([i for neighbors in lists for i in neighbors], dtype=np.int64)
+            state[attr + '_len'] = np.array([len(neighbors) for neighbors in lists], dtype=np.int64)
+
+        if self.neighbor_tracker is not None:
+            state.update(self.neighbor_tracker.get_state())
+
+        if self.writer is not None:
+            state.update(self.writer.get_state(state['ids']))
+
+        return state
+
+    # continues from a state saved by get_state()
+    # the raw data is cut back to where it was when the state was saved
+    def set_state(self, state):
+
+        self.epoch = int(state['epoch'])
+        self.next_node_id = int(state['next_node_id'])
+        self.lifetime_good_nodes, self.lifetime_faulty_nodes, self.lifetime_malicious_nodes = state['lifetime_nodes'].tolist()
+
+        self.nodes = []
+        self.hm_nodes = {}
+        self.node_index = {}
+        self.lifetime_events = []
+
+        inner_bounds = np.concatenate(([0], np.cumsum(state['inner_neighbors_len']))).tolist()
+        outer_bounds = np.concatenate(([0], np.cumsum(state['outer_neighbors_len']))).tolist()
+        inner_neighbors = state['inner_neighbors'].tolist()
+        outer_neighbors = state['outer_neighbors'].tolist()
+
+        for row in range(len(state['ids'])):
+
+            n = Node.from_state(state, row)
+            n.inner_neighbors = inner_neighbors[inner_bounds[row]:inner_bounds[row+1]]
+            n.outer_neighbors = outer_neighbors[outer_bounds[row]:outer_bounds[row+1]]
+
+            self.node_index[n.id] = len(self.nodes)
+            self.nodes.append(n)
+            self.hm_nodes[n.id] = n
+
+            # events that are still to come, see create_node()
+            if n.appear_epoch is not None and not n.has_appeared:
+                self.lifetime_events.append((n.appear_epoch, Simulation.EVENT_APPEAR, n.id))
+            self.lifetime_events.append((n.exit_epoch, Simulation.EVENT_EXIT, n.id))
+
+        heapq.heapify(self.lifetime_events)
+
+        self.inner_neighbor_tuples = [tuple(t) for t in state['inner_neighbor_tuples'].tolist()]
+        self.outer_neighbor_tuples = [tuple(t) for t in state['outer_neighbor_tuples'].tolist()]
 
-        for n in self.nodes:
-            self.inner_neighbor_tuples.extend(n.get_inner_neighbor_tuples())
-            self.outer_neighbor_tuples.extend(n.get_outer_neighbor_tuples())
+        if self.neighbor_tracker is not None:
+            self.neighbor_tracker.set_state(state)
+            self.inner_neighbor_tuples = set(self.inner_neighbor_tuples)
+            self.outer_neighbor_tuples = set(self.outer_neighbor_tuples)
 
-        self.inner_neighbor_tuples = list(set(self.inner_neighbor_tuples))
-        self.outer_neighbor_tuples = list(set(self.outer_neighbor_tuples))
-        # print(self.neighbor_tuples)
+        if self.writer is not None:
+            self.writer.set_state(state, state['ids'], state['types'])
 
     def close_node_files(self):
-        for n in self.nodes:
-            n.out_file.close()
+        if self.writer is not None:
+            self.writer.close()
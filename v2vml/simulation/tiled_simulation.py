@@ -0,0 +1,387 @@
+import multiprocessing
+import numpy as np
+import traceback
+import weakref
+from typing import List
+import v2vml.configuration as conf
+import v2vml.globals as g
+from v2vml.node import Node
+from v2vml.random_streams import RandomStreams
+from v2vml.simulation.neighbors import create_neighbor_finder, empty_pairs
+from v2vml.simulation.node_table import NodeTable
+from v2vml.simulation.vector_simulation import VectorSimulation
+from v2vml.storage import create_raw_data_writer
+
+
+# Simulation where the canvas is split into vertical strips (tiles), each owned by a worker process
+#
+# every tile keeps its nodes in a NodeTable that lives in shared memory. one epoch is:
+#   move:      each worker moves its nodes, removes the ones that left the canvas and puts
+#              the ones that crossed into another tile in its outbox
+#   spawn:     the main process places the replacement nodes directly into the tiles
+#   receive:   each worker takes the nodes that crossed into its tile from its neighbors' outboxes
+#   neighbors: each worker finds the pairs that involve its nodes, reading the nodes of the
+#              tiles to its right that are within 2*RADIUS_SENSOR of its border (the halo)
+#
+# only short commands and counts are sent between processes, the nodes are never pickled
+# the raw data matches a VectorSimulation with the same seed and does not depend on SIM_NUM_TILES,
+# the bsm errors are keyed by node id, see RandomStreams.bsm()
+class TiledSimulation:
+
+    # seed_sequence: numpy SeedSequence all random numbers are drawn from, defaults to SEED
+    # raw_data_dir: where MODE_GATHER_DATA writes the node files
+    def __init__(self, num_initial_nodes, seed_sequence=None, raw_data_dir='./data/raw_data'):
+
+        # current iteration of the simulation
+        self.epoch = 0
+
+        # number of nodes to create at the start of the simulation
+        self.num_initial_nodes = num_initial_nodes
+
+        # ids are unique over the lifetime of the simulation
+        self.next_node_id = 0
+
+        self.raw_data_dir = raw_data_dir
+
+        # random numbers, the same seed always gives the same simulation
+        self.streams = RandomStreams(seed_sequence)
+
+        # number of times nodes were created, each batch has its own random stream
+        self.spawn_batches = 0
+
+        # keeps track of total node type counts over the lifetime of the simulation
+        self.lifetime_good_nodes = 0
+        self.lifetime_faulty_nodes = 0
+        self.lifetime_malicious_nodes = 0
+
+        # tile k owns the nodes with bounds[k] <= x < bounds[k+1]
+        # the first and last tile also own everything off the canvas to their side
+        self.num_tiles = conf.SIM_NUM_TILES
+        self.bounds = [k*conf.CANVAS_WIDTH // self.num_tiles for k in range(self.num_tiles + 1)]
+
+        # nodes can only be handed to the tile next to them
+        if conf.CANVAS_WIDTH // self.num_tiles < Node.SPEED_MAX:
+            raise ValueError('tiles must be at least {} wide, use fewer tiles'.format(Node.SPEED_MAX))
+
+        capacity = conf.SIM_TILE_CAPACITY
+        if capacity is None:
+            capacity = 2*(num_initial_nodes // self.num_tiles) + 1024
+
+        # tile state and outboxes, in shared memory
+        _, nbytes = NodeTable.layout(capacity)
+        table_buffers = [multiprocessing.RawArray('b', nbytes) for _ in range(self.num_tiles)]
+        outbox_buffers = [multiprocessing.RawArray('b', nbytes) for _ in range(self.num_tiles)]
+        self.tables = [NodeTable(capacity, buffer) for buffer in table_buffers]
+
+        # the configuration is passed along in case the workers do not inherit it
+        settings = {name: value for name, value in vars(conf).items() if name.isupper()}
+
+        self.connections = []
+        self.workers = []
+        for tile in range(self.num_tiles):
+
+            parent_conn, child_conn = multiprocessing.Pipe()
+            args = (tile, self.bounds, capacity, table_buffers, outbox_buffers, self.streams.seed_sequence,
+                    raw_data_dir, settings, child_conn)
+
+            worker = multiprocessing.Process(target=run_tile, args=args, daemon=True)
+            worker.start()
+
+            self.connections.append(parent_conn)
+            self.workers.append(worker)
+
+        # stops the workers once the simulation is no longer used
+        self.finalizer = weakref.finalize(self, TiledSimulation.stop_workers, self.connections, self.workers)
+
+        # every node in one table sorted by id and the neighbors as rows of it, see collect()
+        self.collected_epoch = None
+        self.collected = None
+
+        # create initial nodes, the outboxes are still empty so receiving only opens their files
+        self.create_nodes(num_initial_nodes)
+        self.run_step('receive')
+
+    # advance to the next epoch in our simulation
+    def next_epoch(self):
+
+        self.epoch += 1
+
+        num_out = self.run_step('move', self.epoch)
+        self.create_nodes(sum(num_out), on_canvas=False)
+        self.run_step('receive')
+        self.run_step('find_neighbors')
+
+    # sends a command to every worker and waits until they are all done
+    # returns: the result of each worker
+    def run_step(self, command, *args) -> list:
+
+        for conn in self.connections:
+            conn.send((command, args))
+
+        results = []
+        for tile, conn in enumerate(self.connections):
+            ok, result = conn.recv()
+            if not ok:
+                raise RuntimeError('tile {} failed:\n{}'.format(tile, result))
+            results.append(result)
+
+        return results
+
+    # adds count nodes to the simulation, each one is placed in the tile it starts in
+    def create_nodes(self, count, on_canvas=True):
+
+        if count == 0:
+            return
+
+        rows = self.new_rows(count, on_canvas)
+        tiles = self.tile_of(rows['x'])
+
+        for tile, table in enumerate(self.tables):
+
+            selected = tiles == tile
+            tile_rows = {name: column[selected] if isinstance(column, np.ndarray) else column
+                         for name, column in rows.items()}
+
+            if table.size + len(tile_rows['ids']) > table.capacity:
+                raise RuntimeError('tile {} is full, increase SIM_TILE_CAPACITY'.format(tile))
+
+            table.append(tile_rows)
+
+    new_rows = VectorSimulation.new_rows
+
+    # tile that owns each x coordinate
+    def tile_of(self, x) -> np.ndarray:
+        return np.searchsorted(self.bounds[1:-1], x, side='right')
+
+    # every node in one table, sorted by id, and the neighbors as pairs of rows of that table
+    # only built when the nodes or neighbors are looked at
+    def collect(self) -> tuple:
+
+        if self.collected_epoch == self.epoch:
+            return self.collected
+
+        parts = [table.take(slice(0, table.size)) for table in self.tables]
+        columns = {name: np.concatenate([part[name] for part in parts]) for name, _, _ in NodeTable.columns()}
+        order = np.argsort(columns['ids'], kind='stable')
+
+        table = NodeTable(max(len(order), 1))
+        table.append({name: column[order] for name, column in columns.items()})
+
+        # neighbors as ids, each pair is found by exactly one tile
+        results = self.run_step('neighbor_ids')
+        sorted_ids = table.ids[:table.size]
+        inner_pairs = np.searchsorted(sorted_ids, np.concatenate([inner for inner, _ in results]))
+        outer_pairs = np.searchsorted(sorted_ids, np.concatenate([outer for _, outer in results]))
+
+        self.collected_epoch = self.epoch
+        self.collected = (table, inner_pairs, outer_pairs)
+
+        return self.collected
+
+    @property
+    def table(self) -> NodeTable:
+        return self.collect()[0]
+
+    # neighbors as pairs of rows of table, the smaller row comes first
+    @property
+    def inner_pairs(self) -> np.ndarray:
+        return self.collect()[1]
+
+    @property
+    def outer_pairs(self) -> np.ndarray:
+        return self.collect()[2]
+
+    # the rows of table are sorted by id, so the pairs are already (smaller id, larger id)
+    @property
+    def inner_neighbor_tuples(self) -> List[tuple]:
+        table, inner_pairs, _ = self.collect()
+        return [tuple(p) for p in table.ids[inner_pairs].tolist()]
+
+    @property
+    def outer_neighbor_tuples(self) -> List[tuple]:
+        table, _, outer_pairs = self.collect()
+        return [tuple(p) for p in table.ids[outer_pairs].tolist()]
+
+    # neighbor changes would have to be tracked across tiles
+    def subscribe_neighbor_changes(self, callback):
+        raise RuntimeError('neighbor changes are not published by SIM_ENGINE_TILED')
+
+    neighbors_of = VectorSimulation.neighbors_of
+    nodes = VectorSimulation.nodes
+    hm_nodes = VectorSimulation.hm_nodes
+
+    def close_node_files(self):
+        self.run_step('close_node_files')
+
+    # stops the worker processes, the simulation can not be used afterwards
+    def close(self):
+        self.finalizer()
+
+    @staticmethod
+    def stop_workers(connections, workers):
+
+        for conn in connections:
+            try:
+                conn.send(('stop', ()))
+            except (BrokenPipeError, OSError):
+                pass
+
+        for worker in workers:
+            worker.join()
+
+
+# the part of a TiledSimulation that runs in a worker process
+class TileWorker:
+
+    def __init__(self, tile, bounds, capacity, table_buffers, outbox_buffers, seed_sequence, raw_data_dir):
+
+        self.tile = tile
+        self.bounds = bounds
+        self.raw_data_dir = raw_data_dir
+
+        # x range owned by this tile, the outer tiles extend past the canvas
+        self.lo = bounds[tile] if tile > 0 else -np.inf
+        self.hi = bounds[tile + 1] if tile < len(bounds) - 2 else np.inf
+
+        # the nodes of every tile, only this tile's table and outbox are written to
+        self.tables = [NodeTable(capacity, buffer) for buffer in table_buffers]
+        self.outboxes = [NodeTable(capacity, buffer) for buffer in outbox_buffers]
+        self.table = self.tables[tile]
+        self.outbox = self.outboxes[tile]
+
+        self.streams = RandomStreams(seed_sequence)
+
+        # pairs that involve a node of this tile, as (smaller id, larger id)
+        self.neighbor_finder = create_neighbor_finder()
+        self.halo = 2*g.RADIUS_SENSOR
+        self.inner_ids = empty_pairs()
+        self.outer_ids = empty_pairs()
+
+        # MODE_GATHER_DATA output of the nodes in this tile
+        self.writer = None
+        if conf.MODE == conf.MODE_GATHER_DATA:
+            self.writer = create_raw_data_writer(raw_data_dir, part='tile{}_'.format(tile))
+
+        # rows after this one were added since the last move
+        self.num_settled = 0
+
+    def owns(self, x) -> np.ndarray:
+        return (x >= self.lo) & (x < self.hi)
+
+    # moves the nodes, removes the ones that left the canvas and moves the ones that
+    # left the tile to the outbox
+    # returns: the number of nodes that left the canvas
+    def move(self, epoch) -> int:
+
+        table = self.table
+        table.move(epoch, self.streams)
+
+        # writes current location and bsm location of every node
+        if self.writer is not None:
+            table.write_raw_data(self.writer, epoch)
+
+        out_rows = table.due(epoch)
+        self.remove_nodes(out_rows)
+
+        # nodes that change tile are written by their new tile from now on
+        leaving = np.flatnonzero(~self.owns(table.x[:table.size]))
+        self.outbox.size = 0
+        self.outbox.append(table.take(leaving))
+        self.remove_nodes(leaving)
+
+        self.num_settled = table.size
+
+        return len(out_rows)
+
+    # takes the nodes that crossed into this tile
+    # the nodes spawned into this tile since the last move are already in the table
+    def receive(self):
+
+        for other in (self.tile - 1, self.tile + 1):
+
+            if other < 0 or other >= len(self.outboxes):
+                continue
+
+            outbox = self.outboxes[other]
+            rows = np.flatnonzero(self.owns(outbox.x[:outbox.size]))
+
+            if self.table.size + len(rows) > self.table.capacity:
+                raise RuntimeError('tile {} is full, increase SIM_TILE_CAPACITY'.format(self.tile))
+
+            self.table.append(outbox.take(rows))
+
+        # start writing the nodes that are new or just joined this tile
+        if self.writer is not None:
+            added = slice(self.num_settled, self.table.size)
+            self.writer.add_nodes(self.table.ids[added], self.table.types[added], is_new=self.table.is_new[added])
+
+        self.table.is_new[:self.table.size] = False
+
+    # finds the pairs that involve at least one node of this tile
+    # a pair of nodes in two different tiles is found by the tile on the left, so only
+    # the tiles to the right are read, and only their nodes within the halo
+    def find_neighbors(self):
+
+        ids = [self.table.ids[:self.table.size]]
+        x = [self.table.x[:self.table.size]]
+        y = [self.table.y[:self.table.size]]
+
+        for other in range(self.tile + 1, len(self.tables)):
+
+            if self.bounds[other] >= self.hi + self.halo:
+                break
+
+            table = self.tables[other]
+            rows = np.flatnonzero(table.x[:table.size] < self.hi + self.halo)
+
+            ids.append(table.ids[rows])
+            x.append(table.x[rows])
+            y.append(table.y[rows])
+
+        ids = np.concatenate(ids)
+        inner_pairs, outer_pairs = self.neighbor_finder.find(np.concatenate(x), np.concatenate(y))
+
+        # pairs of two halo nodes belong to another tile
+        n = self.table.size
+        inner_pairs = inner_pairs[inner_pairs[:, 0] < n]
+        outer_pairs = outer_pairs[outer_pairs[:, 0] < n]
+
+        self.inner_ids = np.sort(ids[inner_pairs], axis=1)
+        self.outer_ids = np.sort(ids[outer_pairs], axis=1)
+
+    # returns: (inner pairs, outer pairs) as ids
+    def neighbor_ids(self) -> tuple:
+        return self.inner_ids, self.outer_ids
+
+    def remove_nodes(self, rows):
+
+        if self.writer is not None:
+            self.writer.remove_nodes(self.table.ids[rows])
+
+        self.table.remove(rows)
+
+    def close_node_files(self):
+        if self.writer is not None:
+            self.writer.close()
+
+
+# entry point of a worker process, runs the commands sent by TiledSimulation.run_step()
+def run_tile(tile, bounds, capacity, table_buffers, outbox_buffers, seed_sequence, raw_data_dir, settings, conn):
+
+    for name, value in settings.items():
+        setattr(conf, name, value)
+
+    worker = TileWorker(tile, bounds, capacity, table_buffers, outbox_buffers, seed_sequence, raw_data_dir)
+
+    while True:
+
+        command, args = conn.recv()
+        if command == 'stop':
+            break
+
+        try:
+            conn.send((True, getattr(worker, command)(*args)))
+        except Exception:
+            conn.send((False, traceback.format_exc()))
+
+    worker.close_node_files()
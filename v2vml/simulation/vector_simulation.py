@@ -0,0 +1,293 @@
+import numpy as np
+from typing import List
+import v2vml.configuration as conf
+from v2vml.node import Node
+from v2vml.random_streams import RandomStreams
+from v2vml.simulation.neighbor_tracker import NeighborTracker
+from v2vml.simulation.neighbors import create_neighbor_finder, empty_pairs, pairs_to_id_tuples
+from v2vml.simulation.node_table import NodeTable
+from v2vml.storage import create_raw_data_writer
+
+
+# read-only view of a single vehicle stored in a NodeTable
+# exposes the same attributes as Node so that the visualizer can draw either simulation
+# a view is only valid until the simulation advances to the next epoch
+class NodeView:
+
+    # sim: any simulation with a table, an epoch, inner_pairs/outer_pairs and neighbors_of()
+    def __init__(self, sim, row):
+        self.sim = sim
+        self.row = row
+
+    @property
+    def id(self) -> int:
+        return int(self.sim.table.ids[self.row])
+
+    @property
+    def type(self) -> int:
+        return int(self.sim.table.types[self.row])
+
+    @property
+    def dir(self) -> int:
+        return int(self.sim.table.dirs[self.row])
+
+    @property
+    def speed(self) -> int:
+        return int(self.sim.table.speeds[self.row])
+
+    @property
+    def x(self) -> int:
+        return int(self.sim.table.x[self.row])
+
+    @property
+    def y(self) -> int:
+        return int(self.sim.table.y[self.row])
+
+    @property
+    def has_appeared(self) -> bool:
+        return bool(self.sim.table.has_appeared[self.row])
+
+    @property
+    def last_bsm(self):
+        if self.sim.table.bsm_hist_len[self.row] == 0:
+            return None
+        return tuple(self.sim.table.last_bsm[self.row].tolist())
+
+    # ex: [ (oldest_x, oldest_y), ... , (recent_x, recent_y) ]
+    @property
+    def past_coord(self) -> List[tuple]:
+        return self.sim.table.history('coord_hist', self.row, self.sim.epoch)
+
+    # ex: [ (oldest_bsm_x, oldest_bsm_y), ... , (recent_bsm_x, recent_bsm_y) ]
+    @property
+    def past_bsm_coord(self) -> List[tuple]:
+        return self.sim.table.history('bsm_hist', self.row, self.sim.epoch)
+
+    @property
+    def inner_neighbors(self) -> List[int]:
+        return self.sim.neighbors_of(self.sim.inner_pairs, self.row)
+
+    @property
+    def outer_neighbors(self) -> List[int]:
+        return self.sim.neighbors_of(self.sim.outer_pairs, self.row)
+
+    # Node only reads attributes that the view also provides
+    type_as_str = Node.type_as_str
+    get_inner_neighbor_tuples = Node.get_inner_neighbor_tuples
+    get_outer_neighbor_tuples = Node.get_outer_neighbor_tuples
+    __str__ = Node.__str__
+
+
+# Simulation where every vehicle is a row in a NodeTable
+# nodes are moved, checked and replaced with a handful of array operations per epoch
+class VectorSimulation:
+
+    # seed_sequence: numpy SeedSequence all random numbers are drawn from, defaults to SEED
+    # raw_data_dir: where MODE_GATHER_DATA writes the node files
+    def __init__(self, num_initial_nodes, seed_sequence=None, raw_data_dir='./data/raw_data'):
+
+        # current iteration of the simulation
+        self.epoch = 0
+
+        # number of nodes to create at the start of the simulation
+        self.num_initial_nodes = num_initial_nodes
+
+        # ids are unique over the lifetime of the simulation
+        self.next_node_id = 0
+
+        self.raw_data_dir = raw_data_dir
+
+        # random numbers, the same seed always gives the same simulation
+        self.streams = RandomStreams(seed_sequence)
+
+        # number of times nodes were created, each batch has its own random stream
+        self.spawn_batches = 0
+
+        # the nodes, the table may have more room than rows in use
+        self.table = NodeTable(max(num_initial_nodes, 16))
+
+        # neighbors as pairs of rows, the smaller row comes first
+        self.neighbor_finder = create_neighbor_finder()
+        self.inner_pairs = empty_pairs()
+        self.outer_pairs = empty_pairs()
+
+        # keeps the neighbors up to date between epochs
+        self.neighbor_tracker = None
+        if conf.NEIGHBOR_MODE == conf.NEIGHBOR_MODE_INCREMENTAL:
+            self.neighbor_tracker = NeighborTracker()
+
+        # MODE_GATHER_DATA output
+        self.writer = None
+        if conf.MODE == conf.MODE_GATHER_DATA:
+            self.writer = create_raw_data_writer(raw_data_dir)
+
+        # keeps track of total node type counts over the lifetime of the simulation
+        self.lifetime_good_nodes = 0
+        self.lifetime_faulty_nodes = 0
+        self.lifetime_malicious_nodes = 0
+
+        # create initial nodes
+        self.create_nodes(num_initial_nodes)
+
+    # advance to the next epoch in our simulation
+    def next_epoch(self):
+
+        self.epoch += 1
+        self.move_nodes()
+        self.set_neighbors()
+
+    # adds a node to the simulation
+    def create_node(self, on_canvas=True):
+        self.create_nodes(1, on_canvas=on_canvas)
+
+    # adds count nodes to the simulation
+    def create_nodes(self, count, on_canvas=True):
+
+        if count == 0:
+            return
+
+        rows = self.new_rows(count, on_canvas)
+
+        if self.table.size + count > self.table.capacity:
+            self.table = self.table.resized(max(2*self.table.capacity, self.table.size + count))
+        self.table.append(rows)
+
+        if self.writer is not None:
+            self.writer.add_nodes(rows['ids'], rows['types'])
+
+    # returns: the columns of count new nodes, drawn from the next spawn stream
+    # takes the next ids and counts the new nodes towards the lifetime totals
+    def new_rows(self, count, on_canvas) -> dict:
+
+        rng = self.streams.spawn(self.spawn_batches)
+        self.spawn_batches += 1
+
+        rows = NodeTable.new_rows(rng, count, on_canvas, self.next_node_id, self.epoch)
+        self.next_node_id += count
+
+        types = rows['types']
+        self.lifetime_good_nodes += int(np.count_nonzero(types == Node.GOOD))
+        self.lifetime_faulty_nodes += int(np.count_nonzero(types == Node.FAULTY))
+        self.lifetime_malicious_nodes += int(np.count_nonzero(types == Node.MALICIOUS))
+
+        return rows
+
+    # removes the nodes in the given rows from the simulation
+    def remove_nodes(self, rows):
+
+        if len(rows) == 0:
+            return
+
+        # stop writing their raw data
+        if self.writer is not None:
+            self.writer.remove_nodes(self.table.ids[rows])
+
+        self.table.remove(rows)
+
+    # moves nodes and adds new ones if necessary
+    # same steps as Node.update() and Node.is_out(), but for every node at once
+    def move_nodes(self):
+
+        self.table.move(self.epoch, self.streams)
+
+        # writes current location and bsm location of every node
+        if self.writer is not None:
+            self.table.write_raw_data(self.writer, self.epoch)
+
+        # replace the nodes that left the canvas
+        out_rows = self.table.due(self.epoch)
+        self.remove_nodes(out_rows)
+        self.create_nodes(len(out_rows), on_canvas=False)
+
+    # nodes detect their neighbors
+    def set_neighbors(self):
+
+        x = self.table.x[:self.table.size]
+        y = self.table.y[:self.table.size]
+
+        if self.neighbor_tracker is None:
+            self.inner_pairs, self.outer_pairs = self.neighbor_finder.find(x, y)
+            return
+
+        self.inner_pairs, self.outer_pairs, delta = self.neighbor_tracker.update(self.epoch, self.table.ids[:self.table.size], x, y)
+        self.neighbor_tracker.publish(delta)
+
+    # callback is called with a NeighborDelta after every epoch
+    # requires NEIGHBOR_MODE_INCREMENTAL
+    def subscribe_neighbor_changes(self, callback):
+
+        if self.neighbor_tracker is None:
+            raise RuntimeError('neighbor changes are only published in NEIGHBOR_MODE_INCREMENTAL')
+
+        self.neighbor_tracker.subscribe(callback)
+
+    # a set (not list) of all neighbors within the simulation, as (smaller id, larger id)
+    @property
+    def inner_neighbor_tuples(self) -> List[tuple]:
+        return pairs_to_id_tuples(self.inner_pairs, self.table.ids)
+
+    @property
+    def outer_neighbor_tuples(self) -> List[tuple]:
+        return pairs_to_id_tuples(self.outer_pairs, self.table.ids)
+
+    # ids of the nodes paired with the given row
+    def neighbors_of(self, pairs, row) -> List[int]:
+        rows = np.concatenate((pairs[pairs[:, 0] == row, 1], pairs[pairs[:, 1] == row, 0]))
+        return self.table.ids[np.sort(rows)].tolist()
+
+    # nodes present in the simulation
+    @property
+    def nodes(self) -> List[NodeView]:
+        return [NodeView(self, row) for row in range(self.table.size)]
+
+    # hashmap of nodes present in the simulation
+    @property
+    def hm_nodes(self) -> dict:
+        return {node_id: NodeView(self, row) for row, node_id in enumerate(self.table.ids[:self.table.size].tolist())}
+
+    # everything needed to continue the simulation later, as numpy arrays, see checkpoint.py
+    def get_state(self) -> dict:
+
+        state = self.table.take(slice(0, self.table.size))
+        state.update({
+            'epoch': np.array(self.epoch),
+            'next_node_id': np.array(self.next_node_id),
+            'spawn_batches': np.array(self.spawn_batches),
+            'lifetime_nodes': np.array([self.lifetime_good_nodes, self.lifetime_faulty_nodes,
+                                        self.lifetime_malicious_nodes]),
+            'inner_pairs': self.inner_pairs.copy(),
+            'outer_pairs': self.outer_pairs.copy(),
+        })
+
+        if self.neighbor_tracker is not None:
+            state.update(self.neighbor_tracker.get_state())
+
+        if self.writer is not None:
+            state.update(self.writer.get_state(state['ids']))
+
+        return state
+
+    # continues from a state saved by get_state()
+    # the raw data is cut back to where it was when the state was saved
+    def set_state(self, state):
+
+        self.epoch = int(state['epoch'])
+        self.next_node_id = int(state['next_node_id'])
+        self.spawn_batches = int(state['spawn_batches'])
+        self.lifetime_good_nodes, self.lifetime_faulty_nodes, self.lifetime_malicious_nodes = state['lifetime_nodes'].tolist()
+
+        self.table = NodeTable(max(len(state['ids']), 16))
+        self.table.append(state)
+
+        self.inner_pairs = state['inner_pairs']
+        self.outer_pairs = state['outer_pairs']
+
+        if self.neighbor_tracker is not None:
+            self.neighbor_tracker.set_state(state)
+
+        if self.writer is not None:
+            self.writer.set_state(state, state['ids'], state['types'])
+
+    def close_node_files(self):
+        if self.writer is not None:
+            self.writer.close()
@@ -0,0 +1,4 @@
+from .trajectory import *
+from .store import *
+from .writers import *
+from .cache import *
@@ -0,0 +1,207 @@
+import hashlib
+import json
+import os
+import shutil
+import v2vml.configuration as conf
+import v2vml.globals as g
+from v2vml.ml.models import MODELS, STREAMING_MODELS
+import v2vml.ml.preprocessing as pre
+from v2vml.node import Node
+
+
+# every stage of the pipeline keeps its outputs in CACHE_DIR/<stage>/<fingerprint>/
+#   stage.json: the configuration and inputs the outputs were made from, written last
+#   <output>: a copy of every working directory or file the stage wrote to, ex: raw_data/
+# the fingerprint is a hash of stage.json, so several variants of a stage can be kept side by side
+# files are hard linked between the cache and the working directories, nothing is copied unless linking fails
+# each stage keeps at most CACHE_MAX_ENTRIES entries, see prune_stage()
+# bump the version of a stage when its code changes what it writes, so older entries are not used
+STAGE_VERSIONS = {
+    'gather': 2,
+    'extract': 1,
+    'test': 3,
+    'export': 1,
+}
+
+
+# returns: the fingerprint of a stage that ran with the given configuration
+def stage_fingerprint(config) -> str:
+    return hashlib.sha256(json.dumps(config, sort_keys=True).encode()).hexdigest()[:16]
+
+
+# returns: a fingerprint of the files in dirs that changes whenever a file is added, removed or written to
+# only the names, sizes and modification times are read, files restored from the cache keep all three
+def files_fingerprint(dirs) -> str:
+
+    manifest = []
+    for top in dirs:
+        for dir_path, dir_names, file_names in os.walk(top):
+            dir_names.sort()
+            for file in sorted(file_names):
+                stat = os.stat(os.path.join(dir_path, file))
+                manifest.append((os.path.relpath(os.path.join(dir_path, file), top), stat.st_size, stat.st_mtime_ns))
+
+    return stage_fingerprint(manifest)
+
+
+# the values every stage depends on
+def common_config(stage) -> dict:
+    return {'stage': stage, 'version': STAGE_VERSIONS[stage]}
+
+
+# the values the raw data depends on
+# seed: the seed the run used, see summary['seed']
+def gather_config(seed) -> dict:
+
+    config = common_config('gather')
+    config.update({
+        'seed': seed,
+        'epochs': conf.GATHER_DATA_NUM_EPOCHS,
+        'shards': conf.GATHER_DATA_NUM_SHARDS,
+        'initial_nodes': conf.NUM_INITIAL_NODES,
+        'canvas': [conf.CANVAS_WIDTH, conf.CANVAS_HEIGHT],
+        'percent': [conf.PERCENT_GOOD, conf.PERCENT_FAULTY, conf.PERCENT_MALICIOUS],
+        'history': [conf.MAX_COORD_HIST, conf.MAX_BSM_HIST],
+        'engine': conf.SIM_ENGINE,
+        'tiles': conf.SIM_NUM_TILES if conf.SIM_ENGINE == conf.SIM_ENGINE_TILED else None,
+        'node': constants(Node),
+        'globals': constants(g),
+        'raw_data_format': conf.RAW_DATA_FORMAT,
+        'compression': conf.RAW_DATA_COMPRESSION,
+        'write_raw_data': conf.GATHER_DATA_WRITE_RAW_DATA,
+        'features': extract_config(None) if conf.GATHER_DATA_EXTRACT_FEATURES else None,
+    })
+
+    return config
+
+
+# the values the features depend on
+# raw_data_dir: None to leave out the raw data, ex: the features are extracted while the data is gathered
+def extract_config(raw_data_dir) -> dict:
+
+    config = common_config('extract')
+    config.update({
+        'feature_version': pre.FEATURE_VERSION,
+        'sample_size': g.SAMPLE_SIZE,
+        'sample_sizes': conf.EXTRACT_FEATURES_SAMPLE_SIZES,
+        'stride': conf.EXTRACT_FEATURES_STRIDE,
+        'processed_data_format': conf.PROCESSED_DATA_FORMAT,
+        'raw_data_format': conf.RAW_DATA_FORMAT,
+        'inputs': None if raw_data_dir is None else files_fingerprint([raw_data_dir]),
+    })
+
+    return config
+
+
+# the values the test report (stage 'test') or exported models (stage 'export') depend on
+# only used with SEED, the splits of a run without it are drawn from a new seed every time
+def train_config(stage, processed_data_dir) -> dict:
+
+    config = common_config(stage)
+    config.update({
+        'seed': conf.SEED,
+        'num_tests': conf.TRAIN_MODELS_NUM_TESTS if stage == 'test' else None,
+        'ci': [conf.TRAIN_MODELS_CI_WIDTH, conf.TRAIN_MODELS_MIN_TESTS, conf.TRAIN_MODELS_CI_LEVEL]
+        if stage == 'test' else None,
+        'models': [spec.config() for spec in (STREAMING_MODELS if conf.TRAIN_MODELS_STREAMING else MODELS)],
+        'streaming': [conf.TRAIN_MODELS_CHUNK_ROWS, conf.TRAIN_MODELS_STREAMING_PASSES]
+        if conf.TRAIN_MODELS_STREAMING else None,
+        'inputs': files_fingerprint([processed_data_dir]),
+    })
+
+    return config
+
+
+# returns: the upper case attributes of a module or class, ex: Node.ERROR_GOOD
+def constants(obj) -> dict:
+    return {name: getattr(obj, name) for name in dir(obj)
+            if name.isupper() and isinstance(getattr(obj, name), (bool, int, float, str))}
+
+
+def cache_entry(stage, fingerprint) -> str:
+    return '{}/{}/{}'.format(conf.CACHE_DIR, stage, fingerprint)
+
+
+def is_cached(stage, fingerprint) -> bool:
+    return os.path.isfile(cache_entry(stage, fingerprint) + '/stage.json')
+
+
+# links the outputs of a cache entry into the working directories
+# outputs: {output name: working directory or file}, the working directories should be empty
+def restore_stage(stage, fingerprint, outputs):
+
+    entry = cache_entry(stage, fingerprint)
+    for name, dst in outputs.items():
+        link_tree('{}/{}'.format(entry, name), dst)
+
+    # marks the entry as used, see prune_stage()
+    os.utime(entry + '/stage.json')
+
+
+# adds the outputs in the working directories to the cache, see restore_stage()
+# the entry is complete or missing, never half written
+def cache_stage(stage, fingerprint, config, outputs):
+
+    entry = cache_entry(stage, fingerprint)
+    tmp_entry = entry + '.tmp'
+
+    shutil.rmtree(tmp_entry, ignore_errors=True)
+    os.makedirs(tmp_entry)
+    for name, src in outputs.items():
+        link_tree(src, '{}/{}'.format(tmp_entry, name))
+
+    with open(tmp_entry + '/stage.json', 'w') as out_file:
+        json.dump(config, out_file, indent=4, sort_keys=True)
+
+    shutil.rmtree(entry, ignore_errors=True)
+    os.replace(tmp_entry, entry)
+
+    prune_stage(stage)
+
+
+# removes the entries of a stage that were used the longest time ago, until CACHE_MAX_ENTRIES are left
+def prune_stage(stage):
+
+    if conf.CACHE_MAX_ENTRIES is None:
+        return
+
+    stage_dir = '{}/{}'.format(conf.CACHE_DIR, stage)
+    fingerprints = [f for f in os.listdir(stage_dir) if is_cached(stage, f)]
+    fingerprints.sort(key=lambda f: os.path.getmtime(cache_entry(stage, f) + '/stage.json'), reverse=True)
+
+    for fingerprint in fingerprints[conf.CACHE_MAX_ENTRIES:]:
+        shutil.rmtree(cache_entry(stage, fingerprint))
+
+
+# removes every entry of a stage, or of every stage
+def clear_cache(stage=None):
+    shutil.rmtree(conf.CACHE_DIR if stage is None else '{}/{}'.format(conf.CACHE_DIR, stage), ignore_errors=True)
+
+
+# hard links every file in src_dir to the same place in dst_dir, src_dir may be a single file as well
+def link_tree(src_dir, dst_dir):
+
+    if os.path.isfile(src_dir):
+        link_file(src_dir, dst_dir)
+        return
+
+    for dir_path, _, file_names in os.walk(src_dir):
+
+        out_dir = os.path.join(dst_dir, os.path.relpath(dir_path, src_dir))
+        os.makedirs(out_dir, exist_ok=True)
+
+        for file in file_names:
+            link_file(os.path.join(dir_path, file), os.path.join(out_dir, file))
+
+
+# copies the file if it can not be linked, copy2() keeps the modification time, so files_fingerprint() is the same
+# either way
+def link_file(src, dst):
+
+    if os.path.lexists(dst):
+        os.remove(dst)
+
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
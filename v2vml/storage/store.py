@@ -0,0 +1,169 @@
+from collections import OrderedDict
+import numpy as np
+import os
+import pandas as pd
+from typing import List
+from v2vml.storage.trajectory import decode_trajectories
+
+
+# the columnar raw data store, raw_data_dir/store/
+#
+# every record is one node in one epoch. records are written in chunks, each chunk is an
+# uncompressed npz file with one array per column of RAW_DATA_COLUMNS, sorted by node.
+# each chunk also has a node-offset index (index_node_id, index_offset, index_count, ...)
+# and index.npz combines the indexes of every chunk, so the records of a single node can be
+# found without reading the whole store. a node's records can be spread over several chunks.
+# chunks of RAW_DATA_FORMAT_TRAJECTORY hold the records encoded, see trajectory.py
+RAW_DATA_COLUMNS = ['epoch', 'node_id', 'type', 'x', 'y', 'bsm_x', 'bsm_y']
+
+# columns of a node file, see CsvRawDataWriter
+NODE_FILE_COLUMNS = ['x', 'y', 'bsm_x', 'bsm_y']
+
+
+def store_dir(raw_data_dir) -> str:
+    return raw_data_dir + '/store'
+
+
+# feature files written while the data is gathered, see FeatureRawDataWriter
+def features_dir(raw_data_dir) -> str:
+    return raw_data_dir + '/features'
+
+
+# part: prefix that keeps the chunks of different writers apart
+def chunk_path(path, part, chunk) -> str:
+    return '{}/{}chunk_{:06d}.npz'.format(path, part, chunk)
+
+
+def index_path(path) -> str:
+    return path + '/index.npz'
+
+
+def chunk_names(path) -> List[str]:
+    return sorted(f for f in os.listdir(path) if f.endswith('.npz') and f != 'index.npz')
+
+
+# combines the indexes of every chunk in the store at path into index.npz
+# returns: the combined index, see RawDataStore
+def write_index(path) -> dict:
+
+    names = chunk_names(path)
+
+    segments = {'node_id': [], 'type': [], 'chunk': [], 'offset': [], 'count': [], 'first_epoch': []}
+    for chunk, name in enumerate(names):
+        with np.load(path + '/' + name) as archive:
+            for key in ['node_id', 'type', 'offset', 'count', 'first_epoch']:
+                segments[key].append(archive['index_' + key])
+            segments['chunk'].append(np.full(len(archive['index_node_id']), chunk, dtype=np.int64))
+
+    index = {key: np.concatenate(parts) if parts else np.empty(0, dtype=np.int64) for key, parts in segments.items()}
+
+    # a node's segments in the order they were written
+    order = np.lexsort((index['first_epoch'], index['node_id']))
+    index = {key: column[order] for key, column in index.items()}
+    index['chunk_names'] = np.array(names)
+
+    np.savez(index_path(path), **index)
+
+    return index
+
+
+# moves the chunks of the store at src_path into the store at dst_path
+# node ids are shifted by id_offset and part is put in front of the chunk names
+def merge_store(src_path, dst_path, id_offset, part):
+
+    os.makedirs(dst_path, exist_ok=True)
+
+    for name in chunk_names(src_path):
+
+        with np.load(src_path + '/' + name) as archive:
+            columns = {key: archive[key] for key in archive.files}
+
+        # encoded chunks only have the node ids in the index
+        if 'node_id' in columns:
+            columns['node_id'] += id_offset
+        columns['index_node_id'] += id_offset
+        np.savez(dst_path + '/' + part + name, **columns)
+
+    remove_index(dst_path)
+
+
+# removes index.npz, the store changed
+def remove_index(path):
+    if os.path.isfile(index_path(path)):
+        os.remove(index_path(path))
+
+
+# reads the records of a columnar raw data store
+class RawDataStore:
+
+    # number of chunks kept in memory
+    CACHE_SIZE = 4
+
+    def __init__(self, raw_data_dir):
+
+        self.path = store_dir(raw_data_dir)
+
+        # the index is built by the first reader after the store changed
+        if os.path.isfile(index_path(self.path)):
+            with np.load(index_path(self.path)) as archive:
+                index = {key: archive[key] for key in archive.files}
+        else:
+            index = write_index(self.path)
+
+        self.chunk_names = index['chunk_names'].tolist()
+
+        # segments of consecutive records of one node in one chunk, sorted by node
+        self.segment_node_ids = index['node_id']
+        self.segment_chunks = index['chunk']
+        self.segment_offsets = index['offset']
+        self.segment_counts = index['count']
+
+        # first segment of every node
+        self.node_ids, self.first_segments = np.unique(self.segment_node_ids, return_index=True)
+        self.node_types = index['type'][self.first_segments]
+
+        # chunks read recently, keyed by chunk number
+        self.cache = OrderedDict()
+
+    # returns: the same DataFrame as pd.read_csv() on the node's csv file
+    def read_node(self, node_id) -> pd.DataFrame:
+
+        start = np.searchsorted(self.segment_node_ids, node_id, side='left')
+        end = np.searchsorted(self.segment_node_ids, node_id, side='right')
+
+        parts = {name: [] for name in NODE_FILE_COLUMNS}
+        for segment in range(start, end):
+
+            chunk = self.read_chunk(int(self.segment_chunks[segment]))
+            offset = int(self.segment_offsets[segment])
+            rows = slice(offset, offset + int(self.segment_counts[segment]))
+
+            for name in NODE_FILE_COLUMNS:
+                parts[name].append(chunk[name][rows])
+
+        return pd.DataFrame({name: np.concatenate(columns) for name, columns in parts.items()}, columns=NODE_FILE_COLUMNS)
+
+    # returns: (node id, node type) of every node, in the order of their first chunk
+    # reading the nodes in this order keeps the number of chunk reads low
+    def nodes_in_chunk_order(self) -> List[tuple]:
+        order = np.lexsort((self.node_ids, self.segment_chunks[self.first_segments]))
+        return list(zip(self.node_ids[order].tolist(), self.node_types[order].tolist()))
+
+    # returns: the columns of a chunk that make up a node file
+    def read_chunk(self, chunk) -> dict:
+
+        if chunk in self.cache:
+            self.cache.move_to_end(chunk)
+            return self.cache[chunk]
+
+        with np.load(self.path + '/' + self.chunk_names[chunk]) as archive:
+            if 'compression' in archive.files:
+                columns = decode_trajectories(archive)
+            else:
+                columns = {name: archive[name] for name in NODE_FILE_COLUMNS}
+
+        self.cache[chunk] = columns
+        if len(self.cache) > RawDataStore.CACHE_SIZE:
+            self.cache.popitem(last=False)
+
+        return columns
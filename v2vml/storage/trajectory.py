@@ -0,0 +1,122 @@
+import lzma
+import numpy as np
+import v2vml.configuration as conf
+import zlib
+
+
+# RAW_DATA_FORMAT_TRAJECTORY chunks hold the same records and index as the other chunks of the store,
+# but the records are encoded before they are written:
+#   x, y: difference to the previous record, the records are sorted by node and a node moves the same
+#         distance every epoch, so nearly every difference repeats
+#   bsm_x, bsm_y: the bsm error as (radius, angle), see Node.bsm_errors()
+#                 errors that do not come out exactly the same from (radius, angle) are kept as they are
+# every encoded column is stored in the smallest integer type that holds it and compressed on its own
+TRAJECTORY_COLUMNS = ['dx', 'dy', 'radius', 'angle', 'exact_rows', 'exact_bsm_x', 'exact_bsm_y']
+
+# (compress, decompress) of each RAW_DATA_COMPRESSION
+COMPRESSORS = {
+    conf.RAW_DATA_COMPRESSION_ZLIB: (zlib.compress, zlib.decompress),
+    conf.RAW_DATA_COMPRESSION_LZMA: (lzma.compress, lzma.decompress),
+}
+
+# bsm errors point in a whole number of radians between 0 and 359
+ERROR_ANGLES = np.arange(360)
+
+
+# input: the columns of a chunk, see write_chunk()
+# returns: the index columns and the encoded records
+def encode_trajectories(columns, compression) -> dict:
+
+    x, y = columns['x'], columns['y']
+    bsm_x, bsm_y = columns['bsm_x'], columns['bsm_y']
+
+    radius, angle = bsm_error_codes(x, y, bsm_x, bsm_y)
+    decoded_x, decoded_y = bsm_from_codes(x, y, radius, angle)
+    exact_rows = np.flatnonzero((decoded_x != bsm_x) | (decoded_y != bsm_y))
+
+    encoded = {
+        'dx': np.diff(x, prepend=0),
+        'dy': np.diff(y, prepend=0),
+        'radius': radius,
+        'angle': angle,
+        'exact_rows': exact_rows,
+        'exact_bsm_x': bsm_x[exact_rows],
+        'exact_bsm_y': bsm_y[exact_rows],
+    }
+
+    compress, _ = COMPRESSORS[compression]
+
+    chunk = {name: column for name, column in columns.items() if name.startswith('index_')}
+    chunk['compression'] = np.array(compression)
+
+    for name, column in encoded.items():
+        column = narrowed(column)
+        chunk['z_' + name] = np.frombuffer(compress(column.tobytes()), dtype=np.uint8)
+        chunk['dtype_' + name] = np.array(column.dtype.str)
+
+    return chunk
+
+
+# input: an archive written by encode_trajectories()
+# returns: the x, y, bsm_x and bsm_y of every record
+def decode_trajectories(archive) -> dict:
+
+    _, decompress = COMPRESSORS[int(archive['compression'])]
+
+    encoded = {}
+    for name in TRAJECTORY_COLUMNS:
+        data = decompress(archive['z_' + name].tobytes())
+        encoded[name] = np.frombuffer(data, dtype=str(archive['dtype_' + name]))
+
+    x = np.cumsum(encoded['dx'], dtype=np.int64)
+    y = np.cumsum(encoded['dy'], dtype=np.int64)
+
+    bsm_x, bsm_y = bsm_from_codes(x, y, encoded['radius'], encoded['angle'])
+    bsm_x[encoded['exact_rows']] = encoded['exact_bsm_x']
+    bsm_y[encoded['exact_rows']] = encoded['exact_bsm_y']
+
+    return {'x': x, 'y': y, 'bsm_x': bsm_x, 'bsm_y': bsm_y}
+
+
+# returns: (radius, angle) of the bsm errors that are closest to the ones in the records
+def bsm_error_codes(x, y, bsm_x, bsm_y) -> tuple:
+
+    error_x = bsm_x - x
+    error_y = bsm_y - y
+
+    radius = np.rint(np.hypot(error_x, error_y)).astype(np.int64)
+
+    # every error angle as a direction between -pi and pi, sorted
+    directions = np.arctan2(np.sin(ERROR_ANGLES), np.cos(ERROR_ANGLES))
+    order = np.argsort(directions)
+    directions = directions[order]
+
+    direction = np.arctan2(error_y, error_x)
+    right = np.searchsorted(directions, direction).clip(1, len(directions) - 1)
+    left = right - 1
+    nearest = np.where(direction - directions[left] < directions[right] - direction, left, right)
+
+    return radius, ERROR_ANGLES[order[nearest]]
+
+
+# same arithmetic as Node.bsm_errors() and the bsm of the nodes, so the results match to the last bit
+def bsm_from_codes(x, y, radius, angle) -> tuple:
+
+    radius = radius.astype(np.int64)
+    angle = angle.astype(np.int64)
+
+    return x + radius*np.cos(angle), y + radius*np.sin(angle)
+
+
+# returns: the column in the smallest integer type that holds all of its values
+def narrowed(column) -> np.ndarray:
+
+    if column.dtype.kind != 'i' or len(column) == 0:
+        return column
+
+    low, high = column.min(), column.max()
+    for dtype in [np.int8, np.int16, np.int32]:
+        if np.iinfo(dtype).min <= low and high <= np.iinfo(dtype).max:
+            return column.astype(dtype)
+
+    return column
@@ -0,0 +1,543 @@
+from abc import ABC, abstractmethod
+import numpy as np
+import os
+import pandas as pd
+import queue
+import threading
+import time
+import v2vml.configuration as conf
+import v2vml.globals as g
+from v2vml.ml.feature_store import FeatureStoreWriter
+import v2vml.ml.preprocessing as pre
+from v2vml.node import Node
+from v2vml.storage.store import RAW_DATA_COLUMNS, chunk_path, features_dir, remove_index, store_dir
+from v2vml.storage.trajectory import encode_trajectories
+
+
+# where MODE_GATHER_DATA output goes
+# the simulations tell the writer which nodes exist and hand it every node's record once per epoch
+class RawDataWriter(ABC):
+
+    def __init__(self, raw_data_dir):
+        self.raw_data_dir = raw_data_dir
+        super().__init__()
+
+    # nodes that start being written
+    # is_new: False for nodes that were already written by another writer (ex: another tile)
+    @abstractmethod
+    def add_nodes(self, ids, types, is_new=True):
+        pass
+
+    # nodes that will not be written anymore
+    @abstractmethod
+    def remove_nodes(self, ids):
+        pass
+
+    # one record per node, the arrays line up
+    @abstractmethod
+    def write(self, epoch, ids, types, x, y, bsm_x, bsm_y):
+        pass
+
+    # returns: arrays needed to continue writing later, see checkpoint.py
+    # ids: the nodes being written, in the order the simulation saves them
+    @abstractmethod
+    def get_state(self, ids) -> dict:
+        pass
+
+    # drops everything written after the state was saved and continues writing the given nodes
+    @abstractmethod
+    def set_state(self, state, ids, types):
+        pass
+
+    @abstractmethod
+    def close(self):
+        pass
+
+
+# one csv file per node, raw_data_dir/<type>/Node_<id>.csv
+class CsvRawDataWriter(RawDataWriter):
+
+    def __init__(self, raw_data_dir):
+
+        super().__init__(raw_data_dir)
+
+        # open files, keyed by node id
+        self.out_files = {}
+
+    def file_path(self, node_id, node_type) -> str:
+        return '{}/{}/Node_{}.csv'.format(self.raw_data_dir, Node.type_name(node_type), node_id)
+
+    def add_nodes(self, ids, types, is_new=True):
+
+        is_new = np.broadcast_to(is_new, len(ids))
+
+        for node_id, node_type, new in zip(np.asarray(ids).tolist(), np.asarray(types).tolist(), is_new.tolist()):
+
+            if new:
+                out_file = open(self.file_path(node_id, node_type), 'w')
+                out_file.write('x,y,bsm_x,bsm_y\n')
+            else:
+                out_file = open(self.file_path(node_id, node_type), 'a')
+
+            self.out_files[node_id] = out_file
+
+    def remove_nodes(self, ids):
+        for node_id in np.asarray(ids).tolist():
+            self.out_files.pop(node_id).close()
+
+    # writes current location and the location specified in the bsm to each node's file
+    def write(self, epoch, ids, types, x, y, bsm_x, bsm_y):
+
+        rows = zip(np.asarray(ids).tolist(), np.asarray(x).tolist(), np.asarray(y).tolist(),
+                   np.asarray(bsm_x).tolist(), np.asarray(bsm_y).tolist())
+
+        for node_id, x, y, bsm_x, bsm_y in rows:
+            self.out_files[node_id].write('{},{},{},{}\n'.format(x, y, bsm_x, bsm_y))
+
+    # the size of every open file
+    def get_state(self, ids) -> dict:
+
+        out_files = [self.out_files[node_id] for node_id in np.asarray(ids).tolist()]
+        for out_file in out_files:
+            out_file.flush()
+
+        return {'file_offsets': np.array([out_file.tell() for out_file in out_files], dtype=np.int64)}
+
+    # the files are cut back to their saved sizes and reopened for appending
+    def set_state(self, state, ids, types):
+
+        self.close()
+
+        rows = zip(np.asarray(ids).tolist(), np.asarray(types).tolist(), state['file_offsets'].tolist())
+        for node_id, node_type, offset in rows:
+
+            path = self.file_path(node_id, node_type)
+            with open(path, 'r+b') as out_file:
+                out_file.truncate(offset)
+
+            self.out_files[node_id] = open(path, 'a')
+
+    def close(self):
+        for out_file in self.out_files.values():
+            out_file.close()
+        self.out_files = {}
+
+
+# every record in a few large files, see store.py
+# records are collected in memory and written out RAW_DATA_CHUNK_RECORDS at a time
+class ColumnarRawDataWriter(RawDataWriter):
+
+    # part: prefix of the chunk file names, writers that share a store each need their own
+    # compression: RAW_DATA_COMPRESSION to encode the records with, see trajectory.py, None to write them as they are
+    def __init__(self, raw_data_dir, part='', compression=None):
+
+        super().__init__(raw_data_dir)
+
+        self.compression = compression
+
+        self.store_dir = store_dir(raw_data_dir)
+        os.makedirs(self.store_dir, exist_ok=True)
+
+        self.part = part
+        self.num_chunks = 0
+
+        # records written since the last chunk, one tuple of columns per epoch
+        self.batches = []
+        self.num_buffered = 0
+
+    # the store only needs to know about the records
+    def add_nodes(self, ids, types, is_new=True):
+        pass
+
+    def remove_nodes(self, ids):
+        pass
+
+    def write(self, epoch, ids, types, x, y, bsm_x, bsm_y):
+
+        # copies, the simulation keeps changing its arrays
+        batch = (np.full(len(ids), epoch, dtype=np.int64),
+                 np.array(ids, dtype=np.int64),
+                 np.array(types, dtype=np.int8),
+                 np.array(x, dtype=np.int64),
+                 np.array(y, dtype=np.int64),
+                 np.array(bsm_x, dtype=np.float64),
+                 np.array(bsm_y, dtype=np.float64))
+
+        self.batches.append(batch)
+        self.num_buffered += len(ids)
+
+        if self.num_buffered >= conf.RAW_DATA_CHUNK_RECORDS:
+            self.flush()
+
+    # writes the collected records as the next chunk
+    def flush(self):
+
+        if self.num_buffered == 0:
+            return
+
+        columns = dict(zip(RAW_DATA_COLUMNS, (np.concatenate(column) for column in zip(*self.batches))))
+        write_chunk(chunk_path(self.store_dir, self.part, self.num_chunks), columns, self.compression)
+
+        self.num_chunks += 1
+        self.batches = []
+        self.num_buffered = 0
+
+    # the collected records are written out first, so only the number of chunks is needed
+    def get_state(self, ids) -> dict:
+        self.flush()
+        return {'num_chunks': np.array(self.num_chunks)}
+
+    # removes the chunks written after the state was saved
+    def set_state(self, state, ids, types):
+
+        self.batches = []
+        self.num_buffered = 0
+        self.num_chunks = int(state['num_chunks'])
+
+        chunk = self.num_chunks
+        while os.path.isfile(chunk_path(self.store_dir, self.part, chunk)):
+            os.remove(chunk_path(self.store_dir, self.part, chunk))
+            chunk += 1
+
+        remove_index(self.store_dir)
+
+    def close(self):
+        self.flush()
+
+
+# extracts the features of every node while the simulation runs, instead of from the raw data afterwards
+# each node keeps its last g.SAMPLE_SIZE records and a sample is taken every EXTRACT_FEATURES_STRIDE records,
+# the same samples as features_from_frame(), and the node's feature file is written to raw_data_dir/features/
+# once it leaves the simulation
+class FeatureRawDataWriter(RawDataWriter):
+
+    # tee: writer that the records are handed on to, None to not keep the raw data
+    def __init__(self, raw_data_dir, tee=None):
+
+        super().__init__(raw_data_dir)
+
+        self.features_dir = features_dir(raw_data_dir)
+        os.makedirs(self.features_dir, exist_ok=True)
+
+        self.tee = tee
+        self.stride = conf.EXTRACT_FEATURES_STRIDE or g.SAMPLE_SIZE
+
+        # PROCESSED_DATA_FORMAT_STORE, opened by the first node that is written, so a resumed run can keep its rows
+        self.feature_store = None
+
+        # keyed by node id
+        self.types = {}
+        self.num_rows = {}
+        self.samples = {}
+        self.features = {}
+
+    def add_nodes(self, ids, types, is_new=True):
+
+        if self.tee is not None:
+            self.tee.add_nodes(ids, types, is_new)
+
+        for node_id, node_type in zip(np.asarray(ids).tolist(), np.asarray(types).tolist()):
+            self.types[node_id] = node_type
+            self.num_rows[node_id] = 0
+            self.samples[node_id] = []
+            self.features[node_id] = []
+
+    def remove_nodes(self, ids):
+
+        if self.tee is not None:
+            self.tee.remove_nodes(ids)
+
+        for node_id in np.asarray(ids).tolist():
+            self.write_features(node_id)
+
+    def write(self, epoch, ids, types, x, y, bsm_x, bsm_y):
+
+        if self.tee is not None:
+            self.tee.write(epoch, ids, types, x, y, bsm_x, bsm_y)
+
+        # nodes that have a full sample to extract features from this epoch
+        full = []
+
+        rows = zip(np.asarray(x).tolist(), np.asarray(y).tolist(), np.asarray(bsm_x).tolist(), np.asarray(bsm_y).tolist())
+        for node_id, row in zip(np.asarray(ids).tolist(), rows):
+
+            sample = self.samples[node_id]
+            sample.append(row)
+            if len(sample) > g.SAMPLE_SIZE:
+                del sample[0]
+
+            num_rows = self.num_rows[node_id] + 1
+            self.num_rows[node_id] = num_rows
+
+            if num_rows >= g.SAMPLE_SIZE and (num_rows - g.SAMPLE_SIZE) % self.stride == 0:
+                full.append(node_id)
+
+        if not full:
+            return
+
+        # the samples of every node, one after the other, go through features_as_array() at once
+        features = pre.features_as_array(np.array([self.samples[node_id] for node_id in full]).reshape(-1, 4))
+
+        # same columns as get_feature_header()
+        for node_id, row in zip(full, features):
+            self.features[node_id].append(np.append(row, self.types[node_id]))
+
+    # writes the node's feature file or adds it to the feature store, nodes without a full sample are left out
+    def write_features(self, node_id):
+
+        del self.types[node_id]
+        del self.num_rows[node_id]
+        del self.samples[node_id]
+        features = self.features.pop(node_id)
+
+        if not features:
+            return
+
+        df = pd.DataFrame(np.array(features), columns=pre.get_feature_header())
+
+        if conf.PROCESSED_DATA_FORMAT == conf.PROCESSED_DATA_FORMAT_STORE:
+            self.open_feature_store().append_frame(df, node_id)
+        else:
+            pre.write_features('{}/Node_{}.csv'.format(self.features_dir, node_id), df)
+
+    # num_rows: see FeatureStoreWriter()
+    def open_feature_store(self, num_rows=0) -> FeatureStoreWriter:
+
+        if self.feature_store is None:
+            self.feature_store = FeatureStoreWriter(self.features_dir, num_rows)
+
+        return self.feature_store
+
+    # the last records of every node and the features of the full samples
+    def get_state(self, ids) -> dict:
+
+        ids = np.asarray(ids).tolist()
+
+        state = {} if self.tee is None else self.tee.get_state(ids)
+
+        sample_len = [len(self.samples[node_id]) for node_id in ids]
+        samples = np.zeros((len(ids), g.SAMPLE_SIZE, 4))
+        for i, node_id in enumerate(ids):
+            if sample_len[i] > 0:
+                samples[i, :sample_len[i]] = self.samples[node_id]
+
+        features = [row for node_id in ids for row in self.features[node_id]]
+
+        state['feature_num_rows'] = np.array([self.num_rows[node_id] for node_id in ids], dtype=np.int64)
+        state['feature_sample_len'] = np.array(sample_len, dtype=np.int64)
+        state['feature_samples'] = samples
+        state['feature_counts'] = np.array([len(self.features[node_id]) for node_id in ids], dtype=np.int64)
+        state['feature_rows'] = np.array(features).reshape((len(features), len(pre.get_feature_header())))
+
+        # rows in the feature store, the ones written after the state was saved are dropped when it is loaded
+        state['feature_store_rows'] = np.array(0 if self.feature_store is None else self.feature_store.flush())
+
+        return state
+
+    # the feature files of the nodes that left the simulation before the state was saved are already written
+    def set_state(self, state, ids, types):
+
+        if self.tee is not None:
+            self.tee.set_state(state, ids, types)
+
+        self.types = {}
+        self.num_rows = {}
+        self.samples = {}
+        self.features = {}
+
+        if conf.PROCESSED_DATA_FORMAT == conf.PROCESSED_DATA_FORMAT_STORE:
+            self.open_feature_store(int(state['feature_store_rows']))
+
+        ends = np.cumsum(state['feature_counts'])
+        rows = zip(np.asarray(ids).tolist(), np.asarray(types).tolist(), state['feature_num_rows'].tolist(),
+                   state['feature_sample_len'].tolist(), state['feature_samples'], ends - state['feature_counts'], ends)
+
+        for node_id, node_type, num_rows, sample_len, sample, start, end in rows:
+
+            self.types[node_id] = node_type
+            self.num_rows[node_id] = num_rows
+
+            # x and y are whole numbers in the node files
+            self.samples[node_id] = [(int(x), int(y), bsm_x, bsm_y) for x, y, bsm_x, bsm_y in sample[:sample_len].tolist()]
+            self.features[node_id] = list(state['feature_rows'][start:end])
+
+    # the nodes that are still in the simulation get their feature files as well
+    def close(self):
+
+        for node_id in list(self.types):
+            self.write_features(node_id)
+
+        if conf.PROCESSED_DATA_FORMAT == conf.PROCESSED_DATA_FORMAT_STORE:
+            self.open_feature_store().close()
+
+        if self.tee is not None:
+            self.tee.close()
+
+
+# hands every call to another writer over to a background thread, so the simulation keeps
+# running while the records are written to disk
+# at most queue_size calls wait in the queue, once it is full the simulation waits for the thread (backpressure)
+class ThreadedRawDataWriter(RawDataWriter):
+
+    def __init__(self, writer, queue_size):
+
+        super().__init__(writer.raw_data_dir)
+
+        self.writer = writer
+        self.queue = queue.Queue(maxsize=queue_size)
+
+        # first error raised by the thread, raised again by the next call
+        self.error = None
+
+        # queue depth metrics, see stats()
+        self.num_calls = 0
+        self.total_depth = 0
+        self.max_depth = 0
+        self.num_blocked = 0
+        self.blocked_time = 0.0
+        self.busy_time = 0.0
+
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    # the arrays are copied, the simulation keeps changing its own
+    def add_nodes(self, ids, types, is_new=True):
+        self.put(self.writer.add_nodes, np.array(ids), np.array(types), is_new=np.array(is_new))
+
+    def remove_nodes(self, ids):
+        self.put(self.writer.remove_nodes, np.array(ids))
+
+    def write(self, epoch, ids, types, x, y, bsm_x, bsm_y):
+        self.put(self.writer.write, epoch, np.array(ids), np.array(types), np.array(x), np.array(y),
+                 np.array(bsm_x), np.array(bsm_y))
+
+    # the state is taken once every call before it was handled
+    def get_state(self, ids) -> dict:
+        self.drain()
+        return self.writer.get_state(ids)
+
+    def set_state(self, state, ids, types):
+        self.drain()
+        self.writer.set_state(state, ids, types)
+
+    # handles the calls left in the queue, stops the thread and closes the writer
+    def close(self):
+
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+
+        self.writer.close()
+        self.raise_error()
+
+    def put(self, function, *args, **kwargs):
+
+        self.raise_error()
+
+        depth = self.queue.qsize()
+        self.num_calls += 1
+        self.total_depth += depth
+        self.max_depth = max(self.max_depth, depth)
+
+        try:
+            self.queue.put_nowait((function, args, kwargs))
+        except queue.Full:
+            start = time.perf_counter()
+            self.queue.put((function, args, kwargs))
+            self.num_blocked += 1
+            self.blocked_time += time.perf_counter() - start
+
+    # waits until every call in the queue was handled
+    def drain(self):
+        self.queue.join()
+        self.raise_error()
+
+    def raise_error(self):
+        if self.error is not None:
+            raise self.error
+
+    # runs on the background thread until close() puts None in the queue
+    # calls after an error are skipped, but still taken off the queue so the simulation never waits forever
+    def run(self):
+
+        while True:
+
+            call = self.queue.get()
+            if call is None:
+                self.queue.task_done()
+                return
+
+            if self.error is None:
+                function, args, kwargs = call
+                start = time.perf_counter()
+                try:
+                    function(*args, **kwargs)
+                except Exception as e:
+                    self.error = e
+                self.busy_time += time.perf_counter() - start
+
+            self.queue.task_done()
+
+    # returns: how full the queue was when calls were made and how long the simulation waited for the thread
+    def stats(self) -> dict:
+        return {
+            'calls': self.num_calls,
+            'mean_queue_depth': self.total_depth / max(self.num_calls, 1),
+            'max_queue_depth': self.max_depth,
+            'blocked_calls': self.num_blocked,
+            'blocked_seconds': self.blocked_time,
+            'writer_seconds': self.busy_time,
+        }
+
+
+# input: one array per column of RAW_DATA_COLUMNS
+# the records are sorted by node, each node's records stay in the order they were written
+# the chunk also holds the offset and number of records of each node in it
+# compression: see ColumnarRawDataWriter
+def write_chunk(path, columns, compression=None):
+
+    order = np.argsort(columns['node_id'], kind='stable')
+    columns = {name: column[order] for name, column in columns.items()}
+
+    node_ids, offsets, counts = np.unique(columns['node_id'], return_index=True, return_counts=True)
+    columns['index_node_id'] = node_ids
+    columns['index_offset'] = offsets
+    columns['index_count'] = counts
+    columns['index_type'] = columns['type'][offsets]
+    columns['index_first_epoch'] = columns['epoch'][offsets]
+
+    if compression is not None:
+        columns = encode_trajectories(columns, compression)
+
+    # written next to path and then moved over it, so a crash never leaves half a chunk
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as out_file:
+        np.savez(out_file, **columns)
+
+    os.replace(tmp_path, path)
+    remove_index(os.path.dirname(path))
+
+
+# creates the writer selected by RAW_DATA_FORMAT in the configuration file
+# with GATHER_DATA_EXTRACT_FEATURES, the features are extracted as well
+# it runs on a background thread unless RAW_DATA_WRITER_QUEUE_SIZE is 0
+# part: see ColumnarRawDataWriter
+def create_raw_data_writer(raw_data_dir, part='') -> RawDataWriter:
+
+    if conf.GATHER_DATA_EXTRACT_FEATURES and not conf.GATHER_DATA_WRITE_RAW_DATA:
+        writer = None
+    elif conf.RAW_DATA_FORMAT == conf.RAW_DATA_FORMAT_COLUMNAR:
+        writer = ColumnarRawDataWriter(raw_data_dir, part=part)
+    elif conf.RAW_DATA_FORMAT == conf.RAW_DATA_FORMAT_TRAJECTORY:
+        writer = ColumnarRawDataWriter(raw_data_dir, part=part, compression=conf.RAW_DATA_COMPRESSION)
+    else:
+        writer = CsvRawDataWriter(raw_data_dir)
+
+    if conf.GATHER_DATA_EXTRACT_FEATURES:
+        writer = FeatureRawDataWriter(raw_data_dir, tee=writer)
+
+    if conf.RAW_DATA_WRITER_QUEUE_SIZE > 0:
+        writer = ThreadedRawDataWriter(writer, conf.RAW_DATA_WRITER_QUEUE_SIZE)
+
+    return writer